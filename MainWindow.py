@@ -1,5 +1,5 @@
 import PyQt5.QtWidgets as widgets
-from PyQt5.QtCore import Qt, QSize
+from PyQt5.QtCore import Qt, QSize, QThreadPool, QTimer
 from PyQt5.QtGui import QDoubleValidator
 from PyQt5.QtCore import pyqtSignal as Signal
 import datetime as dt
@@ -8,18 +8,52 @@ import os
 from item import Item
 from searchTable import SearchTable
 from driveAccess import DriveAccess
+from driveWorker import DriveWorker
+from localDriveAccess import LocalDriveAccess
+from syncOutbox import SyncOutbox
+from syncMerge import SyncMerge
+from diagnosticsTab import DiagnosticsTab
+from importTab import ImportTab
+from orderImport import OrderImport
+from deliveryImport import DeliveryImport
+from salesAnalytics import SalesAnalytics
+from analyticsTab import AnalyticsTab
+from reorderForecast import ReorderForecast
+from reorderTab import ReorderTab
 from inputForm import InputForm
+from stockDatabase import StockDatabase
+from csvJournal import CsvJournal
+from csvCache import CsvCache
+from orderDatabase import OrderDatabase
+from operationLog import OperationLog
+from sqliteDatabase import SqliteDatabase
+import sqlite3
+from instrumentation import instruments
 
 class MainWindow(widgets.QTabWidget):
     STOCK_FILEPATH = "stock.csv" # path to the csv file containing the stock details: amounts prices descriptions etc.
     STOCK_ADDING_FILEPATH = "stock_adding.csv" # path to the csv file containing the details of the stock inputs
     ORDERS_FILEPATH = "orders.csv" # path to the csv file containing the orders: order dates, order amounts etc.
+    ORDER_LINES_FILEPATH = "order_lines.csv" # path to the csv file containing the items in each order, one line per item
     EBAY_CUT = 0.1 # proportion of the order taken by ebay
     PAYPAL_PERCENT_CUT = 0.029 # proportion of the order taken by paypal
     PAYPAL_PER_ORDER_ABSOLUTE_CUT = 0.3 # absolute amount in gbp taken by paypal per order
     EBAY_INTERNATIONAL_PROGRAMME_POSTCODES = ["WS13 8UR", "WS138UR"] # Postcodes of the ebay international programme address
     POSTAGE_COST = 0.88 # default absolute gbp cost of postage per order
     PACKING_COST = 0.09 # default absolute gbp cost of packing per order
+    USE_SQLITE = False # keep the databases in a sqlite file, the csv files above are then only written for google drive
+    SQLITE_FILEPATH = "stock_control.db" # path to the sqlite database file, imported from the csv files if empty
+    OPERATIONS_FILEPATH = "operations.log" # path to the log of the orders and stock adds committed, for undo and redo
+    OUTBOX_FILEPATH = "outbox.json" # path to the list of files with changes still to upload to google drive
+    DRIVE_FOLDER = None # keep the drive copies of the files in this local folder instead of google drive, e.g. for testing without a network
+    SYNC_INTERVAL = 30 # seconds between background syncs with google drive, uploading the changed files and merging in changes from other computers
+    SYNC_MAX_INTERVAL = 600 # longest wait in seconds between retries when google drive can't be reached
+    MAX_CONFLICTS_SHOWN = 20 # merge conflicts listed in the message box, the rest are counted
+    DIAGNOSTICS_LOG_FILEPATH = "diagnostics.log" # path to the rotating log of how long each slot, drive call and file read or write took
+    SHOW_DIAGNOSTICS = False # add a tab showing the recent latencies, file sizes and memory use
+    REORDER_THRESHOLDS_FILEPATH = "reorder_thresholds.csv" # path to the optional csv file of reorder thresholds for items (item_id and threshold columns) or categories (category and threshold columns)
+    CSV_CACHE_FOLDER = "csv_cache" # folder of binary copies of the parsed csv files, so they're only parsed again when they change
+    SKU_MAP_FILEPATH = "sku_map.csv" # path to the optional csv file of the ebay custom labels (sku column) which aren't the item_id they sell (item_id column)
     
     ###
     TEST = False
@@ -32,10 +66,54 @@ class MainWindow(widgets.QTabWidget):
         """
         super().__init__()
 
-        #init the drive file access and pull down the files
-        if not self.TEST:
-            self.da = DriveAccess()
-            self.ask_pull()
+        #timings of the hot paths, see instrumentation.py
+        instruments.start_log(self.DIAGNOSTICS_LOG_FILEPATH)
+
+        #parsed csv files are cached locally, the csv files stay the format kept in google drive
+        self.csv_cache = CsvCache(self.CSV_CACHE_FOLDER)
+        
+        #orders are stored as headers and order lines, appended to the end of their files rather than rewriting them
+        self.order_db = OrderDatabase(self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.csv_cache)
+        self.order_db.migrate()
+
+        #optional sqlite database for transactional commits
+        self.sqlite_db = None
+        if self.USE_SQLITE:
+            self.sqlite_db = SqliteDatabase(self.SQLITE_FILEPATH)
+            if self.sqlite_db.is_empty():
+                self.sqlite_db.import_csv(self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.STOCK_ADDING_FILEPATH)
+
+        #shared in-memory stock database, only re-read when the file changes
+        self.stock_db = StockDatabase(self.STOCK_FILEPATH, self.sqlite_db, self.REORDER_THRESHOLDS_FILEPATH, self.csv_cache)
+        self.stock_db.invalid_stock_found.connect(self.show_invalid_stock_message)
+
+        #stock adds are appended to the end of their file rather than rewriting it
+        self.stock_adding_journal = CsvJournal(self.STOCK_ADDING_FILEPATH, ('date', 'time'))
+
+        #log of the commits for any number of undos and redos
+        self.operation_log = OperationLog(self.OPERATIONS_FILEPATH)
+        
+        #profit totals of the orders, kept up to date with each commit and undo
+        self.analytics = SalesAnalytics(self.read_orders, self.get_postpack_amount())
+        #sales velocity and reorder suggestions, also kept up to date with each commit and undo
+        self.forecast = ReorderForecast(self.read_orders, self.read_stock_adding)
+
+        #google drive is connected to in the background once the window is up, see self.start_drive_sync()
+        self.da = None
+        self.drive_thread_pool = QThreadPool()
+        self.drive_thread_pool.setMaxThreadCount(1)
+        self.drive_worker = None
+        self.pull_files = []
+        self.drive_checked = False # True once the local files have been compared with drive and any pull done
+        
+        #files with changes to upload, drained to drive in the background by self.background_sync() every self.sync_interval seconds
+        self.outbox = SyncOutbox(self.OUTBOX_FILEPATH)
+        #merges the drive changes made by other computers with the local changes
+        self.sync_merge = SyncMerge()
+        self.sync_interval = self.SYNC_INTERVAL
+        self.sync_timer = QTimer()
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.timeout.connect(self.background_sync)
 
         #if the order is international, we don't set the paypal default
         self.international_order = False
@@ -45,14 +123,14 @@ class MainWindow(widgets.QTabWidget):
         
         #Create the stock searching table
         #@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
-        searchWidget = SearchTable(self.STOCK_FILEPATH)
+        searchWidget = SearchTable(self.stock_db)
         searchWidget.save_error.connect(self.show_save_failed_message)
         self.addTab(searchWidget, "Search stock")
         #@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
     
         #create the order adding form
         #@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
-        self.orderWidget = InputForm(self.STOCK_FILEPATH, False)
+        self.orderWidget = InputForm(self.stock_db, False)
         # self.orderLayout = widgets.QVBoxLayout()
         # orderWidget.setLayout(self.orderLayout)
 
@@ -64,6 +142,7 @@ class MainWindow(widgets.QTabWidget):
         # undo_button.setFocusPolicy(Qt.ClickFocus)
         # self.orderLayout.addWidget(undo_button)
         self.orderWidget.undo_signal.connect(self.undo_last_order)
+        self.orderWidget.redo_signal.connect(self.redo_last_order)
 
         #Add the order adding form
         top_form = self.create_top_order_form()      
@@ -93,7 +172,7 @@ class MainWindow(widgets.QTabWidget):
         
         #create the stock adding form
         #@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
-        self.stockWidget = InputForm(self.STOCK_FILEPATH, True)
+        self.stockWidget = InputForm(self.stock_db, True)
         # self.stockLayout = widgets.QVBoxLayout()
         # stockWidget.setLayout(self.stockLayout)
         
@@ -105,6 +184,7 @@ class MainWindow(widgets.QTabWidget):
         # stock_undo_button.setFocusPolicy(Qt.ClickFocus)
         # self.stockLayout.addWidget(stock_undo_button)
         self.stockWidget.undo_signal.connect(self.undo_last_stock_add)
+        self.stockWidget.redo_signal.connect(self.redo_last_stock_add)
         
         #Add an item object
         # self.stockItemLayout = widgets.QVBoxLayout()
@@ -127,31 +207,266 @@ class MainWindow(widgets.QTabWidget):
         self.stockWidget.commit_signal.connect(self.stock_done)
         #@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
         
-    def ask_pull(self):
+        #create the ebay orders report importing tab
+        #@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
+        self.order_import = OrderImport(self.SKU_MAP_FILEPATH)
+        self.order_report = None # report opened and not imported yet
+        self.orderImportWidget = ImportTab("Import the orders in an ebay orders report, downloaded as a csv file from seller hub. "
+                                           "Each custom label (SKU) is taken as the item id, unless it is listed in {}. "
+                                           "Orders with a line that can't be imported are left out and listed below.".format(self.SKU_MAP_FILEPATH), "Import orders")
+        self.orderImportWidget.file_signal.connect(self.open_order_report)
+        self.orderImportWidget.commit_signal.connect(self.import_orders_done)
+        self.addTab(self.orderImportWidget, "Import orders")
+        #@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
+        
+        #create the supplier delivery importing tab
+        #@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
+        self.delivery_import = DeliveryImport()
+        self.delivery = None # delivery opened and not added yet
+        self.deliveryImportWidget = ImportTab("Add the stock of a supplier delivery from a csv file with item_id and quantity columns, "
+                                              "and manufacturer, category and description columns for any new items. "
+                                              "The change to each item is shown below before the stock is added, as a single stock add.", "Add stock")
+        self.deliveryImportWidget.file_signal.connect(self.open_delivery)
+        self.deliveryImportWidget.commit_signal.connect(self.delivery_done)
+        self.addTab(self.deliveryImportWidget, "Import delivery")
+        #@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
+        
+        #sales and profit analytics
+        self.addTab(AnalyticsTab(self.analytics), "Sales")
+        
+        #reorder suggestions from the sales velocity
+        reorderWidget = ReorderTab(self.forecast, self.stock_db)
+        reorderWidget.save_error.connect(self.show_save_failed_message)
+        self.addTab(reorderWidget, "Reorder")
+        
+        #optional diagnostics
+        if self.SHOW_DIAGNOSTICS:
+            self.addTab(DiagnosticsTab([self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.STOCK_ADDING_FILEPATH, self.DIAGNOSTICS_LOG_FILEPATH]), "Diagnostics")
+        
+        #google drive sync status, in the corner of the tab bar
+        self.sync_label = widgets.QLabel()
+        self.setCornerWidget(self.sync_label, Qt.TopRightCorner)
+        
+        #init the drive file access and pull down the files
+        if self.DRIVE_FOLDER is not None:
+            self.da = LocalDriveAccess(self.DRIVE_FOLDER)
+        elif not self.TEST:
+            self.da = DriveAccess()
+        if self.da is not None:
+            self.da.progress_signal.connect(self.show_transfer_progress)
+            self.start_drive_sync()
+        
+    def set_sync_status(self, status):
         """
-        Ask if the user wants to keep the local or remote file in a message window
+        Show the google drive sync status in the corner of the window
         """
-        mod_times = pd.DataFrame()
-        for filename in [self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.STOCK_ADDING_FILEPATH]:
-            local_mod_time = os.path.getmtime(filename)
-            local_mod_time = dt.datetime.fromtimestamp(local_mod_time)
-            
-            exists = self.da.getID(filename)
-            if exists:
-                remote_mod_time = self.da.file_mod_times[filename]
+        print(status)
+        self.sync_label.setText(status + "  ")
+        
+    def run_drive_task(self, task, finished, *args, failed=None):
+        """
+        Run a google drive task on the drive thread, leaving the window free
+        
+        Arguments:
+            task: function to run
+            finished: function, called in the GUI thread with the value returned by the task
+            args: arguments to the task
+            failed: function, called in the GUI thread with the exception if the task fails, self.drive_task_failed() if None
+        """
+        self.drive_worker = DriveWorker(task, *args)
+        self.drive_worker.signals.finished.connect(finished)
+        self.drive_worker.signals.failed.connect(self.drive_task_failed if failed is None else failed)
+        self.drive_thread_pool.start(self.drive_worker)
+        
+    def is_drive_busy(self):
+        return self.drive_thread_pool.activeThreadCount() > 0
+        
+    def start_drive_sync(self):
+        """
+        Log in to google drive and compare the local files with their drive copies in the background, then ask about pulling them
+        """
+        self.set_sync_status("Connecting to google drive...")
+        self.run_drive_task(self.check_drive, self.ask_pull, failed=self.sync_failed)
+        
+    def check_drive(self):
+        """
+        Runs on the drive thread
+        
+        Returns:
+            pd.DataFrame, the comparison of the local files with their drive copies from DriveAccess.compare_fileGroup()
+        """
+        if not self.da.is_connected():
+            self.da.connect()
+        
+        return self.da.compare_fileGroup([self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.STOCK_ADDING_FILEPATH])
+        
+    def drive_task_failed(self, error):
+        """
+        Show a message box when logging in to or syncing with google drive fails, the local files are used as they are
+        
+        SLOT connected to self.drive_worker.signals.failed SIGNAL in self.run_drive_task()
+        """
+        self.set_sync_status("Google drive sync failed")
+        self.set_forms_enabled(True)
+        
+        msg = widgets.QMessageBox()
+        msg.setIcon(widgets.QMessageBox.Warning)
+        msg.setText("Google drive sync failed")
+        msg.setInformativeText("Could not connect to google drive, the local files are being used.")
+        msg.setDetailedText("{}".format(error))
+        msg.setWindowTitle("Sync failed")
+        msg.setStandardButtons(widgets.QMessageBox.Ok)
+        msg.exec_()
+        
+    def schedule_sync(self):
+        """
+        Run self.background_sync() after self.sync_interval seconds
+        """
+        self.sync_timer.start(int(self.sync_interval*1000))
+        
+    def background_sync(self):
+        """
+        Upload the files in the outbox to drive and bring in any changes made by other computers,
+        or if drive hasn't been checked yet, e.g. it couldn't be reached at startup, check it first
+        
+        SLOT connected to self.sync_timer.timeout SIGNAL in self.__init__()
+        """
+        if self.is_drive_busy():
+            self.schedule_sync()
+        elif not self.drive_checked:
+            self.start_drive_sync()
+        else:
+            pending = self.outbox.get_pending()
+            if pending:
+                self.set_sync_status("Uploading to google drive...")
+            self.run_drive_task(self.upload_outbox, self.upload_done, pending, failed=self.sync_failed)
             
-                mod_times = mod_times.append({'local':local_mod_time, 'remote':remote_mod_time, 'filename':filename}, ignore_index=True)
-            else:
-                mod_times = mod_times.append({'local':local_mod_time, 'remote':None, 'filename':filename}, ignore_index=True)
+    def upload_outbox(self, pending):
+        """
+        Runs on the drive thread
+        
+        Arguments:
+            pending: dict, filename: version from SyncOutbox.get_pending()
+        
+        Returns:
+            tuple, (the pending files; dict, filename: pd.DataFrame of any files changed in drive by another computer, pulled instead of pushed to be merged first;
+                    dict, filename: exception for each file that failed)
+        """
+        if not self.da.is_connected():
+            self.da.connect()
+        
+        #write the sqlite database out to the csv files for drive
+        if self.sqlite_db is not None:
+            self.sqlite_db.export_csv(self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.STOCK_ADDING_FILEPATH)
+        
+        #the changes made by other computers are pulled to be merged first, pushing would overwrite them
+        files = [self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.STOCK_ADDING_FILEPATH]
+        found = self.da.getID_fileGroup(files)
+        remote_changed = [filename for filename in files if found[filename] and self.da.is_remote_changed(filename)]
+        if remote_changed:
+            frames, errors = self.da.pull_fileGroup(remote_changed)
+            return pending, {filename:frame for filename, frame in zip(remote_changed, frames) if frame is not None}, errors
+        
+        if not pending:
+            return pending, {}, {}
+        return pending, {}, self.da.push_fileGroup(list(pending))
+        
+    def upload_done(self, result):
+        """
+        Clear the uploaded files from the outbox, or merge the files pulled instead
+        
+        SLOT connected to self.drive_worker.signals.finished SIGNAL in self.background_sync()
+        """
+        pending, pulled, errors = result
+        if pulled:
+            #merge the other computer's changes in then upload straight away
+            self.set_sync_status("Merging the changes from google drive...")
+            self.apply_pulled(pulled, errors)
+            self.sync_timer.start(0)
+            return
+        
+        self.outbox.remove({filename:version for filename, version in pending.items() if filename not in errors})
+        if errors:
+            self.sync_failed(list(errors.values())[0])
+            return
+        
+        self.sync_interval = self.SYNC_INTERVAL
+        self.set_sync_status("Up to date with google drive")
+        self.schedule_sync()
+        
+    def sync_failed(self, error):
+        """
+        Back off and try again later when drive can't be reached in the background, the program carries on with the local files
+        
+        SLOT connected to self.drive_worker.signals.failed SIGNAL in self.start_drive_sync() and self.background_sync()
+        """
+        print("Google drive sync failed: {}".format(error))
+        self.sync_interval = min(2*self.sync_interval, self.SYNC_MAX_INTERVAL)
+        self.set_sync_status("Offline, {0} files to upload, retrying in {1:.0f}s".format(len(self.outbox), self.sync_interval))
+        self.set_forms_enabled(True)
+        self.schedule_sync()
+        
+    def add_to_outbox(self, kind):
+        """
+        Queue the files changed by an order or stock add to be uploaded to drive by the background sync
+        
+        Arguments:
+            kind: str, 'order' or 'stock_add'
+        """
+        if kind == 'order':
+            self.outbox.add([self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH])
+        else:
+            self.outbox.add([self.STOCK_FILEPATH, self.STOCK_ADDING_FILEPATH])
+        
+    def set_forms_enabled(self, enabled):
+        """
+        Stop orders and stock adds being made while the files are being replaced by a pull
+        """
+        self.orderWidget.setEnabled(enabled)
+        self.stockWidget.setEnabled(enabled)
+        
+    def ask_pull(self, comparison):
+        """
+        Ask if the user wants to keep the local or remote file in a message window
+        Only the files whose contents differ from their google drive copies are offered, if none differ nothing is asked
         
-        mod_times.remote = pd.to_datetime(mod_times.remote, errors='coerce')
+        SLOT connected to self.drive_worker.signals.finished SIGNAL in self.start_drive_sync()
+        
+        Arguments:
+            comparison: pd.DataFrame, from DriveAccess.compare_fileGroup()
+        """
+        instruments.count('drive_files_changed', int(comparison.changed.sum()))
+        self.drive_checked = True
+        self.sync_interval = self.SYNC_INTERVAL
+        
+        #files that can be pulled: in drive and different to the local copy, and changed by another computer since the last sync
+        #the files only changed here are left to be uploaded
+        changed = comparison.index[comparison.changed & comparison.remote.notna()]
+        self.pull_files = [filename for filename in changed if self.da.get_base(filename) is None or self.da.is_remote_changed(filename)]
+        self.outbox.add([filename for filename in changed if filename not in self.pull_files])
+        if not self.pull_files:
+            self.set_sync_status("Up to date with google drive")
+            self.schedule_sync()
+            return
+        self.set_sync_status("Local files differ from google drive")
+        
+        details = []
+        for filename in self.pull_files:
+            local_time, remote_time, newer = comparison.loc[filename, ['local', 'remote', 'newer']]
+            if pd.isna(local_time):
+                details.append("{}: only in google drive".format(filename))
+            else:
+                details.append("{0}: {1} copy is newer by {2}".format(filename, "google drive" if newer == 'remote' else "local", abs(remote_time - local_time).floor('s')))
         
-        print(mod_times)
+        #files without a copy from the last sync can't be merged
+        for filename in self.pull_files:
+            if self.da.get_base(filename) is None and os.path.exists(filename):
+                details.append("{} can't be merged as it hasn't been synced from this computer before, the local file will be overwritten".format(filename))
         
         msg = widgets.QMessageBox()
         msg.setIcon(widgets.QMessageBox.Question)
         msg.setText("Would you like to download the database files from google drive?")
-        msg.setInformativeText("Clicking 'yes' will download the database files from google drive and overwrite the local files. Clicking 'no' will keep the local files.")
+        msg.setInformativeText("These files have been changed in google drive:\n{}\n\nClicking 'yes' will download them from google drive and merge in the orders and stock adds made on other computers. Clicking 'no' will keep the local files.".format("\n".join(details)))
         msg.setWindowTitle("Download")
         msg.setStandardButtons(widgets.QMessageBox.Yes | widgets.QMessageBox.No)
         msg.buttonClicked.connect(self.remote_pull)
@@ -159,32 +474,148 @@ class MainWindow(widgets.QTabWidget):
     
     def remote_pull(self, buttonPressed):
         """
-        If the user agrees to downloading the remote files, get the files and overwrite the local ones.
+        If the user agrees to downloading the remote files, get the files that differ in the background
+        The forms are disabled until the local files have been overwritten in self.pull_done()
         SLOT connected to msg.buttonClicked() SIGNAL in self.ask_pull()
         
         Arguments:
             buttonPressed: the button pressed in the download question message box
         """
-        if buttonPressed.text() == "&Yes":       
-            stock, orders, stock_adding = self.da.pull_fileGroup([self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.STOCK_ADDING_FILEPATH])
-            stock = stock.set_index('item_id')
-            try:
-                stock.to_csv(self.STOCK_FILEPATH)
-            except PermissionError as err:
-                self.show_save_failed_message('stock database', err)
-                
-            orders = orders.set_index('postcode')
-            try:
-                orders.to_csv(self.ORDERS_FILEPATH)
-            except PermissionError as err:
-                self.show_save_failed_message('order database', err)
-
-            stock_adding = stock_adding.set_index(['date', 'time'])
+        if buttonPressed.text() == "&Yes":
+            self.set_forms_enabled(False)
+            self.set_sync_status("Downloading from google drive...")
+            self.run_drive_task(self.da.pull_fileGroup, self.pull_done, self.pull_files)
+        else:
+            self.set_sync_status("Using the local files")
+            self.schedule_sync()
+            
+    def pull_done(self, result):
+        """
+        Merge the pulled files into the local files, or overwrite them
+        
+        SLOT connected to self.drive_worker.signals.finished SIGNAL in self.remote_pull()
+        
+        Arguments:
+            result: tuple, (list of pd.DataFrames, dict of errors) from DriveAccess.pull_fileGroup()
+        """
+        frames, errors = result
+        frames = {filename:frame for filename, frame in zip(self.pull_files, frames) if frame is not None}
+        
+        for filename, err in errors.items():
+            self.show_transfer_failed_message(filename, err)
+        
+        self.apply_pulled(frames, errors)
+        
+        self.set_forms_enabled(True)
+        self.set_sync_status("Google drive download failed" if errors else "Up to date with google drive")
+        self.schedule_sync()
+        
+        
+    @instruments.timed('merge_pulled')
+    def apply_pulled(self, frames, errors):
+        """
+        Bring the drive changes into the local files
+        A file changed both here and in drive is merged with the copy from the last sync as the base, otherwise the local file is overwritten
+        The orders and order lines are merged together, any conflicts are shown to the user
+        
+        Arguments:
+            frames: dict, filename: pd.DataFrame pulled from drive, every column as text
+            errors: dict, filename: exception for each file that failed to pull
+        """
+        #only replace the orders if the order lines to go with them weren't lost, drive may still have the old wide orders file without order lines
+        if self.ORDERS_FILEPATH in errors or self.ORDER_LINES_FILEPATH in errors:
+            frames.pop(self.ORDERS_FILEPATH, None)
+            frames.pop(self.ORDER_LINES_FILEPATH, None)
+        
+        #the csv files have to be up to date to merge into
+        if self.sqlite_db is not None:
+            self.sqlite_db.export_csv(self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.STOCK_ADDING_FILEPATH)
+        
+        conflicts = []
+        for files, name in [([self.STOCK_FILEPATH], 'stock database'), ([self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH], 'order database'), ([self.STOCK_ADDING_FILEPATH], 'stock input database')]:
+            if not any(filename in frames for filename in files):
+                continue
             try:
-                stock_adding.to_csv(self.STOCK_ADDING_FILEPATH)
+                conflicts += self.merge_files(files, frames)
             except PermissionError as err:
-                self.show_save_failed_message('stock input database', err)
+                self.show_save_failed_message(name, err)
+        self.stock_db.invalidate()
+        self.order_db.migrate()
+        
+        if self.sqlite_db is not None:
+            self.sqlite_db.import_csv(self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.STOCK_ADDING_FILEPATH)
+        
+        #the logged commits were made to the replaced files
+        self.operation_log.clear()
+        self.analytics.invalidate()
+        self.forecast.invalidate()
+        
+        if conflicts:
+            self.show_merge_conflicts_message(conflicts)
+        
+    def merge_files(self, files, frames):
+        """
+        Merge or overwrite one database with its pulled drive copy, see self.apply_pulled()
+        
+        Arguments:
+            files: list of str, the files of the database, e.g. the orders and order lines
+            frames: dict, filename: pd.DataFrame pulled from drive, files of the database not pulled are unchanged in drive
+        
+        Returns:
+            list of str, the conflicts found
+        """
+        bases = {filename:self.da.get_base(filename) for filename in files}
+        local = {}
+        for filename in files:
+            local[filename] = pd.read_csv(filename, dtype=str, keep_default_na=False) if os.path.exists(filename) else None
+        remote = {filename:frames.get(filename, bases[filename]) for filename in files}
+        
+        #nothing to merge if only drive has changed, and old wide orders or files without a copy from the last sync can't be merged
+        sides = list(bases.values()) + list(local.values()) + list(remote.values())
+        mergeable = all(frame is not None for frame in sides) and not any(self.order_db.WIDE_ITEM_PATTERN.match(col) for frame in sides if frame is not None for col in frame.columns)
+        if not mergeable or not any(self.da.is_local_changed(filename) for filename in files):
+            for filename in files:
+                if filename in frames:
+                    frames[filename].to_csv(filename, index=False)
+                    self.da.mark_synced(filename)
+            return []
+        
+        if files == [self.STOCK_FILEPATH]:
+            stock, conflicts = self.sync_merge.merge_stock(bases[self.STOCK_FILEPATH], local[self.STOCK_FILEPATH], remote[self.STOCK_FILEPATH])
+            stock.to_csv(self.STOCK_FILEPATH, index=False)
+        elif files == [self.STOCK_ADDING_FILEPATH]:
+            stock_adding = self.sync_merge.merge_rows(bases[self.STOCK_ADDING_FILEPATH], local[self.STOCK_ADDING_FILEPATH], remote[self.STOCK_ADDING_FILEPATH])
+            stock_adding.to_csv(self.STOCK_ADDING_FILEPATH, index=False)
+            conflicts = []
+        else:
+            headers, lines, conflicts = self.sync_merge.merge_orders(*[(side[self.ORDERS_FILEPATH], side[self.ORDER_LINES_FILEPATH]) for side in (bases, local, remote)])
+            self.order_db.write(headers, lines)
+        
+        #drive now matches the base, and the merged files have to be uploaded
+        for filename in files:
+            if filename in frames:
+                self.da.set_base(filename, frames[filename])
+        self.outbox.add(files)
+        print('Merged {0} with google drive, {1} conflicts'.format(", ".join(files), len(conflicts)))
+        
+        return conflicts
+        
+    def show_merge_conflicts_message(self, conflicts):
+        """
+        Arguments:
+            conflicts: list of str, from the SyncMerge merges
+        """
+        shown = conflicts[:self.MAX_CONFLICTS_SHOWN]
+        if len(conflicts) > len(shown):
+            shown.append("...and {} more".format(len(conflicts) - len(shown)))
         
+        msg = widgets.QMessageBox()
+        msg.setIcon(widgets.QMessageBox.Warning)
+        msg.setText("Merge conflicts")
+        msg.setInformativeText("Changes made on this computer and another computer to the same records couldn't both be kept, please check these:\n{}".format("\n".join(shown)))
+        msg.setWindowTitle("Merge conflicts")
+        msg.setStandardButtons(widgets.QMessageBox.Ok)
+        msg.exec_()
         
     def closeEvent(self, event):
         """
@@ -199,21 +630,77 @@ class MainWindow(widgets.QTabWidget):
         msg = widgets.QMessageBox()
         msg.setIcon(widgets.QMessageBox.Question)
         msg.setText("Save to Drive?")
-        msg.setInformativeText("Clicking 'yes' will upload the changes to the databases to google drive.")
+        msg.setInformativeText("Clicking 'yes' will upload the changes to the databases to google drive now. Clicking 'no' keeps any changes not yet uploaded to upload next time.")
         msg.setWindowTitle("Upload")
         msg.setStandardButtons(widgets.QMessageBox.Yes | widgets.QMessageBox.No)
         msg.buttonClicked.connect(self.closing_actions)
         msg.exec_()
         
     def closing_actions(self, buttonPressed):
-        if buttonPressed.text() == "&Yes":
+        if buttonPressed.text() == "&Yes" and self.da is not None:
+            #can't upload while still logging in or downloading
+            if self.is_drive_busy():
+                self.show_drive_busy_message()
+                return
+            self.sync_timer.stop()
+            
+            self.set_sync_status("Uploading to google drive...")
             widgets.QApplication.setOverrideCursor(Qt.WaitCursor)
-            for filename in [self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.STOCK_ADDING_FILEPATH]:
-                file_exists = self.da.getID(filename)
-                self.da.push(filename, new=not file_exists)
+            pending = self.outbox.get_pending()
+            try:
+                if not self.da.is_connected():
+                    self.da.connect()
+                #write the sqlite database out to the csv files for drive
+                if self.sqlite_db is not None:
+                    self.sqlite_db.export_csv(self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.STOCK_ADDING_FILEPATH)
+                errors = self.da.push_fileGroup([self.STOCK_FILEPATH, self.ORDERS_FILEPATH, self.ORDER_LINES_FILEPATH, self.STOCK_ADDING_FILEPATH])
+                self.outbox.remove({filename:version for filename, version in pending.items() if filename not in errors})
+            except Exception as err: # drive can't be reached, the changes stay in the outbox
+                errors = {"The database files":err}
             widgets.QApplication.restoreOverrideCursor()
+            for filename, err in errors.items():
+                self.show_transfer_failed_message(filename, err)
+        #so the next start doesn't parse the stock file saved by this session
+        self.stock_db.store_cache()
         self.window_quit_signal.emit()
         
+    def show_drive_busy_message(self):
+        """
+        Show a message box when closing while google drive is still being synced
+        """
+        msg = widgets.QMessageBox()
+        msg.setIcon(widgets.QMessageBox.Information)
+        msg.setText("Still syncing")
+        msg.setInformativeText("The files are still being synced with google drive, try closing again once it has finished.")
+        msg.setWindowTitle("Still syncing")
+        msg.setStandardButtons(widgets.QMessageBox.Ok)
+        msg.exec_()
+        
+    def show_transfer_progress(self, percent):
+        """
+        Show the progress of a google drive transfer
+        
+        SLOT connected to self.da.progress_signal SIGNAL in self.__init__()
+        """
+        self.set_sync_status("Syncing with google drive {:.0f}%".format(percent))
+        
+    def show_transfer_failed_message(self, filename, error):
+        """
+        Show a message box when a file couldn't be transferred to or from google drive, the local file is left as it was
+        
+        Arguments:
+            filename: str, the file that failed
+            error: the exception raised by the transfer
+        """
+        msg = widgets.QMessageBox()
+        msg.setIcon(widgets.QMessageBox.Warning)
+        msg.setText("Transfer failed")
+        msg.setInformativeText("{} could not be transferred to or from google drive, the local file has been left as it was. Any changes not uploaded will be uploaded next time.".format(filename))
+        msg.setDetailedText("{}".format(error))
+        msg.setWindowTitle("Transfer failed")
+        msg.setStandardButtons(widgets.QMessageBox.Ok)
+        msg.exec_()
+        
     def create_top_order_form(self):
         """
         Create the QFormLayout object containing the static form entries at the top
@@ -307,15 +794,42 @@ class MainWindow(widgets.QTabWidget):
         except ValueError:#no value
             order_amount = 0
         
+        outlays = self.get_outlays(pd.Series([order_amount]), pd.Series([self.international_order])).iloc[0]
+        
         #set the ebay cut
-        ebay_cut = order_amount * self.EBAY_CUT
-        self.ebayCutEdit.setText('{:.2f}'.format(ebay_cut))
+        self.ebayCutEdit.setText('{:.2f}'.format(outlays.loc['ebay_amount']))
         
         #set the default paypal cut
         if not self.international_order:
-            paypal_cut = order_amount * self.PAYPAL_PERCENT_CUT + self.PAYPAL_PER_ORDER_ABSOLUTE_CUT
-            self.paypalCutEdit.setText('{:.2f}'.format(paypal_cut))
+            self.paypalCutEdit.setText('{:.2f}'.format(outlays.loc['paypal_amount']))
+            
+    def get_outlays(self, order_amounts, international):
+        """
+        Default cuts taken by Ebay and Paypal and the postage and packing cost of orders, the same rules for the order form and imported orders
+        
+        Arguments:
+            order_amounts: pd.Series of float, the order amounts in gbp
+            international: pd.Series of bool, True for orders to the ebay international programme address, which don't get a paypal cut set
+        
+        Returns:
+            pd.DataFrame with the index of order_amounts and the ebay_amount, paypal_amount and postpack_amount columns in gbp rounded to the penny,
+            the paypal_amount is nan for the international orders
+        """
+        outlays = pd.DataFrame(index=order_amounts.index)
+        outlays['ebay_amount'] = (order_amounts * self.EBAY_CUT).round(2)
+        paypal_amounts = (order_amounts * self.PAYPAL_PERCENT_CUT + self.PAYPAL_PER_ORDER_ABSOLUTE_CUT).round(2)
+        outlays['paypal_amount'] = paypal_amounts.where(~international.values)
+        outlays['postpack_amount'] = self.get_postpack_amount()
         
+        return outlays
+        
+    def get_postpack_amount(self):
+        """
+        Returns:
+            float, the default postage and packing cost of an order in gbp rounded to the penny, for the order form, imported orders and
+            the sales analytics of orders saved without one
+        """
+        return round(self.POSTAGE_COST + self.PACKING_COST, 2)
         
     # def get_order_item(self, edit_num, item_id):
         # """
@@ -363,12 +877,10 @@ class MainWindow(widgets.QTabWidget):
             # self.stockItemLayout.addWidget(self.stockItems[-1].widget)
         
     def load_stock_database(self):
-        stock = pd.read_csv(self.STOCK_FILEPATH)
-        stock.item_id = stock.item_id.astype(str)
-        stock.item_id = stock.item_id.apply(str.upper)
-        stock = stock.set_index('item_id')
-        
-        return stock
+        """
+        Get a copy of the shared stock database to make changes to before saving with self.stock_db.save()
+        """
+        return self.stock_db.load().copy()
             
     # def get_item_from_df(self, item_ID):
         # """
@@ -407,14 +919,18 @@ class MainWindow(widgets.QTabWidget):
         # msg.exec_()
         
     
+    @instruments.timed('order_done')
     def order_done(self):
         """
         Load the stock file
-        Create a new order dict with all the details to save to the orders file
+        Create a new order header and order lines with all the details to save to the orders files
         Reduce the stock of the ordered items and re-save to the stock file
         
         SLOT connected to commit_button.clicked() SIGNAL in __init__()
         """
+        if not self.check_stock_valid():
+            return
+        
         stock = self.load_stock_database()
         
         #check the order is valid
@@ -455,77 +971,56 @@ class MainWindow(widgets.QTabWidget):
         
         
         if order_ok:
-            #create the new order object
-            order = {
+            #create the new order header
+            order_id = self.get_next_order_id()
+            #amounts as numbers rounded to the penny rather than the text typed, None if left empty
+            header = {
+                    'order_id':order_id,
                     'date':self.dateEdit.text(),
                     'postcode':self.postcodeEdit.text(),
-                    'order_amount':self.orderAmountEdit.text(),
-                    'ebay_amount':self.ebayCutEdit.text(),
-                    'paypal_amount':self.paypalCutEdit.text()
-                    # 'postpack_amount':self.ppEdit.text()
+                    'order_amount':self.order_db.schema.parse_pounds(self.orderAmountEdit.text()),
+                    'ebay_amount':self.order_db.schema.parse_pounds(self.ebayCutEdit.text()),
+                    'paypal_amount':self.order_db.schema.parse_pounds(self.paypalCutEdit.text()),
+                    'postpack_amount':self.get_postpack_amount()
                     }
                     
+            lines = []
+            stock_changes = {} # item_id: change in stock
             i = 1 # item number in order
             for item in self.orderWidget.items:
                 if item.item_id != item.NO_ITEM:#item ID has been input
                     # deduct the quantity from the stock line
                     quantity = int(item.quantityEdit.text())
                     stock.loc[item.item_id, 'stock'] -= quantity
+                    stock_changes[item.item_id] = stock_changes.get(item.item_id, 0) - quantity
 
-                    #add the items to the order dict
-                    order['item{}_id'.format(i)] = item.item_id
-                    order['item{}_quantity'.format(i)] = quantity
-                    order['item{}_manufacturer'.format(i)] = item.item.loc['manufacturer']
-                    order['item{}_category'.format(i)] = item.item.loc['category']
-                    order['item{}_description'.format(i)] = item.item.loc['description']
+                    #add an order line for the item
+                    lines.append({
+                            'order_id':order_id,
+                            'item_num':i,
+                            'item_id':item.item_id,
+                            'quantity':quantity,
+                            'manufacturer':item.item.loc['manufacturer'],
+                            'category':item.item.loc['category'],
+                            'description':item.item.loc['description']
+                            })
                     
                     i+=1
 
-            print(order)
-
-            #load the order saving file and append the new order
-            saved_orders = pd.read_csv(self.ORDERS_FILEPATH)
-            saved_orders = saved_orders.append(order, ignore_index=True)
-            saved_orders = saved_orders.set_index('postcode')
-
-            ###
-            # print(saved_orders)
-            ###
-
-            #save the orders file
-            try:
-                saved_orders.to_csv(self.ORDERS_FILEPATH)
-            except PermissionError as err:
-                self.show_save_failed_message('orders database', err)
-                order_ok = False
-                  
-            ####
-            # print(stock)
-            ####
-            
-            #save the new stock database to file if everything above is ok
-            if order_ok:
-                try:
-                    stock.to_csv(self.STOCK_FILEPATH)
-                except PermissionError as err:
-                    #remove the last order and resave
-                    saved_orders = saved_orders[:-1]
-                    saved_orders.to_csv(self.ORDERS_FILEPATH)
-                
-                    self.show_save_failed_message('stock database', err)
-                    order_ok = False
+            order_ok = self.save_orders([header], lines, stock, stock_changes)
                 
-                #Message box pop-up asking if you want to do another order
-                if order_ok:
-                    msg = widgets.QMessageBox()
-                    msg.setIcon(widgets.QMessageBox.Question)
-                    msg.setText("Success!")
-                    msg.setInformativeText("The order has been added and the stock has been deducted from the database. \n\nAdd another?")
-                    msg.setWindowTitle("Order added")
-                    msg.setStandardButtons(widgets.QMessageBox.Yes | widgets.QMessageBox.No)
-                    msg.setEscapeButton(widgets.QMessageBox.No)
-                    msg.buttonClicked.connect(self.new_order)
-                    msg.exec_()
+            #Message box pop-up asking if you want to do another order
+            if order_ok:
+                instruments.count('order_lines_committed', len(lines))
+                msg = widgets.QMessageBox()
+                msg.setIcon(widgets.QMessageBox.Question)
+                msg.setText("Success!")
+                msg.setInformativeText("The order has been added and the stock has been deducted from the database. \n\nAdd another?")
+                msg.setWindowTitle("Order added")
+                msg.setStandardButtons(widgets.QMessageBox.Yes | widgets.QMessageBox.No)
+                msg.setEscapeButton(widgets.QMessageBox.No)
+                msg.buttonClicked.connect(self.new_order)
+                msg.exec_()
         else:
             #Message box pop-up asking if you want to do another order
             msg = widgets.QMessageBox()
@@ -536,10 +1031,167 @@ class MainWindow(widgets.QTabWidget):
             msg.setStandardButtons(widgets.QMessageBox.Ok)
             msg.exec_()
             
+    def read_orders(self):
+        """
+        Returns:
+            tuple of pd.DataFrames, (headers, lines) of all the orders
+        """
+        if self.sqlite_db is not None:
+            return self.sqlite_db.read_orders()
+        return self.order_db.read()
+        
+    def read_stock_adding(self):
+        """
+        Returns:
+            pd.DataFrame, all the stock adds in the wide layout of the stock adding file
+        """
+        if self.sqlite_db is not None:
+            return self.sqlite_db.read_stock_adding()
+        try:
+            return self.csv_cache.read(self.STOCK_ADDING_FILEPATH, pd.read_csv)
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            return pd.DataFrame(columns=['date', 'time'])
+        
+    def get_next_order_id(self):
+        """
+        Returns:
+            int, the order_id for a new order
+        """
+        if self.sqlite_db is not None:
+            return self.sqlite_db.get_next_order_id()
+        return self.order_db.get_next_order_id()
+
+    def save_orders(self, headers, lines, stock, stock_changes):
+        """
+        Save new orders and the stock with the orders deducted, e.g. one order from the form or a batch imported from ebay
+        In a single transaction if using sqlite, otherwise the orders are appended to the orders files and removed again if the stock can't be saved
+        The orders are logged as one operation, so a batch is undone and redone as a whole
+        
+        Arguments:
+            headers: list of dicts, the order details with the OrderDatabase.HEADER_COLUMNS
+            lines: list of dicts, one per item with the OrderDatabase.LINE_COLUMNS
+            stock: pd.DataFrame, the stock database with the orders deducted
+            stock_changes: dict, item_id: change in stock
+        
+        Returns:
+            bool, True if everything was saved
+        """
+        #a batch is logged with all its headers, see self.get_order_headers()
+        records = {'header':headers[0], 'lines':lines} if len(headers) == 1 else {'headers':headers, 'lines':lines}
+        
+        if self.sqlite_db is not None:
+            try:
+                self.sqlite_db.commit_orders(headers, lines, stock_changes)
+            except (sqlite3.Error, KeyError) as err:
+                self.show_save_failed_message('database', err)
+                return False
+            
+            self.stock_db.set_stock(stock)
+            self.log_commit('order', stock_changes, records)
+            return True
+        
+        #append the new orders to the end of the orders files
+        try:
+            order_offsets = self.order_db.append(headers, lines)
+        except PermissionError as err:
+            self.show_save_failed_message('orders database', err)
+            return False
+        
+        #save the new stock database to file
+        try:
+            self.stock_db.save(stock)
+        except PermissionError as err:
+            #remove the new orders
+            self.order_db.truncate(order_offsets)
+        
+            self.show_save_failed_message('stock database', err)
+            return False
+        
+        self.log_commit('order', stock_changes, records, list(order_offsets), self.get_file_sizes('order'))
+        return True
+            
+    def open_order_report(self, filepath):
+        """
+        Read an ebay orders report and show what would be imported
+        
+        SLOT connected to self.orderImportWidget.file_signal(str) SIGNAL in self.__init__()
+        
+        Arguments:
+            filepath: str, path to the report csv file
+        """
+        try:
+            self.order_report = self.order_import.read_report(filepath)
+        except (OSError, ValueError) as err:
+            self.order_report = None
+            self.orderImportWidget.set_report("The report could not be read: {}".format(err), pd.DataFrame(), False)
+            return
+        
+        headers, lines, stock_changes, rejected = self.make_imported_orders()
+        summary = "{0} orders with {1} items can be imported, {2} lines of the report were rejected.".format(len(headers), len(lines), len(rejected))
+        self.orderImportWidget.set_report(summary, rejected, len(headers) > 0)
+        
+    def make_imported_orders(self):
+        """
+        Build the orders from the open ebay orders report against the current stock, with the default cuts and postage and packing cost
+        
+        Returns:
+            tuple, (pd.DataFrame of headers with the OrderDatabase.HEADER_COLUMNS; pd.DataFrame of lines; dict, item_id: change in stock; pd.DataFrame of rejected lines)
+        """
+        stock = self.load_stock_database()
+        imported_numbers = self.read_orders()[0].get('order_number', pd.Series(dtype=object)).dropna()
+        headers, lines, stock_changes, rejected = self.order_import.make_orders(self.order_report, stock, self.get_next_order_id(), set(imported_numbers.astype(str)))
+        
+        international = headers.postcode.isin(self.EBAY_INTERNATIONAL_PROGRAMME_POSTCODES)
+        headers = headers.join(self.get_outlays(headers.order_amount, international))
+        headers['order_amount'] = headers.order_amount.round(2)
+        
+        #numbers like the order form's, with None for the amounts not set
+        headers = headers[OrderDatabase.HEADER_COLUMNS].astype(object)
+        return headers.where(headers.notna(), None), lines, stock_changes, rejected
+        
+    @instruments.timed('import_orders_done')
+    def import_orders_done(self):
+        """
+        Save the orders of the open ebay orders report and deduct their stock, all together as one commit
+        They are checked again first in case the stock has changed since the report was opened
+        
+        SLOT connected to self.orderImportWidget.commit_signal() SIGNAL in self.__init__()
+        """
+        if self.order_report is None or not self.check_stock_valid():
+            return
+        
+        headers, lines, stock_changes, rejected = self.make_imported_orders()
+        if len(headers) == 0:
+            self.orderImportWidget.set_report("There are no orders left to import.", rejected, False)
+            return
+        
+        stock = self.change_stock(stock_changes)
+        if stock is None:
+            return
+        
+        if not self.save_orders(headers.to_dict('records'), lines.to_dict('records'), stock, stock_changes):
+            return
+        
+        self.order_report = None
+        summary = "{0} orders with {1} items were imported, orders {2} to {3}. {4} lines of the report were rejected.".format(len(headers), len(lines), headers.order_id.iloc[0], headers.order_id.iloc[-1], len(rejected))
+        self.orderImportWidget.set_report(summary, rejected, False)
+        
+        msg = widgets.QMessageBox()
+        msg.setIcon(widgets.QMessageBox.Information)
+        msg.setText("Orders imported")
+        msg.setInformativeText(summary + "\n\nThey can all be removed again with the undo button of the order form.")
+        msg.setWindowTitle("Orders imported")
+        msg.setStandardButtons(widgets.QMessageBox.Ok)
+        msg.exec_()
+            
+    @instruments.timed('stock_done')
     def stock_done(self):
         """
         For adding stock
         """
+        if not self.check_stock_valid():
+            return
+        
         stock = self.load_stock_database()
         
         new_item = {item.item_id:False for item in self.stockWidget.items}
@@ -578,69 +1230,49 @@ class MainWindow(widgets.QTabWidget):
                 stock_ok = True
                 
         if stock_ok:
-            #create the new stock add object
-            stock_add = {
-                        'date':"{:%d/%m/%Y}".format(dt.date.today()),
-                        'time':"{0}:{1}:{2}".format(dt.datetime.now().hour, dt.datetime.now().minute, dt.datetime.now().second)
-                        }
-            
-            item_num = 1
+            stock_changes = {} # item_id: change in stock for existing items
+            new_items = {} # item_id: stock row for the new items
+            added = [] # (item_id, quantity) of each item in the form
             for item in self.stockWidget.items:
                 if item.item_id != item.NO_ITEM:#item ID has been input
                     # add the quantity from the stock line
                     quantity = int(item.quantityEdit.text())
                     
-                    if new_item[item.item_id]:
-                        stock = stock.append(pd.Series({'stock':quantity,
-                                                        'manufacturer':item.manufacturerEdit.text(),
-                                                        'category':item.categoryEdit.text(),
-                                                        'description':item.descriptionEdit.text()}, name=item.item_id))
+                    if not new_item[item.item_id]:
+                        stock_changes[item.item_id] = stock_changes.get(item.item_id, 0) + quantity
+                    elif item.item_id in new_items:
+                        new_items[item.item_id]['stock'] += quantity
                     else:
-                        stock.loc[item.item_id, 'stock'] += quantity
+                        new_items[item.item_id] = {'stock':quantity,
+                                                   'manufacturer':item.manufacturerEdit.text(),
+                                                   'category':item.categoryEdit.text(),
+                                                   'description':item.descriptionEdit.text()}
                     
-                    stock_add['item{}_id'.format(item_num)] = item.item_id
-                    stock_add['item{}_quantity'.format(item_num)] = quantity
-                    item_num += 1
+                    added.append((item.item_id, quantity))
+                    
+            #create the new stock add object
+            stock_add = self.make_stock_add(added)
+            new_items = pd.DataFrame.from_dict(new_items, orient='index').reindex(columns=stock.columns).rename_axis(stock.index.name)
+            stock = self.add_to_stock(stock, stock_changes, new_items)
                 
             ###
             print(stock_add)
             # print(stock)
             ###
             
-            #add the new stock input to the database
-            stock_adding = pd.read_csv(self.STOCK_ADDING_FILEPATH)
-            stock_adding = stock_adding.append(stock_add, ignore_index=True)
-            stock_adding = stock_adding.set_index(['date', 'time'])
-                
-            #save back to file
-            try:
-                stock_adding.to_csv(self.STOCK_ADDING_FILEPATH)
-            except PermissionError as err:
-                self.show_save_failed_message('stock input database', err)
-                stock_ok = False
+            stock_ok = self.save_stock_add(stock_add, stock, stock_changes, new_items)
             
+            #Message box pop-up asking if you want to do another order
             if stock_ok:
-                try:
-                    stock.to_csv(self.STOCK_FILEPATH)
-                except PermissionError as err:
-                    #remove the stock input
-                    stock_adding = stock_adding[:-1]
-                    stock_adding.to_csv(self.STOCK_ADDING_FILEPATH)
-                
-                    self.show_save_failed_message('stock database', err)
-                    stock_ok = False
-            
-                #Message box pop-up asking if you want to do another order
-                if stock_ok:
-                    msg = widgets.QMessageBox()
-                    msg.setIcon(widgets.QMessageBox.Question)
-                    msg.setText("Success!")
-                    msg.setInformativeText("The stock has been added to the database. \n\nAdd another?")
-                    msg.setWindowTitle("Stock added")
-                    msg.setStandardButtons(widgets.QMessageBox.Yes | widgets.QMessageBox.No)
-                    msg.setEscapeButton(widgets.QMessageBox.No)
-                    msg.buttonClicked.connect(self.new_stock_input)
-                    msg.exec_()
+                msg = widgets.QMessageBox()
+                msg.setIcon(widgets.QMessageBox.Question)
+                msg.setText("Success!")
+                msg.setInformativeText("The stock has been added to the database. \n\nAdd another?")
+                msg.setWindowTitle("Stock added")
+                msg.setStandardButtons(widgets.QMessageBox.Yes | widgets.QMessageBox.No)
+                msg.setEscapeButton(widgets.QMessageBox.No)
+                msg.buttonClicked.connect(self.new_stock_input)
+                msg.exec_()
         else:
             #Message box pop-up asking if you want to do another order
             msg = widgets.QMessageBox()
@@ -653,6 +1285,155 @@ class MainWindow(widgets.QTabWidget):
         
         
         
+    def open_delivery(self, filepath):
+        """
+        Read a supplier delivery file and preview the change to each item
+        
+        SLOT connected to self.deliveryImportWidget.file_signal(str) SIGNAL in self.__init__()
+        
+        Arguments:
+            filepath: str, path to the delivery csv file
+        """
+        try:
+            self.delivery = self.delivery_import.read_delivery(filepath)
+        except (OSError, ValueError) as err:
+            self.delivery = None
+            self.deliveryImportWidget.set_report("The delivery could not be read: {}".format(err), pd.DataFrame(), False)
+            return
+        
+        added, stock_changes, new_items, preview = self.delivery_import.make_stock_add(self.delivery, self.load_stock_database())
+        self.deliveryImportWidget.set_report(self.get_delivery_summary(added, new_items, preview, "will be"), preview, len(added) > 0)
+        
+    def get_delivery_summary(self, added, new_items, preview, tense):
+        """
+        Returns:
+            str, the numbers of items and lines in a delivery, see DeliveryImport.make_stock_add()
+        """
+        return "{0} units of {1} items {2} added, {3} of them new items. {4} lines were rejected.".format(added.sum(), len(added), tense, len(new_items), len(preview) - len(added))
+        
+    @instruments.timed('delivery_done')
+    def delivery_done(self):
+        """
+        Add the stock of the open delivery and insert its new items, saved as a single stock add
+        It is checked again first in case the stock has changed since the preview
+        
+        SLOT connected to self.deliveryImportWidget.commit_signal() SIGNAL in self.__init__()
+        """
+        if self.delivery is None or not self.check_stock_valid():
+            return
+        
+        stock = self.load_stock_database()
+        added, stock_changes, new_items, preview = self.delivery_import.make_stock_add(self.delivery, stock)
+        if len(added) == 0:
+            self.deliveryImportWidget.set_report("There is no stock to add.", preview, False)
+            return
+        
+        stock_add = self.make_stock_add(added.items())
+        stock = self.add_to_stock(stock, stock_changes, new_items)
+        if not self.save_stock_add(stock_add, stock, stock_changes, new_items):
+            return
+        
+        self.delivery = None
+        summary = self.get_delivery_summary(added, new_items, preview, "were")
+        self.deliveryImportWidget.set_report(summary, preview, False)
+        
+        msg = widgets.QMessageBox()
+        msg.setIcon(widgets.QMessageBox.Information)
+        msg.setText("Stock added")
+        msg.setInformativeText(summary + "\n\nIt can be removed again with the undo button of the stock form.")
+        msg.setWindowTitle("Stock added")
+        msg.setStandardButtons(widgets.QMessageBox.Ok)
+        msg.exec_()
+        
+    def make_stock_add(self, added):
+        """
+        Create a stock add for the stock adding database, dated now
+        
+        Arguments:
+            added: iterable of (item_id, quantity), the items in the order they were added
+        
+        Returns:
+            dict, the stock add with the date, time and itemN_id and itemN_quantity keys for each item
+        """
+        now = dt.datetime.now()
+        stock_add = {
+                    'date':"{:%d/%m/%Y}".format(now),
+                    'time':"{0}:{1}:{2}".format(now.hour, now.minute, now.second)
+                    }
+        for item_num, (item_id, quantity) in enumerate(added, 1):
+            stock_add['item{}_id'.format(item_num)] = item_id
+            stock_add['item{}_quantity'.format(item_num)] = int(quantity)
+            
+        return stock_add
+        
+    def add_to_stock(self, stock, stock_changes, new_items):
+        """
+        Increase the stock of the existing items and insert the new items, all at once
+        
+        Arguments:
+            stock: pd.DataFrame, a copy of the stock database, changed in place
+            stock_changes: dict, item_id: change in stock for existing items
+            new_items: pd.DataFrame, the stock rows of the new items indexed by item_id
+        
+        Returns:
+            pd.DataFrame, the stock database with the stock added
+        """
+        changes = pd.Series(stock_changes, dtype=int)
+        stock.loc[changes.index, 'stock'] += changes
+        
+        if len(new_items) == 0:
+            return stock
+        return pd.concat([stock, new_items])
+        
+    def save_stock_add(self, stock_add, stock, stock_changes, new_items):
+        """
+        Save a new stock add and the stock with the additions
+        In a single transaction if using sqlite, otherwise the stock add is appended to the stock adding file and removed again if the stock can't be saved
+        
+        Arguments:
+            stock_add: dict, the stock add with itemN_ keys for each item
+            stock: pd.DataFrame, the stock database with the stock added
+            stock_changes: dict, item_id: change in stock for existing items
+            new_items: pd.DataFrame, the rows added to the stock database for new items
+        
+        Returns:
+            bool, True if everything was saved
+        """
+        #the change in stock of every item, including the new ones, for undoing
+        all_changes = dict(stock_changes)
+        for item_id, quantity in new_items.stock.items():
+            all_changes[item_id] = all_changes.get(item_id, 0) + int(quantity)
+        
+        if self.sqlite_db is not None:
+            try:
+                self.sqlite_db.commit_stock_add(stock_add, stock_changes, new_items)
+            except (sqlite3.Error, KeyError) as err:
+                self.show_save_failed_message('database', err)
+                return False
+            
+            self.stock_db.set_stock(stock)
+            self.log_commit('stock_add', all_changes, {'stock_add':stock_add})
+            return True
+        
+        #append the new stock input to the end of the stock adding file
+        try:
+            stock_adding_offset = self.stock_adding_journal.append([stock_add])
+        except PermissionError as err:
+            self.show_save_failed_message('stock input database', err)
+            return False
+        
+        try:
+            self.stock_db.save(stock)
+        except PermissionError as err:
+            #remove the stock input
+            self.stock_adding_journal.truncate(stock_adding_offset)
+        
+            self.show_save_failed_message('stock database', err)
+            return False
+        
+        self.log_commit('stock_add', all_changes, {'stock_add':stock_add}, [stock_adding_offset], self.get_file_sizes('stock_add'))
+        return True
+        
     def show_save_failed_message(self, file, error):
         """
         Show a message box when saving to a file fails, e.g. the self.STOCK_FILEPATH or self.ORDERS_FILEPATH
@@ -716,20 +1497,28 @@ class MainWindow(widgets.QTabWidget):
         
         SLOT connected to undo_button.clicked() SIGNAL in self.__init__()
         """
-        orders = pd.read_csv(self.ORDERS_FILEPATH)
-        
-        last_order = orders.iloc[-1]
+        op = self.get_undo_operation('order')
+        if op is None:
+            return
+        headers = self.get_order_headers(op['records'])
         
         #show warning
         msg = widgets.QMessageBox()
         msg.setIcon(widgets.QMessageBox.Warning)
-        msg.setText("Are you sure you want to remove the last order? This cannot be undone.")
-        msg.setInformativeText("Date: {0}, Postcode: {1}, Amount: £{2:.2f}".format(last_order.loc['date'], last_order.loc['postcode'], last_order.loc['order_amount']))
+        if len(headers) == 1:
+            header = headers[0]
+            msg.setText("Are you sure you want to remove the last order? It can be added back with the redo button.")
+            msg.setInformativeText("Date: {0}, Postcode: {1}, Amount: £{2:.2f}".format(header['date'], header['postcode'], pd.to_numeric(header['order_amount'], errors='coerce')))
+        else:
+            amounts = pd.to_numeric(pd.Series([header['order_amount'] for header in headers]), errors='coerce')
+            msg.setText("Are you sure you want to remove the last {} orders, imported together? They can be added back with the redo button.".format(len(headers)))
+            msg.setInformativeText("Dates: {0} to {1}, Total amount: £{2:.2f}".format(headers[0]['date'], headers[-1]['date'], amounts.sum()))
         msg.setWindowTitle("Undo last order")
         msg.setStandardButtons(widgets.QMessageBox.Yes | widgets.QMessageBox.Cancel)
         msg.buttonClicked.connect(self.undo_last_order_confirmed)
         msg.exec_()
 
+    @instruments.timed('undo_order')
     def undo_last_order_confirmed(self, buttonPressed):
         """
         Remove the last order from the orders database and re-add the stock to the stock database
@@ -737,103 +1526,42 @@ class MainWindow(widgets.QTabWidget):
         SLOT connected to msg.buttonClicked() SIGNAL in self.undo_last_order()
         """
         if buttonPressed.text() == "&Yes":
-            undo_ok = True
-            
-            orders = pd.read_csv(self.ORDERS_FILEPATH)
-            stock = self.load_stock_database()
-            
-            last_order = orders.iloc[-1]
-            
-            #remove the order
-            orders = orders.drop([last_order.name])
-            
-            last_order = last_order.rename(last_order.loc['postcode'])
-            last_order = last_order.drop('postcode')
-            orders = orders.set_index('postcode')
-            
-            print(last_order)
-            
-            item_num = 1
-            while True:
-                try:
-                    item_id = last_order.loc['item{}_id'.format(item_num)]
-                    quantity = int(last_order.loc['item{}_quantity'.format(item_num)])
-                except (KeyError, ValueError):
-                    break
-                
-                #re-add the stock of the item
-                try:
-                    stock.loc[item_id, 'stock'] += quantity
-                except KeyError as err:
-                    self.show_missing_stock_item_message(item_id, err)
-                    undo_ok = False
-                    break
-                
-                item_num += 1
-        
-            ###
-            # print(orders)
-            # print(stock)
-            ###
-            
-            if undo_ok:
-                #resave the orders
-                try:
-                    orders.to_csv(self.ORDERS_FILEPATH)
-                except PermissionError as err:
-                    self.show_save_failed_message('orders database', err)
-                    undo_ok = False
-                    
-                if undo_ok:
-                    #resave the stock
-                    try:
-                        stock.to_csv(self.STOCK_FILEPATH)
-                    except PermissionError as err:
-                        #re-add the last order
-                        orders = orders.append(last_order)
-                        orders.to_csv(self.ORDERS_FILEPATH)
-                    
-                        self.show_save_failed_message('stock database', err)
-                        undo_ok = False
+            op = self.get_undo_operation('order')
+            if op is not None:
+                self.undo_operation(op)
             
-    def show_missing_stock_item_message(self, item_id, error):
+    @instruments.timed('redo_order')
+    def redo_last_order(self):
         """
-        Show a message box when looking up a stock item fails
+        Add back the last order removed with undo
         
-        Arguments:
-            item_id: str, the id of the item that is missing
-            error: KeyError or str, the key error thrown
+        SLOT connected to self.orderWidget.redo_signal SIGNAL in self.__init__()
         """
-        msg = widgets.QMessageBox()
-        msg.setIcon(widgets.QMessageBox.Warning)
-        msg.setText("Item look-up failed")
-        msg.setInformativeText("Item {} could not be found in the database, the operation has been cancelled.".format(item_id))
-        msg.setDetailedText("{}".format(error))
-        msg.setWindowTitle("Item look-up failed")
-        msg.setStandardButtons(widgets.QMessageBox.Ok)
-        msg.exec_()
-                
+        self.redo_operation('order')
+            
     def undo_last_stock_add(self):
         """
         Ask for confirmation about removing the last stock add
         
         SLOT connected to stock_undo_button.clicked() SIGNAL in self.__init__()
         """
-        stock_adds = pd.read_csv(self.STOCK_ADDING_FILEPATH)
-        
-        last_add = stock_adds.iloc[-1]
-        print(last_add)
+        op = self.get_undo_operation('stock_add')
+        if op is None:
+            return
+        stock_add = op['records']['stock_add']
+        print(stock_add)
         
         #show warning
         msg = widgets.QMessageBox()
         msg.setIcon(widgets.QMessageBox.Warning)
-        msg.setText("Are you sure you want to remove the last stock input? This cannot be undone.")
-        msg.setInformativeText("Date: {0}, Time: {1}, First item ID: {2}".format(last_add.loc['date'], last_add.loc['time'], last_add.loc['item1_id']))
+        msg.setText("Are you sure you want to remove the last stock input? It can be added back with the redo button.")
+        msg.setInformativeText("Date: {0}, Time: {1}, First item ID: {2}".format(stock_add['date'], stock_add['time'], stock_add['item1_id']))
         msg.setWindowTitle("Undo last stock add")
         msg.setStandardButtons(widgets.QMessageBox.Yes | widgets.QMessageBox.Cancel)
         msg.buttonClicked.connect(self.undo_last_stock_add_confirmed)
         msg.exec_()
         
+    @instruments.timed('undo_stock_add')
     def undo_last_stock_add_confirmed(self, buttonPressed):
         """
         Remove the last stock add from the stock adding database and remove the stock from the stock database
@@ -841,62 +1569,376 @@ class MainWindow(widgets.QTabWidget):
         SLOT connected to msg.buttonClicked() SIGNAL in self.undo_last_stock_add()
         """
         if buttonPressed.text() == "&Yes":
-            undo_ok = True
-            stock_adds = pd.read_csv(self.STOCK_ADDING_FILEPATH)
-            stock = self.load_stock_database()
+            op = self.get_undo_operation('stock_add')
+            if op is not None:
+                self.undo_operation(op)
+                
+    @instruments.timed('redo_stock_add')
+    def redo_last_stock_add(self):
+        """
+        Add back the last stock add removed with undo
+        
+        SLOT connected to self.stockWidget.redo_signal SIGNAL in self.__init__()
+        """
+        self.redo_operation('stock_add')
+        
+    def log_commit(self, kind, stock_changes, records, offsets=None, sizes=None):
+        """
+        Add a commit to the operation log so it can be undone, see OperationLog.commit()
+        Failing to write the log doesn't fail the commit, the commit can still be undone from the end of the database
+        """
+        self.add_to_outbox(kind)
+        self.update_analytics(kind, records)
+        try:
+            self.operation_log.commit(kind, stock_changes, records, offsets, sizes)
+        except PermissionError as err:
+            print("Couldn't write the operation log: {}".format(err))
+        
+    def update_analytics(self, kind, records, sign=1):
+        """
+        Add the orders or stock add of a commit or redo to the sales analytics and the reorder forecast, or take them away for an undo
+        
+        Arguments:
+            kind: str, 'order' or 'stock_add', stock adds only change the forecast
+            records: dict, the records of the operation
+            sign: int, -1 for an undo
+        """
+        if kind == 'order':
+            self.analytics.add_orders(self.get_order_headers(records), records['lines'], sign)
+            self.forecast.add_orders(self.get_order_headers(records), records['lines'], sign)
+        else:
+            self.forecast.add_stock_add(records['stock_add'], sign)
+        
+    def get_file_sizes(self, kind):
+        """
+        Returns:
+            list of int, the sizes of the csv files for the kind of operation, 'order' or 'stock_add'
+        """
+        if kind == 'order':
+            return list(self.order_db.get_sizes())
+        return [self.stock_adding_journal.get_size()]
+        
+    def append_records(self, kind, records):
+        """
+        Append the rows of an operation to the end of its csv files
+        
+        Returns:
+            list of int, the sizes of the files before appending
+            
+        Raises:
+            PermissionError if a file can't be written
+        """
+        if kind == 'order':
+            return list(self.order_db.append(self.get_order_headers(records), records['lines']))
+        return [self.stock_adding_journal.append([records['stock_add']])]
+        
+    def get_order_headers(self, records):
+        """
+        Returns:
+            list of dicts, the order headers of an order operation's records, one unless the orders were imported together
+        """
+        if 'headers' in records:
+            return records['headers']
+        return [records['header']]
+        
+    def truncate_records(self, kind, offsets):
+        """
+        Remove the rows of an operation from the end of its csv files
+        
+        Arguments:
+            offsets: list of int, from self.append_records()
+        """
+        if kind == 'order':
+            self.order_db.truncate(offsets)
+        else:
+            self.stock_adding_journal.truncate(offsets[0])
+        
+    def operation_matches(self, op):
+        """
+        Check an operation from the log is still the last one in the database, i.e. nothing has been changed outside the program since
+        
+        Returns:
+            bool
+        """
+        if self.sqlite_db is None:
+            return op['sizes'] == self.get_file_sizes(op['kind'])
+        
+        if op['kind'] == 'order':
+            last_order, lines = self.sqlite_db.get_last_order()
+            return last_order is not None and int(last_order.loc['order_id']) == int(self.get_order_headers(op['records'])[-1]['order_id'])
+        
+        last_add = self.sqlite_db.get_last_stock_add()
+        stock_add = op['records']['stock_add']
+        return last_add is not None and (last_add.loc['date'], last_add.loc['time']) == (stock_add['date'], stock_add['time'])
+        
+    def get_stock_add_changes(self, stock_add):
+        """
+        Returns:
+            dict, item_id: quantity added for the items of a stock add with itemN_ keys
+        """
+        stock_changes = {}
+        item_num = 1
+        while True:
+            try:
+                item_id = str(stock_add['item{}_id'.format(item_num)]).upper()
+                quantity = int(float(stock_add['item{}_quantity'.format(item_num)]))
+            except (KeyError, ValueError):
+                break
             
-            last_add = stock_adds.iloc[-1]
+            stock_changes[item_id] = stock_changes.get(item_id, 0) + quantity
+            item_num += 1
             
-            print(last_add)
+        return stock_changes
+        
+    def get_last_operation(self, kind):
+        """
+        Read the last order or stock add from the end of the database as an operation, for commits which aren't in the operation log
+        
+        Arguments:
+            kind: str, 'order' or 'stock_add'
+        
+        Returns:
+            dict, the operation as in OperationLog.commit(), None if the database is empty
+        """
+        offsets = None
+        if kind == 'order':
+            if self.sqlite_db is not None:
+                header, lines = self.sqlite_db.get_last_order()
+            else:
+                header, lines, offsets = self.order_db.get_last_order()
+            if header is None:
+                return None
             
-            #drop the last stock add
-            stock_adds = stock_adds.drop([last_add.name])
+            #summed per item in case an item is on more than one line
+            stock_changes = (-lines.quantity.groupby(lines.item_id.astype(str).str.upper()).sum()).to_dict()
+            records = {'header':header.to_dict(), 'lines':lines.to_dict('records')}
+        else:
+            if self.sqlite_db is not None:
+                stock_add = self.sqlite_db.get_last_stock_add()
+            else:
+                rows, offset = self.stock_adding_journal.get_last_rows()
+                stock_add = pd.Series(rows[-1]) if rows else None
+                offsets = (offset,)
+            if stock_add is None:
+                return None
             
-            item_num = 1
-            while True:
-                try:
-                    item_id = last_add.loc['item{}_id'.format(item_num)]
-                    quantity = int(last_add.loc['item{}_quantity'.format(item_num)])
-                except (KeyError, ValueError):
-                    break
+            stock_changes = self.get_stock_add_changes(stock_add)
+            records = {'stock_add':stock_add.to_dict()}
+            
+        return {
+            'op_id':self.operation_log.new_op_id(),
+            'kind':kind,
+            'stock_changes':stock_changes,
+            'records':records,
+            'offsets':None if offsets is None else list(offsets),
+            'sizes':None if offsets is None else self.get_file_sizes(kind)
+            }
+        
+    def get_undo_operation(self, kind):
+        """
+        Get the last order or stock add to undo, from the operation log if it is still the last in the database, otherwise from the end of the database
+        
+        Arguments:
+            kind: str, 'order' or 'stock_add'
+        
+        Returns:
+            dict, the operation as in OperationLog.commit(), None if there is nothing to undo
+        """
+        op = self.operation_log.get_undo(kind)
+        if op is not None:
+            if self.operation_matches(op):
+                return op
+            
+            #the database has been changed outside the program, so the logged operations no longer apply
+            print("The operation log doesn't match the database, clearing it")
+            self.operation_log.clear()
+        
+        return self.get_last_operation(kind)
+        
+    def change_stock(self, stock_changes, sign=1):
+        """
+        Apply the stock changes of an operation to a copy of the stock database
+        
+        Arguments:
+            stock_changes: dict, item_id: change in stock
+            sign: int, -1 to apply the opposite changes when undoing
+        
+        Returns:
+            pd.DataFrame, the changed stock database, None if an item is missing or the stock can't be saved
+        """
+        if not self.check_stock_valid():
+            return None
+        
+        stock = self.load_stock_database()
+        
+        changes = pd.Series(stock_changes, dtype=int)*sign
+        missing = changes.index.difference(stock.index)
+        if len(missing) > 0:
+            self.show_missing_stock_item_message(missing[0], KeyError(missing[0]))
+            return None
+        
+        stock.loc[changes.index, 'stock'] += changes
+        
+        return stock
+        
+    def undo_operation(self, op):
+        """
+        Undo an order or stock add: remove its rows from the end of the database and apply the opposite stock changes
+        In a single transaction if using sqlite, otherwise the rows are appended again if the stock can't be saved
+        
+        Arguments:
+            op: dict, the operation from self.get_undo_operation()
+        
+        Returns:
+            bool, True if the operation was undone
+        """
+        stock = self.change_stock(op['stock_changes'], -1)
+        if stock is None:
+            return False
+        
+        if self.sqlite_db is not None:
+            try:
+                if op['kind'] == 'order':
+                    self.sqlite_db.remove_last_orders(len(self.get_order_headers(op['records'])))
+                else:
+                    self.sqlite_db.remove_last_stock_add()
+            except (sqlite3.Error, KeyError) as err:
+                self.show_save_failed_message('database', err)
+                return False
+            
+            self.stock_db.set_stock(stock)
+        else:
+            #remove the rows from the end of the files
+            try:
+                self.truncate_records(op['kind'], op['offsets'])
+            except PermissionError as err:
+                self.show_save_failed_message('orders database' if op['kind'] == 'order' else 'stock input database', err)
+                return False
+            
+            #resave the stock
+            try:
+                self.stock_db.save(stock)
+            except PermissionError as err:
+                #re-add the rows
+                self.append_records(op['kind'], op['records'])
                 
-                #remove the stock of the item
-                try:
-                    stock.loc[item_id, 'stock'] -= quantity
-                except KeyError as err:
-                    self.show_missing_stock_item_message(item_id, err)
-                    undo_ok = False
-                    break
+                self.show_save_failed_message('stock database', err)
+                return False
+        
+        self.add_to_outbox(op['kind'])
+        self.update_analytics(op['kind'], op['records'], -1)
+        try:
+            self.operation_log.undo(op)
+        except PermissionError as err:
+            print("Couldn't write the operation log: {}".format(err))
+        
+        return True
+        
+    def redo_operation(self, kind):
+        """
+        Redo the last order or stock add that was undone: append its rows to the database again and re-apply its stock changes
+        
+        Arguments:
+            kind: str, 'order' or 'stock_add'
+        
+        Returns:
+            bool, True if an operation was redone
+        """
+        op = self.operation_log.get_redo(kind)
+        if op is None:
+            return False
+        
+        stock = self.change_stock(op['stock_changes'])
+        if stock is None:
+            return False
+        
+        records = op['records']
+        offsets = None
+        sizes = None
+        if self.sqlite_db is not None:
+            try:
+                if kind == 'order':
+                    self.sqlite_db.commit_orders(self.get_order_headers(records), records['lines'], op['stock_changes'])
+                else:
+                    self.sqlite_db.commit_stock_add(records['stock_add'], op['stock_changes'], stock.iloc[:0])
+            except (sqlite3.Error, KeyError) as err:
+                self.show_save_failed_message('database', err)
+                return False
+            
+            self.stock_db.set_stock(stock)
+        else:
+            try:
+                offsets = self.append_records(kind, records)
+            except PermissionError as err:
+                self.show_save_failed_message('orders database' if kind == 'order' else 'stock input database', err)
+                return False
+            
+            try:
+                self.stock_db.save(stock)
+            except PermissionError as err:
+                self.truncate_records(kind, offsets)
                 
-                item_num += 1
+                self.show_save_failed_message('stock database', err)
+                return False
+            sizes = self.get_file_sizes(kind)
         
-            if undo_ok:
-                #resave the stock adding
-                stock_adds_to_save = stock_adds.set_index(['date', 'time'])
-                try:
-                    stock_adds_to_save.to_csv(self.STOCK_ADDING_FILEPATH)
-                except PermissionError as err:
-                    self.show_save_failed_message('stock input database', err)
-                    undo_ok = False
-                    
-                if undo_ok:
-                    #resave the stock database
-                    try:
-                        stock.to_csv(self.STOCK_FILEPATH)
-                    except PermissionError as err:
-                        #re-add the stock add
-                        stock_adds = stock_adds.append(last_add)
-                        stock_adds = stock_adds.set_index(['date', 'time'])
-                        stock_adds.to_csv(self.STOCK_ADDING_FILEPATH)
-                    
-                        self.show_save_failed_message('stock database', err)
-                        undo_ok = False
-                        
+        self.add_to_outbox(kind)
+        self.update_analytics(kind, records)
+        try:
+            self.operation_log.redo(op, offsets, sizes)
+        except PermissionError as err:
+            print("Couldn't write the operation log: {}".format(err))
         
+        return True
+            
+    def check_stock_valid(self):
+        """
+        Check the stock database can be saved, it can't while any stock isn't a whole number as the value would be lost
         
+        Returns:
+            bool, True if the stock can be saved, otherwise the items are shown to the user
+        """
+        invalid_stock = self.stock_db.get_invalid_stock()
+        if invalid_stock:
+            self.show_invalid_stock_message(invalid_stock)
+            return False
+        return True
         
+    def show_invalid_stock_message(self, invalid_stock):
+        """
+        Show a message box listing the items with a stock which isn't a whole number
+        SLOT connected to self.stock_db.invalid_stock_found(list) SIGNAL in self.__init__(), also called by self.check_stock_valid()
         
+        Arguments:
+            invalid_stock: list of tuples, (item_id, text) of the stock
+        """
+        shown = ["{0}: '{1}'".format(item_id, text) for item_id, text in invalid_stock[:self.MAX_CONFLICTS_SHOWN]]
+        if len(invalid_stock) > len(shown):
+            shown.append("...and {} more".format(len(invalid_stock) - len(shown)))
         
+        msg = widgets.QMessageBox()
+        msg.setIcon(widgets.QMessageBox.Warning)
+        msg.setText("Invalid stock")
+        msg.setInformativeText("The stock of {0} items in the stock database isn't a whole number. Nothing can be saved until they are corrected in {1}.".format(
+            len(invalid_stock), self.STOCK_FILEPATH if self.sqlite_db is None else self.SQLITE_FILEPATH))
+        msg.setDetailedText("\n".join(shown))
+        msg.setWindowTitle("Invalid stock")
+        msg.setStandardButtons(widgets.QMessageBox.Ok)
+        msg.exec_()
         
+    def show_missing_stock_item_message(self, item_id, error):
+        """
+        Show a message box when looking up a stock item fails
         
-    
\ No newline at end of file
+        Arguments:
+            item_id: str, the id of the item that is missing
+            error: KeyError or str, the key error thrown
+        """
+        msg = widgets.QMessageBox()
+        msg.setIcon(widgets.QMessageBox.Warning)
+        msg.setText("Item look-up failed")
+        msg.setInformativeText("Item {} could not be found in the database, the operation has been cancelled.".format(item_id))
+        msg.setDetailedText("{}".format(error))
+        msg.setWindowTitle("Item look-up failed")
+        msg.setStandardButtons(widgets.QMessageBox.Ok)
+        msg.exec_()
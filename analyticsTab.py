@@ -0,0 +1,68 @@
+import PyQt5.QtWidgets as widgets
+from PyQt5.QtCore import Qt
+from stockTableModel import StockTableModel
+from instrumentation import instruments
+
+class AnalyticsTab(widgets.QWidget):
+    """
+    Tab showing the revenue, fees and net profit of the orders grouped by day, week, month, item, manufacturer or category, see SalesAnalytics
+    Refreshed from the kept totals each time it's shown, so it's up to date with the orders added and undone since
+    """
+    HEADERS = {'orders':"Orders", 'quantity':"Items sold", 'revenue':"Revenue £", 'fees':"Ebay and paypal £", 'postpack':"Postage and packing £",
+               'net':"Net £", 'margin':"Margin %", 'item_id':"Item ID", 'manufacturer':"Manufacturer", 'category':"Category"} # column: header, the group columns are headed by the grouping
+    def __init__(self, analytics):
+        """
+        Arguments:
+            analytics: SalesAnalytics, the kept totals of the orders
+        """
+        super().__init__()
+
+        self.analytics = analytics
+
+        layout = widgets.QVBoxLayout()
+        self.setLayout(layout)
+
+        topBar = widgets.QHBoxLayout()
+        topBar.addWidget(widgets.QLabel("Group by"))
+        self.groupingBox = widgets.QComboBox()
+        self.groupingBox.addItems(list(analytics.GROUPINGS))
+        self.groupingBox.setCurrentText('Month')
+        self.groupingBox.currentTextChanged.connect(self.refresh)
+        topBar.addWidget(self.groupingBox)
+        topBar.addStretch(1)
+        layout.addLayout(topBar)
+
+        self.overall_label = widgets.QLabel()
+        layout.addWidget(self.overall_label)
+
+        #sortable by clicking a column header, like the search table
+        self.table = widgets.QTableView()
+        self.table.verticalHeader().setSectionResizeMode(widgets.QHeaderView.Fixed)
+        self.table.setSortingEnabled(True)
+        layout.addWidget(self.table)
+
+    def showEvent(self, event):
+        """
+        Override the showEvent QWidget SLOT, refresh whenever the tab is shown
+        """
+        self.refresh()
+        super().showEvent(event)
+
+    @instruments.timed('refresh_analytics')
+    def refresh(self):
+        """
+        SLOT connected to self.groupingBox.currentTextChanged() SIGNAL in self.__init__()
+        """
+        grouping = self.groupingBox.currentText()
+        table = self.analytics.get_table(grouping)
+
+        columns = list(table.columns)
+        #kept as an attribute, the view doesn't keep the model alive
+        self.model = StockTableModel(columns, [self.HEADERS.get(col, grouping) for col in columns])
+        self.model.set_frame(table)
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+
+        overall = self.analytics.get_overall()
+        self.overall_label.setText("All orders: {0:.0f} orders, {1:.0f} items sold, revenue £{2:.2f}, ebay and paypal £{3:.2f}, postage and packing £{4:.2f}, net £{5:.2f}".format(
+            overall.orders, overall.quantity, overall.revenue, overall.fees, overall.postpack, overall.net))
@@ -0,0 +1,214 @@
+"""
+Headless benchmarks of the data paths: the stock search, filling an item, committing orders and stock adds, and undo and redo
+
+Each path is run on synthetic databases of each size (see syntheticData.py) with MainWindow.TEST set, so google drive is never used,
+and the message boxes are answered 'yes' straight away rather than waiting for a click.
+The timings are saved as json, and can be compared against an earlier results file to catch regressions:
+
+    python benchmarks/benchmark.py --sizes 1000 100000 --output new.json --baseline old.json
+"""
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import platform
+import statistics
+import tempfile
+import time
+import pandas as pd
+import PyQt5.QtWidgets as widgets
+from syntheticData import SyntheticData
+
+class Benchmark():
+    """
+    Times each data path on one set of synthetic databases, each path run self.REPEATS times
+    """
+    SEARCH_TERMS = {'search_item':'{item_id}', 'search_manufacturer':'shimano', 'search_terms':'hub front'}
+    ORDER_ITEMS = 3 # items in each benchmarked order
+    def __init__(self, folder, repeats, use_sqlite=False):
+        """
+        Arguments:
+            folder: str, folder holding the synthetic databases, the window is run in it
+            repeats: int, runs of each path
+            use_sqlite: bool, benchmark with MainWindow.USE_SQLITE
+        """
+        self.FOLDER = folder
+        self.REPEATS = repeats
+        self.USE_SQLITE = use_sqlite
+
+        self.timings = {} # path: list of seconds
+
+    def time(self, name, function, *args):
+        """
+        Run a function with its prints hidden, adding how long it took to the timings of name
+        """
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function(*args)
+            self.timings.setdefault(name, []).append(time.perf_counter() - start)
+
+    def run(self):
+        """
+        Returns:
+            dict, path: {'runs', 'median', 'min', 'max'} in seconds
+        """
+        os.chdir(self.FOLDER)
+        import MainWindow as main_window
+        main_window.MainWindow.TEST = True
+        main_window.MainWindow.USE_SQLITE = self.USE_SQLITE
+
+        self.time('startup', main_window.MainWindow)
+        window = main_window.MainWindow()
+
+        for _ in range(self.REPEATS):
+            window.stock_db.invalidate()
+            self.time('stock_load', window.stock_db.load)
+        #the full parse a stock load needs when the csv cache is out of date
+        for _ in range(self.REPEATS):
+            self.time('stock_parse', window.stock_db.parse_file, window.STOCK_FILEPATH)
+        for _ in range(self.REPEATS):
+            self.time('orders_read', window.read_orders)
+
+        #items to order, with plenty of stock so every order goes through
+        stock = window.stock_db.load()
+        item_ids = list(stock.index[stock.stock >= 3*self.REPEATS*self.ORDER_ITEMS][:self.ORDER_ITEMS])
+
+        search_table = window.widget(0)
+        self.time('search_index', search_table.stock_db.get_search_index)
+        for name, term in self.SEARCH_TERMS.items():
+            for _ in range(self.REPEATS):
+                search_table.searchEdit.setText(term.format(item_id=item_ids[0]))
+                self.time(name, self.search, search_table)
+
+        for _ in range(self.REPEATS):
+            self.time('fill_item', window.orderWidget.fill_item, 0, item_ids[0])
+        window.orderWidget.clear_items()
+
+        for _ in range(self.REPEATS):
+            self.fill_form(window.orderWidget, item_ids)
+            window.postcodeEdit.setText('AB1 2CD')
+            window.orderAmountEdit.setText('20')
+            window.set_outlays()
+            self.time('order_done', window.order_done)
+        for _ in range(self.REPEATS):
+            self.time('undo_order', window.undo_last_order)
+        for _ in range(self.REPEATS):
+            self.time('redo_order', window.redo_last_order)
+
+        for _ in range(self.REPEATS):
+            self.fill_form(window.stockWidget, item_ids)
+            self.time('stock_done', window.stock_done)
+            window.stockWidget.clear_items()
+        for _ in range(self.REPEATS):
+            self.time('undo_stock_add', window.undo_last_stock_add)
+        for _ in range(self.REPEATS):
+            self.time('redo_stock_add', window.redo_last_stock_add)
+
+        window.close()
+
+        return {name:{'runs':runs, 'median':statistics.median(runs), 'min':min(runs), 'max':max(runs)} for name, runs in self.timings.items()}
+
+    def search(self, search_table):
+        """
+        Search for the text in the search field and wait for all the results to be in the table
+        """
+        search_table.search()
+        search_table.thread_pool.waitForDone()
+        widgets.QApplication.processEvents()
+
+    def fill_form(self, form, item_ids):
+        """
+        Enter the items into the order or stock add form, a quantity of 1 each
+        """
+        for i, item_id in enumerate(item_ids):
+            form.items[i].item_id_edit.setText(item_id)
+            form.items[i].get_item()
+            form.items[i].quantityEdit.setText('1')
+
+
+def answer_yes(msg):
+    """
+    Stands in for QMessageBox.exec_() so the benchmarks aren't held up by the message boxes, clicks 'yes', or 'ok' if there isn't one
+    """
+    button = msg.button(widgets.QMessageBox.Yes) or msg.button(widgets.QMessageBox.Ok)
+    if button is not None:
+        button.click()
+
+def compare(results, baseline, threshold):
+    """
+    Print each median against the baseline results
+
+    Arguments:
+        results, baseline: dict, the results files
+        threshold: float, ratio of the medians above which a path is flagged as slower
+
+    Returns:
+        int, number of paths flagged
+    """
+    slower = 0
+    for size, paths in results['results'].items():
+        for name, timing in paths.items():
+            old = baseline['results'].get(size, {}).get(name)
+            if old is None:
+                continue
+            ratio = timing['median']/old['median'] if old['median'] > 0 else float('inf')
+            flag = ''
+            if ratio > threshold:
+                flag = '  SLOWER'
+                slower += 1
+            print('{0:>9} {1:<20} {2:10.4f}s {3:10.4f}s {4:6.2f}x{5}'.format(size, name, old['median'], timing['median'], ratio, flag))
+
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data paths on synthetic databases")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000], help="numbers of stock items, orders and stock adds to benchmark with")
+    parser.add_argument('--repeats', type=int, default=5, help="runs of each path")
+    parser.add_argument('--sqlite', action='store_true', help="benchmark with MainWindow.USE_SQLITE")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the synthetic databases")
+    parser.add_argument('--output', default='benchmark_results.json', help="file to save the results to")
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--threshold', type=float, default=1.2, help="ratio of the medians above which a path is flagged as slower than the baseline")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    app = widgets.QApplication(sys.argv)
+    widgets.QMessageBox.exec_ = answer_yes
+
+    results = {'date':dt.datetime.now().isoformat(timespec='seconds'),
+               'platform':platform.platform(),
+               'python':platform.python_version(),
+               'pandas':pd.__version__,
+               'sqlite':args.sqlite,
+               'repeats':args.repeats,
+               'results':{}}
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            SyntheticData(args.seed).write(folder, size)
+            print('Benchmarking {} rows...'.format(size))
+            timings = Benchmark(folder, args.repeats, args.sqlite).run()
+            os.chdir(os.path.dirname(output))
+        results['results'][str(size)] = timings
+        for name, timing in timings.items():
+            print('{0:>9} {1:<20} median {2:10.4f}s  min {3:10.4f}s'.format(size, name, timing['median'], timing['min']))
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print('Saved the results to {}'.format(output))
+
+    if baseline is not None:
+        slower = compare(results, baseline, args.threshold)
+        print('{} paths slower than the baseline'.format(slower))
+
+
+if __name__ == "__main__":
+    main()
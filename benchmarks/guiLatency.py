@@ -0,0 +1,199 @@
+"""
+End-to-end latency of the window as the user sees it, driving the real widgets offscreen with QTest
+
+Scripts orders with many items each: typing each item id and quantity, committing the order with the Done button,
+then undoing and redoing them, and typing searches into the search tab.
+Each step is timed from its input event until the window has settled, i.e. every slot, worker thread and message box it set off has finished.
+The message boxes are shown for real and answered by a timer as soon as they are up, taking 'yes' or 'ok', so their cost is counted.
+
+    python benchmarks/guiLatency.py --rows 10000 --orders 200 --items 10 --output latency.json
+"""
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import contextlib
+import io
+import json
+import tempfile
+import time
+import numpy as np
+import PyQt5.QtWidgets as widgets
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtTest import QTest
+from syntheticData import SyntheticData
+
+class ModalDismisser():
+    """
+    Answers each message box as soon as it's shown, clicking 'yes', or 'ok' if there isn't one
+    """
+    INTERVAL = 1 # ms between checks for a message box
+    def __init__(self):
+        self.dismissed = 0
+
+        self.timer = QTimer()
+        self.timer.setInterval(self.INTERVAL)
+        self.timer.timeout.connect(self.dismiss)
+        self.timer.start()
+
+    def dismiss(self):
+        msg = widgets.QApplication.activeModalWidget()
+        if not isinstance(msg, widgets.QMessageBox):
+            return
+        button = msg.button(widgets.QMessageBox.Yes) or msg.button(widgets.QMessageBox.Ok) or msg.escapeButton()
+        if button is not None:
+            self.dismissed += 1
+            button.click()
+
+class GuiLatency():
+    """
+    Runs the scripted session on one set of databases and keeps the latency of each kind of step
+    """
+    SEARCH_TERMS = ['shimano', 'hub front', 'MAVIC1', 'spoke key']
+    def __init__(self, folder, num_orders, items_per_order):
+        """
+        Arguments:
+            folder: str, folder holding the databases, the window is run in it
+            num_orders: int, orders to commit
+            items_per_order: int, items in each order
+        """
+        self.FOLDER = folder
+        self.NUM_ORDERS = num_orders
+        self.ITEMS_PER_ORDER = items_per_order
+
+        self.latencies = {} # step: list of seconds
+        self.num_dismissed = 0 # message boxes answered
+
+    def settle(self):
+        """
+        Wait until the window has finished reacting to the last input
+        """
+        widgets.QApplication.processEvents()
+        self.search_table.thread_pool.waitForDone()
+        widgets.QApplication.processEvents()
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """
+        Time the input events sent in the with block until the window has settled
+        """
+        start = time.perf_counter()
+        yield
+        self.settle()
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    def type_text(self, edit, text):
+        """
+        Replace the text of a line edit by typing it in and pressing return
+        """
+        edit.clear()
+        QTest.keyClicks(edit, text)
+        QTest.keyClick(edit, Qt.Key_Return)
+
+    def get_button(self, widget, text):
+        return [button for button in widget.findChildren(widgets.QPushButton) if button.text() == text][0]
+
+    def run(self):
+        """
+        Returns:
+            dict, step: list of seconds
+        """
+        os.chdir(self.FOLDER)
+        import MainWindow as main_window
+        main_window.MainWindow.TEST = True
+
+        window = main_window.MainWindow()
+        window.show()
+        self.search_table = window.widget(0)
+        dismisser = ModalDismisser()
+
+        #items with enough stock for every order
+        stock = window.stock_db.load()
+        item_ids = list(stock.index[stock.stock >= self.NUM_ORDERS])
+        rng = np.random.default_rng(0)
+
+        form = window.orderWidget
+        done_button = self.get_button(form, "Done")
+        window.setCurrentWidget(form)
+        for _ in range(self.NUM_ORDERS):
+            self.type_text(window.postcodeEdit, 'AB1 2CD')
+            self.type_text(window.orderAmountEdit, '25.00')
+            for i, item_id in enumerate(rng.choice(item_ids, self.ITEMS_PER_ORDER, replace=False)):
+                with self.timed('type_item_id'):
+                    self.type_text(form.items[i].item_id_edit, item_id)
+                with self.timed('type_quantity'):
+                    self.type_text(form.items[i].quantityEdit, '1')
+            with self.timed('commit_order'):
+                QTest.mouseClick(done_button, Qt.LeftButton)
+
+        for _ in range(self.NUM_ORDERS):
+            with self.timed('undo_order'):
+                QTest.mouseClick(self.get_button(form, "Undo"), Qt.LeftButton)
+        for _ in range(self.NUM_ORDERS):
+            with self.timed('redo_order'):
+                QTest.mouseClick(self.get_button(form, "Redo"), Qt.LeftButton)
+
+        window.setCurrentWidget(self.search_table)
+        for _ in range(max(1, self.NUM_ORDERS//len(self.SEARCH_TERMS))):
+            for term in self.SEARCH_TERMS:
+                self.search_table.searchEdit.clear()
+                QTest.keyClicks(self.search_table.searchEdit, term)
+                with self.timed('search'):
+                    QTest.keyClick(self.search_table.searchEdit, Qt.Key_Return)
+                #as you type, searching once typing pauses for SearchTable.SEARCH_DELAY
+                self.search_table.searchEdit.clear()
+                with self.timed('search_as_you_type'):
+                    QTest.keyClicks(self.search_table.searchEdit, term)
+                    QTest.qWait(self.search_table.SEARCH_DELAY)
+                    while self.search_table.search_timer.isActive():
+                        QTest.qWait(1)
+
+        self.num_dismissed = dismisser.dismissed
+        window.close()
+
+        return self.latencies
+
+
+def get_percentiles(latencies):
+    """
+    Returns:
+        dict, step: {'count', 'p50', 'p90', 'p95', 'p99', 'max'} in milliseconds
+    """
+    summary = {}
+    for name, runs in latencies.items():
+        runs = 1000*np.array(runs)
+        summary[name] = {'count':len(runs), **{'p{}'.format(p):float(np.percentile(runs, p)) for p in (50, 90, 95, 99)}, 'max':float(runs.max())}
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the latency of the window driven offscreen")
+    parser.add_argument('--rows', type=int, default=10000, help="numbers of stock items, orders and stock adds in the synthetic databases")
+    parser.add_argument('--orders', type=int, default=200, help="orders to commit")
+    parser.add_argument('--items', type=int, default=10, help="items in each order")
+    parser.add_argument('--output', help="file to save the latencies to as json")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output is not None else None
+
+    app = widgets.QApplication(sys.argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        SyntheticData().write(folder, args.rows)
+        session = GuiLatency(folder, args.orders, args.items)
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies = session.run()
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    print('{} message boxes answered'.format(session.num_dismissed))
+
+    summary = get_percentiles(latencies)
+    print('{0:<20} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}'.format('step (ms)', 'count', 'p50', 'p90', 'p95', 'p99', 'max'))
+    for name, stats in summary.items():
+        print('{0:<20} {count:>6} {p50:9.2f} {p90:9.2f} {p95:9.2f} {p99:9.2f} {max:9.2f}'.format(name, **stats))
+
+    if output is not None:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({'rows':args.rows, 'orders':args.orders, 'items':args.items, 'latencies':summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import datetime as dt
+import numpy as np
+import pandas as pd
+import argparse
+import os
+
+class SyntheticData():
+    """
+    Generator of realistic stock, orders and stock adding files of any size, in the same layouts as the real files
+    Used by benchmark.py to find how the data paths scale without needing a copy of the shop's databases
+
+    The same seed always gives the same files, so benchmark runs on different days compare like for like.
+    """
+    MANUFACTURERS = ['mavic', 'DT Swiss', 'shimano', 'sram', 'campagnolo', 'hope', 'sapim', 'fulcrum']
+    CATEGORIES = ['competition', 'spoke key', 'hub', 'rim', 'spoke', 'nipple', 'tool', 'bearing']
+    DESCRIPTION_WORDS = ['front', 'rear', 'black', 'silver', '28h', '32h', '700c', '26in', 'disc', 'rim brake', 'main key type', 'spare']
+    LINES_PER_ORDER = [0.6, 0.25, 0.1, 0.05] # probability of an order having 1, 2, 3 or 4 items
+    ITEMS_PER_STOCK_ADD = 3 # most items in a stock add
+    FIRST_DATE = dt.date(2015, 1, 1)
+    POSTPACK_AMOUNT = 0.97
+    def __init__(self, seed=0):
+        """
+        Arguments:
+            seed: int, seed for the random numbers
+        """
+        self.rng = np.random.default_rng(seed)
+
+    def make_stock(self, num_items):
+        """
+        Returns:
+            pd.DataFrame, the stock file with an item_id column
+        """
+        manufacturers = self.rng.choice(self.MANUFACTURERS, num_items)
+        prefixes = pd.Series(manufacturers).str.replace(' ', '').str[:5].str.upper()
+        descriptions = np.where(self.rng.random(num_items) < 0.3, '', self.rng.choice(self.DESCRIPTION_WORDS, num_items))
+
+        return pd.DataFrame({
+            'item_id':prefixes + pd.Series(np.arange(num_items)).astype(str),
+            'manufacturer':manufacturers,
+            'category':self.rng.choice(self.CATEGORIES, num_items),
+            'stock':self.rng.integers(0, 400, num_items),
+            'description':descriptions
+            })
+
+    def make_dates(self, num):
+        """
+        Returns:
+            pd.Series of datetimes, num dates in order from FIRST_DATE to today
+        """
+        start = pd.Timestamp(self.FIRST_DATE)
+        seconds = int((pd.Timestamp.now() - start).total_seconds())
+        return pd.Series(start + pd.to_timedelta(np.sort(self.rng.integers(0, seconds, num)), unit='s'))
+
+    def make_postcodes(self, num):
+        letters = np.array(list('ABCDEFGHJKLMNPRSTUWY'))
+        return pd.Series(self.rng.choice(letters, num)) + pd.Series(self.rng.integers(1, 30, num)).astype(str) + ' ' + \
+            pd.Series(self.rng.integers(1, 10, num)).astype(str) + pd.Series(self.rng.choice(letters, num)) + pd.Series(self.rng.choice(letters, num))
+
+    def make_orders(self, num_orders, stock):
+        """
+        Arguments:
+            num_orders: int, number of orders
+            stock: pd.DataFrame, from self.make_stock(), the items ordered are taken from it
+
+        Returns:
+            tuple of pd.DataFrames, (headers, lines) with the OrderDatabase columns
+        """
+        amounts = np.round(self.rng.uniform(5, 200, num_orders), 2)
+        headers = pd.DataFrame({
+            'order_id':np.arange(1, num_orders+1),
+            'postcode':self.make_postcodes(num_orders),
+            'date':self.make_dates(num_orders).dt.strftime('%d/%m/%Y'),
+            'order_amount':amounts,
+            'ebay_amount':np.round(0.1*amounts, 2),
+            'paypal_amount':np.round(0.029*amounts + 0.3, 2),
+            'postpack_amount':self.POSTPACK_AMOUNT
+            })
+
+        num_lines = self.rng.choice(np.arange(1, len(self.LINES_PER_ORDER)+1), num_orders, p=self.LINES_PER_ORDER)
+        order_ids = np.repeat(headers.order_id.values, num_lines)
+        items = stock.iloc[self.rng.integers(0, len(stock), len(order_ids))].reset_index(drop=True)
+        lines = pd.DataFrame({
+            'order_id':order_ids,
+            'item_num':pd.Series(order_ids).groupby(order_ids).cumcount().values + 1,
+            'item_id':items.item_id,
+            'quantity':self.rng.integers(1, 4, len(order_ids)),
+            'manufacturer':items.manufacturer,
+            'category':items.category,
+            'description':items.description
+            })
+
+        return headers, lines
+
+    def make_stock_adding(self, num_adds, stock):
+        """
+        Returns:
+            pd.DataFrame, the stock adding file, with date and time columns and itemN_id, itemN_quantity columns
+        """
+        dates = self.make_dates(num_adds)
+        stock_adding = pd.DataFrame({'date':dates.dt.strftime('%d/%m/%Y'), 'time':dates.dt.strftime('%H:%M:%S')})
+
+        num_items = self.rng.integers(1, self.ITEMS_PER_STOCK_ADD+1, num_adds)
+        for i in range(1, self.ITEMS_PER_STOCK_ADD+1):
+            used = num_items >= i
+            stock_adding['item{}_id'.format(i)] = np.where(used, stock.item_id.values[self.rng.integers(0, len(stock), num_adds)], '')
+            stock_adding['item{}_quantity'.format(i)] = pd.Series(np.where(used, self.rng.integers(1, 50, num_adds), 0)).replace(0, '')
+
+        return stock_adding
+
+    def write(self, folder, num_items, num_orders=None, num_adds=None):
+        """
+        Write a full set of database files
+
+        Arguments:
+            folder: str, the folder to write stock.csv, orders.csv, order_lines.csv and stock_adding.csv to, created if it doesn't exist
+            num_items: int, number of stock items
+            num_orders: int, number of orders, num_items if None
+            num_adds: int, number of stock adds, num_items if None
+        """
+        num_orders = num_items if num_orders is None else num_orders
+        num_adds = num_items if num_adds is None else num_adds
+
+        os.makedirs(folder, exist_ok=True)
+        stock = self.make_stock(num_items)
+        headers, lines = self.make_orders(num_orders, stock)
+        stock.to_csv(os.path.join(folder, 'stock.csv'), index=False)
+        headers.to_csv(os.path.join(folder, 'orders.csv'), index=False)
+        lines.to_csv(os.path.join(folder, 'order_lines.csv'), index=False)
+        self.make_stock_adding(num_adds, stock).to_csv(os.path.join(folder, 'stock_adding.csv'), index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic stock, orders and stock adding files")
+    parser.add_argument('folder', help="folder to write the files to")
+    parser.add_argument('--rows', type=int, default=1000, help="number of stock items, orders and stock adds")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    SyntheticData(args.seed).write(args.folder, args.rows)
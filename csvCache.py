@@ -0,0 +1,291 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import uuid
+import numpy as np
+import pandas as pd
+from instrumentation import instruments
+
+class CsvCache():
+    """
+    Binary copies of the parsed database csv files, so a file which hasn't changed since it was last read isn't parsed again
+
+    Each csv file has a folder in the cache folder with a .npy file per column and a meta.json recording the (modification time, size) and md5 of the csv file
+    the columns were parsed from. The numeric columns are memory mapped when read, copy on write. Text columns with few distinct values, and categoricals,
+    are kept as memory mapped codes into their distinct values, nullable integers, e.g. the money in pence, as memory mapped values and missing masks,
+    and the rest as pickled arrays.
+    A csv file with the same modification time and size is read from the cache without being opened. One with the same size and md5, e.g. downloaded
+    again from google drive, is too. One which has only had rows appended since, as the CsvJournals do, has only the appended rows parsed.
+    Anything else is parsed again in full. The csv files stay the interchange format with google drive, the cache is only ever local.
+
+    A cache is written to new column files and meta.json is swapped in last, so a cache is never left half written.
+    """
+    META_FILENAME = 'meta.json'
+    FOLDER_SUFFIX = '.cache'
+    HASH_BLOCK_SIZE = 1048576 # bytes read at a time when hashing a csv file
+    MAPPED_KINDS = 'biufcmM' # numpy dtype kinds memory mapped when read
+    SAMPLE_ROWS = 10000 # rows looked at first to see if a text column is worth storing as codes
+    MAX_UNIQUE_SHARE = 0.5 # text columns with fewer distinct values than this share of the rows are stored as codes into the distinct values
+    def __init__(self, folder):
+        """
+        Arguments:
+            folder: str, path to the folder to keep the caches in, created when first written
+        """
+        self.FOLDER = folder
+
+        self.lock = threading.Lock()
+
+    def get_cache_folder(self, filepath):
+        return os.path.join(self.FOLDER, os.path.basename(filepath) + self.FOLDER_SUFFIX)
+
+    def get_signature(self, filepath):
+        """
+        Returns:
+            list, [modification time in ns, size in bytes] of the file
+
+        Raises:
+            FileNotFoundError if there isn't one, as reading the csv would
+        """
+        stat = os.stat(filepath)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def get_md5(self, filepath, size=None):
+        """
+        Arguments:
+            filepath: str
+            size: int, hash only the first size bytes, all of the file if None
+
+        Returns:
+            hashlib md5, of the file, the rest of the file can be added with update()
+        """
+        md5 = hashlib.md5()
+        left = size
+        with open(filepath, 'rb') as f:
+            while left is None or left > 0:
+                block = f.read(self.HASH_BLOCK_SIZE if left is None else min(self.HASH_BLOCK_SIZE, left))
+                if not block:
+                    break
+                md5.update(block)
+                if left is not None:
+                    left -= len(block)
+
+        return md5
+
+    def read_meta(self, filepath):
+        """
+        Returns:
+            dict, the meta of the cache of the csv file, None if there isn't one
+        """
+        try:
+            with open(os.path.join(self.get_cache_folder(filepath), self.META_FILENAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def read(self, filepath, parse):
+        """
+        Read a csv file from its cache if it's up to date, otherwise parse it and cache the result
+
+        Arguments:
+            filepath: str, path to the csv file
+            parse: function(source), parses the csv file, or a buffer with its column names and some of its rows, into a pd.DataFrame
+
+        Returns:
+            pd.DataFrame, as from parse(filepath)
+
+        Raises:
+            FileNotFoundError if there is no csv file, or anything else parse() raises
+        """
+        with self.lock:
+            signature = self.get_signature(filepath)
+            meta = self.read_meta(filepath)
+            if meta is not None:
+                try:
+                    frame = self.read_cached(filepath, meta, signature, parse)
+                except (OSError, ValueError, KeyError) as err:
+                    print("Couldn't read the cache of {0}: {1}".format(filepath, err))
+                    frame = None
+                if frame is not None:
+                    return frame
+
+            #hashed before parsing, so a file changed while it's parsed doesn't match the cache next time
+            md5 = self.get_md5(filepath).hexdigest()
+            frame = parse(filepath)
+            self.write(filepath, frame, signature, md5)
+
+            return frame
+
+    @instruments.timed('csv_cache_read')
+    def read_cached(self, filepath, meta, signature, parse):
+        """
+        Returns:
+            pd.DataFrame, from the cache, with any rows appended to the csv file since parsed and added, None if the cache can't be used
+        """
+        if meta['signature'] == signature:
+            return self.load(filepath, meta)
+
+        cached_size = meta['signature'][1]
+        if signature[1] < cached_size:
+            return None
+        md5 = self.get_md5(filepath, cached_size)
+        if md5.hexdigest() != meta['md5']:
+            return None
+
+        frame = self.load(filepath, meta)
+        if signature[1] > cached_size:
+            #rows appended, parse them under the column names, which must be the same or the file would have been rewritten
+            with open(filepath, 'rb') as f:
+                header = f.readline()
+                f.seek(cached_size - 1)
+                tail = f.read()
+            if not tail.startswith(b'\n'):
+                return None
+            md5.update(tail[1:])
+            appended = parse(io.BytesIO(header + tail[1:]))
+            if list(appended.columns) != list(frame.columns) or appended.index.names != frame.index.names:
+                return None
+            frame = pd.concat([frame, appended], ignore_index=meta['index'] is None)
+
+        self.write(filepath, frame, signature, md5.hexdigest())
+
+        return frame
+
+    def load(self, filepath, meta):
+        """
+        Returns:
+            pd.DataFrame, the cached frame
+        """
+        folder = self.get_cache_folder(filepath)
+        columns = {}
+        for col, entry in zip(meta['columns'], meta['files']):
+            if entry['storage'] == 'objects':
+                values = np.load(os.path.join(folder, entry['file']), allow_pickle=True)
+                if entry['dtype'] != 'object':
+                    values = pd.array(values, dtype=entry['dtype'])
+            else:
+                values = np.load(os.path.join(folder, entry['file']), mmap_mode='c')
+            if entry['storage'] == 'masked':
+                values = pd.arrays.IntegerArray(np.asarray(values), np.load(os.path.join(folder, entry['mask'])))
+            elif entry['storage'] == 'codes':
+                uniques = np.load(os.path.join(folder, entry['uniques']), allow_pickle=True)
+                if entry['dtype'] == 'category':
+                    values = pd.Categorical.from_codes(values, categories=uniques, ordered=entry['ordered'])
+                else:
+                    #missing values have code -1, which picks the nan added at the end
+                    values = np.append(uniques, np.nan).take(values)
+            columns[col] = values
+
+        frame = pd.DataFrame(columns, columns=meta['columns'])
+        if meta['index'] is not None:
+            frame = frame.set_index(meta['index'])
+            frame.index.names = meta['index_names']
+
+        return frame
+
+    def save_column(self, folder, filename, values):
+        """
+        Write a column to the cache folder, as one of 'array', memory mapped when read; 'codes', codes memory mapped and the unique values pickled;
+        'masked', nullable integers memory mapped with their missing mask; or 'objects', pickled
+
+        Arguments:
+            folder: str, the cache folder
+            filename: str, name for the column file, the unique values get the same name with _uniques added and the missing mask with _mask
+            values: pd.Series
+
+        Returns:
+            dict, the column's entry in the meta
+        """
+        entry = {'file':filename + '.npy', 'dtype':str(values.dtype)}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            entry.update({'storage':'codes', 'uniques':filename + '_uniques.npy', 'ordered':bool(values.cat.ordered)})
+            codes, uniques = values.cat.codes.to_numpy(), values.cat.categories.to_numpy(dtype=object)
+        elif isinstance(values.dtype, np.dtype) and values.dtype.kind in self.MAPPED_KINDS:
+            entry['storage'] = 'array'
+            np.save(os.path.join(folder, entry['file']), values.to_numpy())
+            return entry
+        elif isinstance(values.dtype, pd.Int64Dtype):
+            entry.update({'storage':'masked', 'mask':filename + '_mask.npy'})
+            np.save(os.path.join(folder, entry['file']), values.to_numpy(dtype=np.int64, na_value=0))
+            np.save(os.path.join(folder, entry['mask']), values.isna().to_numpy())
+            return entry
+        else:
+            #few distinct values, e.g. the manufacturers, are each stored once, checked on the first rows before going through them all
+            encode = values.dtype == object and values.iloc[:self.SAMPLE_ROWS].nunique(dropna=False) <= self.MAX_UNIQUE_SHARE*min(len(values), self.SAMPLE_ROWS)
+            if encode:
+                codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+                encode = len(uniques) <= self.MAX_UNIQUE_SHARE*len(values)
+            if not encode:
+                entry['storage'] = 'objects'
+                np.save(os.path.join(folder, entry['file']), values.to_numpy(dtype=object), allow_pickle=True)
+                return entry
+            entry.update({'storage':'codes', 'uniques':filename + '_uniques.npy'})
+            codes, uniques = codes.astype(np.int32), uniques.astype(object)
+
+        np.save(os.path.join(folder, entry['file']), codes)
+        np.save(os.path.join(folder, entry['uniques']), uniques, allow_pickle=True)
+
+        return entry
+
+    @instruments.timed('csv_cache_write')
+    def write(self, filepath, frame, signature, md5):
+        """
+        Write the cache of a csv file, failing to write it only means the file is parsed next time
+
+        Arguments:
+            filepath: str, path to the csv file
+            frame: pd.DataFrame, parsed from the file
+            signature: list, self.get_signature() of the file when it was parsed
+            md5: str, of the file when it was parsed
+        """
+        folder = self.get_cache_folder(filepath)
+        stored = frame if isinstance(frame.index, pd.RangeIndex) else frame.reset_index()
+        index = None if stored is frame else list(stored.columns[:frame.index.nlevels])
+        token = uuid.uuid4().hex
+
+        try:
+            os.makedirs(folder, exist_ok=True)
+            files = [self.save_column(folder, '{0}_{1}'.format(token, num), values) for num, (col, values) in enumerate(stored.items())]
+
+            meta = {'signature':signature, 'md5':md5, 'index':index, 'index_names':list(frame.index.names), 'columns':[str(col) for col in stored.columns], 'files':files}
+            temp_filepath = os.path.join(folder, self.META_FILENAME + '.tmp')
+            with open(temp_filepath, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(temp_filepath, os.path.join(folder, self.META_FILENAME))
+        except OSError as err:
+            print("Couldn't write the cache of {0}: {1}".format(filepath, err))
+            return
+
+        #the old column files once the new meta is in place, any still memory mapped on windows are left for the next write
+        kept = {entry[key] for entry in files for key in ['file', 'uniques', 'mask'] if key in entry}
+        for filename in os.listdir(folder):
+            if filename.endswith('.npy') and filename not in kept:
+                try:
+                    os.remove(os.path.join(folder, filename))
+                except OSError:
+                    pass
+
+    def discard(self, filepath):
+        """
+        Stop using the cache of a csv file, so it is parsed again the next time it's read, e.g. when it has values which have to be checked on each read
+
+        Arguments:
+            filepath: str, path to the csv file
+        """
+        with self.lock:
+            try:
+                os.remove(os.path.join(self.get_cache_folder(filepath), self.META_FILENAME))
+            except OSError:
+                pass
+
+    def store(self, filepath, frame):
+        """
+        Cache a frame just written to a csv file, so the next read of the file doesn't parse it
+
+        Arguments:
+            filepath: str, path to the csv file
+            frame: pd.DataFrame, as parse() would return for the file
+        """
+        with self.lock:
+            self.write(filepath, frame, self.get_signature(filepath), self.get_md5(filepath).hexdigest())
@@ -0,0 +1,204 @@
+import csv
+import math
+import os
+from instrumentation import instruments
+
+class CsvJournal():
+    """
+    Append-only writer for the orders and stock adding csv files
+
+    New rows are appended to the end of the file and synced to disk, so the cost of a commit doesn't grow with the size of the file.
+    Only when a row brings new columns (e.g. the first order with more items than any before) is the whole file rewritten with the wider header,
+    this is written to a temporary file first and swapped in with os.replace() so the file is never left half written.
+    """
+    ENCODING = 'utf-8'
+    LINE_TERMINATOR = '\n'
+    TEMP_SUFFIX = '.tmp'
+    TAIL_BLOCK_SIZE = 65536 # bytes read at a time when reading the end of the file
+    def __init__(self, filepath, first_columns=()):
+        """
+        Arguments:
+            filepath: str, path to the csv file
+            first_columns: tuple of str, columns to put first if the file has to be created, e.g. the columns pandas would use as the index
+        """
+        self.FILEPATH = filepath
+        self.FIRST_COLUMNS = first_columns
+
+    def get_columns(self):
+        """
+        Read only the header line of the file
+
+        Returns:
+            list of str, the column names, empty if the file doesn't exist or is empty
+        """
+        try:
+            with open(self.FILEPATH, 'r', newline='', encoding=self.ENCODING) as f:
+                return next(csv.reader(f), [])
+        except FileNotFoundError:
+            return []
+
+    def get_size(self):
+        """
+        Returns:
+            int, the size of the file in bytes, 0 if it doesn't exist
+        """
+        try:
+            return os.path.getsize(self.FILEPATH)
+        except FileNotFoundError:
+            return 0
+
+    def format_value(self, value):
+        """
+        Write missing values as empty cells like pandas does
+        """
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return ''
+        return value
+
+    @instruments.timed('csv_append')
+    def append(self, rows):
+        """
+        Append rows to the end of the file, widening the header first if any of the rows have new columns
+
+        Arguments:
+            rows: list of dicts, column name: value
+
+        Returns:
+            int, the size of the file before the rows were appended, for self.truncate()
+
+        Raises:
+            PermissionError if the file can't be written, e.g. it's open in another program
+        """
+        columns = self.get_columns()
+
+        new_columns = []
+        for row in rows:
+            new_columns += [col for col in row.keys() if col not in columns and col not in new_columns]
+
+        if not columns:
+            new_columns = [col for col in self.FIRST_COLUMNS if col in new_columns] + [col for col in new_columns if col not in self.FIRST_COLUMNS]
+            self.rewrite(new_columns)
+            columns = new_columns
+        elif new_columns:
+            columns = columns + new_columns
+            self.rewrite(columns)
+
+        offset = self.get_size()
+
+        with open(self.FILEPATH, 'a', newline='', encoding=self.ENCODING) as f:
+            if offset > 0 and not self.ends_with_newline():
+                f.write(self.LINE_TERMINATOR)
+            writer = csv.DictWriter(f, fieldnames=columns, restval='', lineterminator=self.LINE_TERMINATOR)
+            for row in rows:
+                writer.writerow({col:self.format_value(value) for col, value in row.items()})
+            f.flush()
+            os.fsync(f.fileno())
+
+        return offset
+
+    def ends_with_newline(self):
+        with open(self.FILEPATH, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) in (b'\n', b'\r')
+
+    def rewrite(self, columns):
+        """
+        Rewrite the file with a new header, padding the existing rows with empty cells for the new columns
+
+        Arguments:
+            columns: list of str, the new header, starting with the existing columns
+        """
+        temp_filepath = self.FILEPATH + self.TEMP_SUFFIX
+        with open(temp_filepath, 'w', newline='', encoding=self.ENCODING) as temp:
+            writer = csv.writer(temp, lineterminator=self.LINE_TERMINATOR)
+            writer.writerow(columns)
+            try:
+                with open(self.FILEPATH, 'r', newline='', encoding=self.ENCODING) as f:
+                    reader = csv.reader(f)
+                    next(reader, None)
+                    for row in reader:
+                        writer.writerow(row + ['']*(len(columns)-len(row)))
+            except FileNotFoundError:
+                pass
+            temp.flush()
+            os.fsync(temp.fileno())
+
+        os.replace(temp_filepath, self.FILEPATH)
+
+    @instruments.timed('csv_truncate')
+    def truncate(self, offset):
+        """
+        Remove everything appended after the given offset, e.g. to roll back an append when saving the stock fails
+
+        Arguments:
+            offset: int, the file size returned by self.append()
+        """
+        with open(self.FILEPATH, 'r+b') as f:
+            f.truncate(offset)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @instruments.timed('csv_read_last_rows')
+    def get_last_rows(self, key_column=None):
+        """
+        Read the rows at the end of the file which share the value in key_column with the last row, e.g. all the lines of the last order
+        Only the end of the file is read, a block at a time, so this doesn't depend on the size of the file
+
+        Arguments:
+            key_column: str, the column to group the rows by, or None for only the last row
+
+        Returns:
+            tuple, (list of dicts, the last rows in file order; int, the offset they start at for self.truncate())
+        """
+        columns = self.get_columns()
+        if not columns or (key_column is not None and key_column not in columns):
+            return [], self.get_size()
+        key = None if key_column is None else columns.index(key_column)
+
+        with open(self.FILEPATH, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            position = end
+            data = b''
+            while True:
+                #read backwards until a row with a different key (or the header) is in the data
+                start = max(position - self.TAIL_BLOCK_SIZE, 0)
+                f.seek(start)
+                data = f.read(position - start) + data
+                position = start
+
+                lines = data.split(b'\n')
+                #the first line may be cut off unless we are at the start of the file
+                complete = lines if position == 0 else lines[1:]
+                rows = []
+                row_offsets = []
+                offset = end - len(data) + (0 if position == 0 else len(lines[0]) + 1)
+                for line in complete:
+                    if line.strip():
+                        rows.append(line)
+                        row_offsets.append(offset)
+                    offset += len(line) + 1
+
+                if position == 0:
+                    rows = rows[1:] # header
+                    row_offsets = row_offsets[1:]
+
+                parsed = [next(csv.reader([row.decode(self.ENCODING)])) for row in rows]
+                if key is None:
+                    first = max(len(parsed)-1, 0)
+                    if parsed or position == 0:
+                        break
+                    continue
+
+                last_key = parsed[-1][key] if parsed else None
+                first = len(parsed)
+                while first > 0 and parsed[first-1][key] == last_key:
+                    first -= 1
+
+                if first > 0 or position == 0:
+                    break
+
+        last_rows = [dict(zip(columns, row + ['']*(len(columns)-len(row)))) for row in parsed[first:]]
+        last_offset = row_offsets[first] if first < len(row_offsets) else end
+
+        return last_rows, last_offset
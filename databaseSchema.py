@@ -0,0 +1,245 @@
+import decimal
+import numpy as np
+import pandas as pd
+
+class DatabaseSchema():
+    """
+    The column types of the stock, order header and order line frames, given to pd.read_csv so the types aren't inferred from the text
+
+    manufacturer and category are categoricals, so each name is held once however many items share it, and the stock and quantities are integers.
+    A stock which isn't a whole number is taken as 0 and listed in self.invalid_stock, so the StockDatabase can keep it from being saved over.
+    Money is held as whole pence in nullable Int64 columns, so the totals are exact sums of native integers. It is read from the text of the csv
+    files straight to pence, without going through a float. It stays pounds in the csv files, the sqlite database and the order headers of a commit,
+    see self.format_headers().
+    Order dates are parsed to datetime64, and written back in DATE_FORMAT. A date which can't be read keeps its text in DATE_TEXT_COLUMN,
+    so it is written back as it was.
+    The type_ methods can be given frames which are already typed, e.g. after adding rows, and only convert the columns which aren't.
+    """
+    STOCK_DTYPES = {'item_id':str, 'manufacturer':'category', 'category':'category', 'stock':str, 'description':str} # stock is read as text so any which isn't a whole number can be reported
+    HEADER_DTYPES = {'order_id':'Int64', 'postcode':str, 'date':str, 'order_amount':str, 'ebay_amount':str, 'paypal_amount':str, 'postpack_amount':str, 'order_number':str}
+    LINE_DTYPES = {'order_id':'Int64', 'item_num':'Int64', 'item_id':str, 'quantity':'Int64', 'manufacturer':'category', 'category':'category', 'description':str}
+    CATEGORY_COLUMNS = ['manufacturer', 'category']
+    MONEY_COLUMNS = ['order_amount', 'ebay_amount', 'paypal_amount', 'postpack_amount'] # pounds in the files, pence in the frames
+    HEADER_INTEGER_COLUMNS = ['order_id']
+    LINE_INTEGER_COLUMNS = ['order_id', 'item_num', 'quantity']
+    MONEY_DTYPE = 'Int64'
+    DATE_FORMAT = '%d/%m/%Y' # as in the order form
+    FALLBACK_DATE_FORMATS = ['%d/%m/%y', '%Y-%m-%d', '%d-%b-%y', '%d-%b-%Y'] # tried in turn for dates not in DATE_FORMAT, each has the day and month in a fixed place
+    DATE_TEXT_COLUMN = 'date_text' # the text of the dates which couldn't be read, missing for the rest
+    def __init__(self):
+        self.invalid_stock = [] # (item_id, text) of the stock last typed from text which wasn't a whole number
+
+    def read_stock(self, source):
+        """
+        Arguments:
+            source: str or file-like, the stock csv file
+
+        Returns:
+            pd.DataFrame, typed, indexed by the upper case item_id
+        """
+        stock = pd.read_csv(source, dtype=self.STOCK_DTYPES)
+        stock['item_id'] = stock.item_id.astype(str).str.upper()
+
+        return self.type_stock(stock.set_index('item_id'))
+
+    def type_stock(self, stock):
+        """
+        Arguments:
+            stock: pd.DataFrame, indexed by item_id
+
+        Returns:
+            pd.DataFrame, with categorical manufacturer and category, and the stock as integers,
+            one which is missing or isn't a whole number is 0 and its item id and text are kept in self.invalid_stock
+        """
+        stock = self.to_categories(stock, self.CATEGORY_COLUMNS)
+        if 'stock' in stock.columns and stock.stock.dtype != np.int64:
+            values = pd.to_numeric(stock.stock, errors='coerce')
+            invalid = values.isna() | (values != values.round())
+            self.invalid_stock = list(stock.stock[invalid].fillna('').astype(str).items())
+            stock['stock'] = values.where(~invalid, 0).astype(np.int64)
+
+        return stock
+
+    def read_headers(self, source):
+        """
+        Arguments:
+            source: str or file-like, the orders csv file
+
+        Returns:
+            pd.DataFrame, the typed order headers
+        """
+        return self.type_headers(pd.read_csv(source, dtype=self.HEADER_DTYPES))
+
+    def type_headers(self, headers):
+        """
+        Arguments:
+            headers: pd.DataFrame, order headers with the money in pounds, or already typed
+
+        Returns:
+            pd.DataFrame, with integer order ids, the money in pence and the dates parsed, with the text of any which can't be in DATE_TEXT_COLUMN
+        """
+        headers = self.to_integers(headers, self.HEADER_INTEGER_COLUMNS)
+        for col in self.MONEY_COLUMNS:
+            if col in headers.columns and headers[col].dtype != self.MONEY_DTYPE:
+                headers[col] = self.to_pence(headers[col])
+        if 'date' in headers.columns and not pd.api.types.is_datetime64_dtype(headers.date):
+            dates = self.parse_dates(headers.date)
+            headers[self.DATE_TEXT_COLUMN] = headers.date.where(dates.isna()).astype(object)
+            headers['date'] = dates
+
+        return headers
+
+    def read_lines(self, source):
+        """
+        Arguments:
+            source: str or file-like, the order lines csv file
+
+        Returns:
+            pd.DataFrame, the typed order lines
+        """
+        return self.type_lines(pd.read_csv(source, dtype=self.LINE_DTYPES))
+
+    def type_lines(self, lines):
+        """
+        Arguments:
+            lines: pd.DataFrame, order lines
+
+        Returns:
+            pd.DataFrame, with integer ids and quantities, and categorical manufacturer and category
+        """
+        return self.to_categories(self.to_integers(lines, self.LINE_INTEGER_COLUMNS), self.CATEGORY_COLUMNS)
+
+    def format_headers(self, headers):
+        """
+        Turn typed order headers back into the layout of the orders file
+
+        Arguments:
+            headers: pd.DataFrame, typed or not, e.g. read as text for merging
+
+        Returns:
+            pd.DataFrame, with the money in pounds and the dates in DATE_FORMAT, or as they were if they couldn't be read
+        """
+        headers = headers.copy()
+        for col in self.MONEY_COLUMNS:
+            if col in headers.columns and headers[col].dtype == self.MONEY_DTYPE:
+                headers[col] = self.get_pounds(headers[col])
+        if 'date' in headers.columns and pd.api.types.is_datetime64_dtype(headers.date):
+            dates = headers.date.dt.strftime(self.DATE_FORMAT)
+            if self.DATE_TEXT_COLUMN in headers.columns:
+                dates = dates.where(headers.date.notna(), headers[self.DATE_TEXT_COLUMN])
+            headers['date'] = dates
+
+        return headers.drop(columns=self.DATE_TEXT_COLUMN, errors='ignore')
+
+    def to_categories(self, frame, columns):
+        """
+        Returns:
+            pd.DataFrame, with the columns made categorical if they aren't, e.g. after rows with new names were added
+        """
+        for col in columns:
+            if col in frame.columns and not isinstance(frame[col].dtype, pd.CategoricalDtype):
+                frame[col] = frame[col].astype('category')
+
+        return frame
+
+    def to_integers(self, frame, columns):
+        """
+        Returns:
+            pd.DataFrame, with the columns as int64, or nullable Int64 if any are missing
+        """
+        for col in columns:
+            if col not in frame.columns or frame[col].dtype == np.int64:
+                continue
+            if isinstance(frame[col].dtype, pd.Int64Dtype):
+                values = frame[col]
+            else:
+                values = pd.to_numeric(frame[col], errors='coerce').round()
+            frame[col] = values.astype('Int64' if values.isna().any() else np.int64)
+
+        return frame
+
+    def to_pence(self, pounds):
+        """
+        Arguments:
+            pounds: pd.Series of amounts in pounds, numbers or text
+
+        Returns:
+            pd.Series of Int64, the amounts in whole pence, missing if they aren't numbers
+        """
+        if pd.api.types.is_numeric_dtype(pounds):
+            return (pounds.astype('float64')*100).round().astype(self.MONEY_DTYPE)
+
+        #there are far fewer distinct amounts than orders, so each is only converted once
+        positions, amounts = pd.factorize(pounds.to_numpy(dtype=object))
+        pence = pd.array([self.get_pence(amount) for amount in amounts] + [None], dtype=self.MONEY_DTYPE)
+
+        #missing amounts are at position -1, which picks the None added at the end
+        return pd.Series(pence[positions], index=pounds.index, name=pounds.name)
+
+    def get_pence(self, amount):
+        """
+        Arguments:
+            amount: str or number, an amount in pounds, e.g. '12.5' or '£12.50'
+
+        Returns:
+            int, the amount in whole pence rounded half up, None if it isn't a number
+        """
+        try:
+            #a float goes through its shortest text, so 0.1 is 10 pence
+            value = decimal.Decimal(amount.strip().lstrip('£') if isinstance(amount, str) else repr(float(amount)))
+        except (decimal.InvalidOperation, TypeError, ValueError):
+            return None
+        if not value.is_finite():
+            return None
+
+        return int((value*100).quantize(decimal.Decimal(1), rounding=decimal.ROUND_HALF_UP))
+
+    def get_pounds(self, pence):
+        """
+        Arguments:
+            pence: pd.Series of Int64
+
+        Returns:
+            pd.Series of float, the amounts in pounds, nan for missing amounts
+        """
+        return pence.astype('float64')/100
+
+    def parse_pounds(self, text):
+        """
+        Arguments:
+            text: str, an amount in pounds as typed in the order form
+
+        Returns:
+            float, the amount rounded to whole pence, None if it isn't a number
+        """
+        try:
+            return round(float(text), 2)
+        except ValueError:
+            return None
+
+    def parse_dates(self, dates):
+        """
+        Arguments:
+            dates: pd.Series of dates as text, in DATE_FORMAT unless typed otherwise, or already parsed
+
+        Returns:
+            pd.Series of datetime64, NaT for dates that can't be read in DATE_FORMAT or any of the FALLBACK_DATE_FORMATS
+        """
+        if pd.api.types.is_datetime64_dtype(dates):
+            return dates
+
+        #there are far fewer dates than orders, so each date is only parsed once
+        positions, unique_dates = pd.factorize(dates)
+        unique_dates = pd.Series(unique_dates, dtype=object)
+        parsed = pd.to_datetime(unique_dates, format=self.DATE_FORMAT, errors='coerce')
+        #no guessing at the format, which could swap the day and month of e.g. 05/07/20
+        for date_format in self.FALLBACK_DATE_FORMATS:
+            missing = parsed.isna()
+            if not missing.any():
+                break
+            parsed[missing] = pd.to_datetime(unique_dates[missing], format=date_format, errors='coerce')
+
+        #missing dates are at position -1, which picks the NaT added at the end
+        values = np.append(parsed.values, np.datetime64('NaT', 'ns'))[positions]
+
+        return pd.Series(values, index=dates.index, name=dates.name)
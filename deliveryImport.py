@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+from instrumentation import instruments
+
+class DeliveryImport():
+    """
+    Turns a supplier delivery csv file into one stock add, for MainWindow.save_stock_add()
+
+    The file has a row per item delivered with item_id and quantity columns, and manufacturer, category and description columns for the new items.
+    The column names can be in any case and a line of an item already in the file adds to its quantity.
+    Existing items get the quantity added to their stock and the rest are new items, all in one go rather than an item at a time.
+    Lines which can't be added are rejected and the rest still go in.
+    """
+    REQUIRED_COLUMNS = ['item_id', 'quantity']
+    DETAIL_COLUMNS = ['manufacturer', 'category', 'description'] # stock columns set for new items
+    PREVIEW_COLUMNS = ['line', 'item_id', 'change', 'manufacturer', 'category', 'description', 'stock', 'adding', 'new_stock']
+    ENCODING = 'utf-8-sig' # spreadsheet programs can start the file with a byte order mark
+    def read_delivery(self, filepath):
+        """
+        Read a delivery csv file
+
+        Arguments:
+            filepath: str, path to the csv file
+
+        Returns:
+            pd.DataFrame, all text, with the REQUIRED_COLUMNS, the DETAIL_COLUMNS and the line of each row in the file
+
+        Raises:
+            OSError if the file can't be read, ValueError if it hasn't got the REQUIRED_COLUMNS
+        """
+        delivery = pd.read_csv(filepath, dtype=str, keep_default_na=False, skip_blank_lines=False, encoding=self.ENCODING)
+        delivery.columns = [str(col).strip().lower() for col in delivery.columns]
+
+        missing = [col for col in self.REQUIRED_COLUMNS if col not in delivery.columns]
+        if missing:
+            raise ValueError("The file has no {} column".format(', '.join(missing)))
+
+        delivery = delivery.reindex(columns=self.REQUIRED_COLUMNS + self.DETAIL_COLUMNS, fill_value='')
+        delivery = delivery.apply(lambda column: column.str.strip())
+        delivery['item_id'] = delivery.item_id.str.upper()
+        #line in the file, counting from 1 for the column names
+        delivery.insert(0, 'line', delivery.index + 2)
+
+        #blank lines
+        return delivery[(delivery[self.REQUIRED_COLUMNS] != '').any(axis=1)].reset_index(drop=True)
+
+    @instruments.timed('make_delivery_stock_add')
+    def make_stock_add(self, delivery, stock):
+        """
+        Check the delivery against the stock and work out the change to each item
+
+        Arguments:
+            delivery: pd.DataFrame, from self.read_delivery()
+            stock: pd.DataFrame, the stock database indexed by item_id
+
+        Returns:
+            tuple, (pd.Series of int, the quantity added to each item indexed by item_id, in the order of the file;
+                    dict, item_id: change in stock for the existing items;
+                    pd.DataFrame, the stock rows of the new items indexed by item_id;
+                    pd.DataFrame, the preview of every line with the PREVIEW_COLUMNS, the rejected lines first)
+        """
+        quantities = pd.to_numeric(delivery.quantity, errors='coerce')
+        matches = delivery.item_id.map(stock.index.value_counts()).fillna(0)
+
+        #the details of a new item from whichever of its lines has them
+        details = delivery[self.DETAIL_COLUMNS].where(delivery[self.DETAIL_COLUMNS] != '').groupby(delivery.item_id, sort=False).first().fillna('')
+        new_details = details.reindex(delivery.item_id)
+
+        #the first problem found with each line, in order of the checks
+        reasons = pd.Series('', index=delivery.index)
+        for rejected, reason in [(delivery.item_id == '', 'No item id'),
+                                 (~((quantities > 0) & (quantities % 1 == 0)), 'Quantity is not a whole number above 0'),
+                                 (matches > 1, 'More than one item in the stock database with this id'),
+                                 ((matches == 0) & ((new_details.manufacturer.values == '') | (new_details.category.values == '')), 'New item without a manufacturer and category')]:
+            reasons[rejected & (reasons == '')] = reason
+        ok = reasons == ''
+
+        #total added to each item, existing items incremented and new items inserted
+        added = quantities[ok].astype(int).groupby(delivery.item_id[ok], sort=False).sum()
+        is_new = ~added.index.isin(stock.index)
+        stock_changes = added[~is_new].to_dict()
+        new_items = details.reindex(added.index[is_new]).assign(stock=added[is_new])
+        new_items = new_items.reindex(columns=stock.columns)
+        new_items.index.name = stock.index.name
+
+        #what each item will look like, then the rejected lines
+        first_lines = delivery[ok].drop_duplicates('item_id').set_index('item_id').line
+        current = stock[~stock.index.duplicated(keep='first')].reindex(added.index)
+        before = pd.to_numeric(current.stock, errors='coerce').fillna(0).astype(int)
+        preview = pd.DataFrame({
+            'line':first_lines.reindex(added.index).values,
+            'item_id':added.index,
+            'change':np.where(is_new, 'new item', 'add to stock'),
+            'stock':np.where(is_new, '', before.astype(str)),
+            'adding':added.values,
+            'new_stock':(before + added).values
+            })
+        for col in self.DETAIL_COLUMNS:
+            preview[col] = np.where(is_new, details.reindex(added.index)[col].values, current[col].astype(object).fillna('').astype(str).values)
+        rejected = delivery[~ok].assign(change='rejected: ' + reasons[~ok], stock='', adding=delivery.quantity[~ok], new_stock='')
+        preview = pd.concat([rejected, preview], ignore_index=True)[self.PREVIEW_COLUMNS]
+
+        return added, stock_changes, new_items, preview
@@ -0,0 +1,112 @@
+import PyQt5.QtWidgets as widgets
+from PyQt5.QtCore import QTimer
+import os
+import sys
+from instrumentation import instruments
+try:
+    import psutil
+except ImportError: # optional, the peak memory use is shown instead of the current
+    psutil = None
+try:
+    import resource
+except ImportError: # not on windows
+    resource = None
+
+class DiagnosticsTab(widgets.QWidget):
+    """
+    Tab showing where the time goes: the recent latencies of each timed span, the counters, the sizes of the database files and the memory use
+    Refreshed every REFRESH_INTERVAL while it's the current tab
+    """
+    REFRESH_INTERVAL = 2000 # ms between refreshes
+    SPAN_COLUMNS = ['Span', 'Count', 'Last ms', 'p50 ms', 'p95 ms', 'Max ms']
+    def __init__(self, files):
+        """
+        Arguments:
+            files: list of str, paths to the database files to show the sizes of
+        """
+        super().__init__()
+
+        self.files = files
+
+        self.refresh_timer = QTimer()
+        self.refresh_timer.setInterval(self.REFRESH_INTERVAL)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+        layout = widgets.QVBoxLayout()
+        self.setLayout(layout)
+
+        #spans, slowest p95 first
+        self.span_table = widgets.QTableWidget(0, len(self.SPAN_COLUMNS))
+        self.span_table.setHorizontalHeaderLabels(self.SPAN_COLUMNS)
+        self.span_table.verticalHeader().hide()
+        self.span_table.setEditTriggers(widgets.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.span_table)
+
+        self.counters_label = widgets.QLabel()
+        layout.addWidget(self.counters_label)
+        self.files_label = widgets.QLabel()
+        layout.addWidget(self.files_label)
+        self.memory_label = widgets.QLabel()
+        layout.addWidget(self.memory_label)
+
+        bottomBar = widgets.QHBoxLayout()
+        bottomBar.addStretch(1)
+        refreshButton = widgets.QPushButton("Refresh")
+        refreshButton.clicked.connect(self.refresh)
+        bottomBar.addWidget(refreshButton)
+        layout.addLayout(bottomBar)
+
+    def showEvent(self, event):
+        """
+        Override the showEvent QWidget SLOT, refresh while the tab is shown
+        """
+        self.refresh()
+        self.refresh_timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        """
+        Override the hideEvent QWidget SLOT
+        """
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        """
+        SLOT connected to self.refresh_timer.timeout() SIGNAL and refreshButton.clicked() SIGNAL in self.__init__()
+        """
+        summary = instruments.get_summary()
+        names = sorted(summary, key=lambda name: summary[name]['p95'], reverse=True)
+        self.span_table.setRowCount(len(names))
+        for row, name in enumerate(names):
+            stats = summary[name]
+            values = [name, str(stats['count'])] + ['{:.1f}'.format(stats[col]) for col in ('last', 'p50', 'p95', 'max')]
+            for col, value in enumerate(values):
+                self.span_table.setItem(row, col, widgets.QTableWidgetItem(value))
+        self.span_table.resizeColumnsToContents()
+
+        counters = instruments.get_counters()
+        self.counters_label.setText("Counters: " + (", ".join("{0}: {1}".format(name, value) for name, value in sorted(counters.items())) or "none yet"))
+
+        sizes = []
+        for filepath in self.files:
+            try:
+                sizes.append("{0}: {1:.1f} kB".format(filepath, os.path.getsize(filepath)/1024))
+            except OSError:
+                sizes.append("{}: missing".format(filepath))
+        self.files_label.setText("Files: " + ", ".join(sizes))
+
+        self.memory_label.setText("Memory: {}".format(self.get_memory()))
+
+    def get_memory(self):
+        """
+        Returns:
+            str, the memory used by the program
+        """
+        if psutil is not None:
+            return "{:.1f} MB".format(psutil.Process().memory_info().rss/1048576)
+        if resource is not None:
+            #ru_maxrss is in kB on linux, bytes on mac
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return "{:.1f} MB peak".format(peak/(1048576 if sys.platform == 'darwin' else 1024))
+        return "unknown, install psutil to show it"
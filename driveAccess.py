@@ -1,54 +1,459 @@
-from PyQt5.QtCore import QObject
+from PyQt5.QtCore import QObject, QCoreApplication
+from PyQt5.QtCore import pyqtSignal as Signal
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
+from googleapiclient.http import MediaFileUpload
+from googleapiclient.errors import HttpError
+from httplib2 import HttpLib2Error
+from driveDownloadStream import DriveDownloadStream
 import datetime as dt
 import pandas as pd
 import io
+import os
+import time
+import hashlib
+import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from instrumentation import instruments
 
 
 class DriveAccess(QObject):
     SCOPES = ['https://www.googleapis.com/auth/drive.file'] # view and manage files created with this app
     CREDENTIALS = "../client_secret.json" # file path to the credentials file
+    TOKEN = "../drive_token.json" # file path to the saved login, so the browser login is only needed once
+    MAX_TRANSFERS = 4 # number of files transferred at once by the group operations
+    WAIT_INTERVAL = 0.05 # seconds between processing GUI events while waiting for a group transfer
+    HASH_BLOCK_SIZE = 1048576 # bytes read at a time when hashing a local file
+    MANIFEST_FILEPATH = "drive_manifest.json" # file path to the cache of the drive file ids, modification times and checksums
+    FILE_FIELDS = "id, name, modifiedTime, md5Checksum" # drive file metadata fields kept in the manifest
+    BASE_FOLDER = "drive_base" # folder of copies of the files as they were in drive at the last sync, the base for merging the local and drive changes
+    CHUNK_SIZE = 1048576 # bytes sent or received per request in a transfer, must be a multiple of 256KB for uploads
+    MAX_RETRIES = 5 # times a failed chunk is retried before the transfer is given up
+    RETRY_WAIT = 1 # seconds before the first retry of a failed chunk, doubled for each retry after
+    progress_signal = Signal(float) # percentage done of the current group transfer, averaged over its files
+    file_progress_signal = Signal(str, float) # filename and fraction done of each file in the current group transfer
     def __init__(self):
         super().__init__()
         
         #dict to connect the filenames with file_ids
         self.file_ids = {}
         self.file_mod_times = {}
+        self.file_checksums = {} # md5 of the drive copy of each file
         
-        #connect with google drive to let the user log in
-        flow = InstalledAppFlow.from_client_secrets_file(self.CREDENTIALS, self.SCOPES)
-        creds = flow.run_local_server(port=0)
+        #md5 of each local file, with the (modification time, size) it was calculated for so it's only recalculated when the file changes
+        self.local_checksums = {}
+        #(modification time, size) of each local file when it was last written from or to drive, with the drive md5 at the time
+        self.synced = {}
+        #drive md5 of the copy of each file in BASE_FOLDER
+        self.base_checksums = {}
         
-        #service to send the requests to
+        #all the above are kept between runs in the manifest file
+        self.manifest_lock = threading.Lock()
+        self.load_manifest()
+        
+        #service to send the requests to, set by self.connect()
+        self.creds = None
+        self.service = None
+        
+        #threads for the group transfers, each with its own service in self.local
+        self.executor = ThreadPoolExecutor(max_workers=self.MAX_TRANSFERS)
+        self.local = threading.local()
+        
+    @instruments.timed('drive_connect')
+    def connect(self):
+        """
+        Log in to google drive, using the saved login if there is one and only asking the user to log in with the browser if it's missing or has expired
+        This blocks on the network, so it's run on a DriveWorker at startup
+        """
+        creds = None
+        try:
+            creds = Credentials.from_authorized_user_file(self.TOKEN, self.SCOPES)
+        except (FileNotFoundError, ValueError):
+            pass
+        
+        if creds is not None and not creds.valid and creds.expired and creds.refresh_token:
+            try:
+                creds.refresh(Request())
+            except RefreshError as err:
+                print('Saved login has expired: {}'.format(err))
+                creds = None
+        
+        if creds is None or not creds.valid:
+            #connect with google drive to let the user log in
+            flow = InstalledAppFlow.from_client_secrets_file(self.CREDENTIALS, self.SCOPES)
+            creds = flow.run_local_server(port=0)
+        
+        try:
+            with open(self.TOKEN, 'w') as f:
+                f.write(creds.to_json())
+        except PermissionError as err:
+            print("Couldn't save the login: {}".format(err))
+        
+        self.creds = creds
         self.service = build('drive', 'v3', credentials=creds)
         
+    def is_connected(self):
+        return self.service is not None
+        
+    def get_service(self):
+        """
+        Get the service for the current thread, the http connection it uses can't be shared between threads
+        """
+        if threading.current_thread() is threading.main_thread():
+            return self.service
+        
+        if not hasattr(self.local, 'service'):
+            self.local.service = build('drive', 'v3', credentials=self.creds)
+        return self.local.service
+        
+    def run_fileGroup(self, transfer, files):
+        """
+        Run a transfer for each file at once on the thread pool, returning once they have all finished
+        If called from the GUI thread, GUI events are processed while waiting so the progress signal can be shown
+        
+        Arguments:
+            transfer: function(filename, report_progress), transfers one file, report_progress(filename, fraction) is called as it goes
+            files: list of filenames
+        
+        Returns:
+            tuple, (list of the transfer results in the order of files, None where a transfer failed; dict, filename: exception for each failed transfer)
+        """
+        progress = {filename:0.0 for filename in files}
+        lock = threading.Lock()
+        def report_progress(filename, fraction):
+            with lock:
+                progress[filename] = fraction
+                percent = 100*sum(progress.values())/len(progress)
+            self.file_progress_signal.emit(filename, fraction)
+            self.progress_signal.emit(percent)
+        
+        futures = [self.executor.submit(transfer, filename, report_progress) for filename in files]
+        in_gui_thread = threading.current_thread() is threading.main_thread()
+        while wait(futures, timeout=self.WAIT_INTERVAL).not_done:
+            if in_gui_thread:
+                QCoreApplication.processEvents()
+        
+        results = []
+        errors = {}
+        for filename, future in zip(files, futures):
+            try:
+                results.append(future.result())
+            except Exception as err: # report any failure against its file rather than losing the other transfers
+                print('Transfer of {0} failed: {1}'.format(filename, err))
+                results.append(None)
+                errors[filename] = err
+            report_progress(filename, 1.0)
+        
+        return results, errors
+        
+    @instruments.timed('drive_pull_group')
     def pull_fileGroup(self, files):
         """
-        Pull down multiple files at once
+        Pull down multiple files at once, on up to MAX_TRANSFERS threads
         
         Arguments:
             files: list of filenames
         
         returns:
-            list of pd.DataFrames
+            tuple, (list of pd.DataFrames in the order of files, None for any that failed; dict, filename: exception for each file that failed)
         """
-        frames = []
-        for filename in files:
-            frames.append(self.pull(filename))
-        
-        return frames
+        return self.run_fileGroup(self.pull, files)
     
+    @instruments.timed('drive_push_group')
     def push_fileGroup(self, files):
         """
-        Push up multiple files at once
+        Push up multiple files at once, on up to MAX_TRANSFERS threads
+        Files not yet in google drive are uploaded as new files, files the same as their drive copy are skipped
+        Files changed in drive by another computer since the last sync aren't pushed over, they have to be pulled and merged first
+        
+        Each file is uploaded from a snapshot in BASE_FOLDER, which becomes its base once uploaded, so the base is exactly what's in drive
+        even if the local file is changed during the upload
         
         Arguments:
             files: list of filenames
+        
+        returns:
+            dict, filename: exception for each file that failed
+        """
+        found = self.getID_fileGroup(files)
+        def push_or_create(filename, report_progress):
+            exists = found[filename]
+            if exists and not self.is_changed(filename):
+                print('Skipping {}, unchanged'.format(filename))
+                return
+            if exists and self.is_remote_changed(filename):
+                raise RuntimeError('{} has been changed in google drive by another computer since the last sync, it will be merged at the next sync'.format(filename))
+            
+            os.makedirs(self.BASE_FOLDER, exist_ok=True)
+            snapshot = self.get_base_filepath(filename) + '.push'
+            signature = self.get_file_signature(filename)
+            shutil.copyfile(filename, snapshot)
+            self.push(filename, new=not exists, report_progress=report_progress, source=snapshot)
+            
+            os.replace(snapshot, self.get_base_filepath(filename))
+            with self.manifest_lock:
+                self.base_checksums[filename] = self.file_checksums.get(filename)
+                #the local file matches drive if it hasn't changed since the snapshot
+                self.synced[filename] = (signature, self.file_checksums.get(filename))
+        
+        results, errors = self.run_fileGroup(push_or_create, files)
+        self.save_manifest()
+        
+        return errors
+        
+    def load_manifest(self):
         """
+        Read the drive file ids, modification times and checksums, and the local checksums, saved by the last run
+        A missing or unreadable manifest just means everything is looked up again
+        """
+        try:
+            with open(self.MANIFEST_FILEPATH, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        
+        for filename, item in manifest.get('drive', {}).items():
+            self.set_drive_file(filename, item)
+        self.local_checksums = {filename:(tuple(signature), checksum) for filename, (signature, checksum) in manifest.get('local', {}).items()}
+        self.synced = {filename:(tuple(signature), checksum) for filename, (signature, checksum) in manifest.get('synced', {}).items()}
+        self.base_checksums = manifest.get('base', {})
+        
+    def save_manifest(self):
+        """
+        Write the manifest, to a temporary file first so it's never left half written
+        """
+        with self.manifest_lock:
+            manifest = {
+                'drive':{filename:{'id':self.file_ids[filename],
+                                   'modifiedTime':None if pd.isna(self.file_mod_times.get(filename)) else self.file_mod_times[filename].isoformat(),
+                                   'md5Checksum':self.file_checksums.get(filename)} for filename in self.file_ids},
+                'local':dict(self.local_checksums),
+                'synced':{filename:item for filename, item in self.synced.items() if item[0] is not None},
+                'base':dict(self.base_checksums)
+                }
+            temp_filepath = self.MANIFEST_FILEPATH + '.tmp'
+            try:
+                with open(temp_filepath, 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f)
+                os.replace(temp_filepath, self.MANIFEST_FILEPATH)
+            except PermissionError as err:
+                print("Couldn't save the drive manifest: {}".format(err))
+        
+    def set_drive_file(self, filename, item):
+        """
+        Keep the metadata of a drive file
+        
+        Arguments:
+            filename: str, name of the file
+            item: dict, the drive file metadata with the FILE_FIELDS
+        """
+        self.file_ids[filename] = item['id']
+        self.file_mod_times[filename] = pd.to_datetime(item.get('modifiedTime'), errors='coerce')
+        self.file_checksums[filename] = item.get('md5Checksum')
+        
+    def get_file_signature(self, filename):
+        """
+        Returns:
+            tuple, (modification time in ns, size in bytes) of the local file, None if it doesn't exist
+        """
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+        
+    def get_local_checksum(self, filename):
+        """
+        Get the md5 checksum of a local file, as drive calculates it, only re-reading the file if it has changed since the last time
+        
+        Arguments:
+            filename: str, path to the local file
+        
+        Returns:
+            str, the hex md5 checksum, None if the file doesn't exist
+        """
+        signature = self.get_file_signature(filename)
+        if signature is None:
+            return None
+        
+        cached = self.local_checksums.get(filename)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        
+        checksum = self.hash_file(filename)
+        self.local_checksums[filename] = (signature, checksum)
+        
+        return checksum
+        
+    def hash_file(self, filepath):
+        """
+        Returns:
+            str, the hex md5 checksum of the file
+        """
+        md5 = hashlib.md5()
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(self.HASH_BLOCK_SIZE), b''):
+                md5.update(block)
+        
+        return md5.hexdigest()
+        
+    def mark_synced(self, filename):
+        """
+        Record that the local file matches its drive copy, e.g. after writing out a pulled file which won't be byte for byte the same
+        """
+        self.synced[filename] = (self.get_file_signature(filename), self.file_checksums.get(filename))
+        self.set_base(filename)
+        
+    def get_base_filepath(self, filename):
+        return os.path.join(self.BASE_FOLDER, filename)
+        
+    def set_base(self, filename, frame=None):
+        """
+        Keep a copy of the file as it is in drive, the base the local and drive changes are merged from at the next sync
+        
+        Arguments:
+            filename: str, name of the file
+            frame: pd.DataFrame, the copy pulled from drive, if None the local file is copied as it matches drive
+        """
+        os.makedirs(self.BASE_FOLDER, exist_ok=True)
+        base_filepath = self.get_base_filepath(filename)
+        temp_filepath = base_filepath + '.tmp'
+        try:
+            if frame is None:
+                shutil.copyfile(filename, temp_filepath)
+            else:
+                frame.to_csv(temp_filepath, index=False)
+            os.replace(temp_filepath, base_filepath)
+        except (FileNotFoundError, PermissionError) as err:
+            print("Couldn't keep the sync base of {0}: {1}".format(filename, err))
+            return
+        
+        with self.manifest_lock:
+            self.base_checksums[filename] = self.file_checksums.get(filename)
+        self.save_manifest()
+        
+    def get_base(self, filename):
+        """
+        Returns:
+            pd.DataFrame, the copy of the file from the last sync with every column as text, None if there isn't one
+        """
+        if self.base_checksums.get(filename) is None:
+            return None
+        try:
+            return pd.read_csv(self.get_base_filepath(filename), dtype=str, keep_default_na=False)
+        except FileNotFoundError:
+            return None
+        
+    def is_local_changed(self, filename):
+        """
+        Returns:
+            bool, True if the local file has been changed since it was last pulled or pushed
+        """
+        synced = self.synced.get(filename)
+        return synced is None or synced[0] != self.get_file_signature(filename)
+        
+    def is_remote_changed(self, filename):
+        """
+        Check if the drive copy has been changed by another computer since the last sync, the drive copy must have been looked up with self.getID()
+        
+        Returns:
+            bool, True if the drive copy differs from the base, False if there is no base to tell from
+        """
+        base_checksum = self.base_checksums.get(filename)
+        remote_checksum = self.file_checksums.get(filename)
+        return base_checksum is not None and remote_checksum is not None and base_checksum != remote_checksum
+        
+    def is_changed(self, filename):
+        """
+        Check if the local file differs from its drive copy, the drive copy must have been looked up with self.getID()
+        
+        Arguments:
+            filename: str, name of the file
+        
+        Returns:
+            bool, True if the contents differ or either copy is missing
+        """
+        remote_checksum = self.file_checksums.get(filename)
+        if remote_checksum is None:
+            return True
+        
+        if self.synced.get(filename) == (self.get_file_signature(filename), remote_checksum):
+            return False
+        
+        return self.get_local_checksum(filename) != remote_checksum
+        
+    def compare_fileGroup(self, files):
+        """
+        Compare the local files with their drive copies, looking up the drive copies in a single query
+        
+        Arguments:
+            files: list of filenames
+        
+        Returns:
+            pd.DataFrame indexed by filename, with columns local and remote, the modification times (UTC) or NaT if missing,
+            changed, True if the contents differ, and newer, 'local', 'remote' or '' if unchanged
+        """
+        found = self.getID_fileGroup(files)
+        exists = [found[filename] for filename in files]
+        
+        comparison = pd.DataFrame(index=pd.Index(files, name='filename'))
+        comparison['local'] = [pd.Timestamp(signature[0], unit='ns', tz='UTC') if signature is not None else pd.NaT for signature in map(self.get_file_signature, files)]
+        comparison['remote'] = [self.file_mod_times[filename] if found else pd.NaT for filename, found in zip(files, exists)]
+        comparison['changed'] = [self.is_changed(filename) if found else True for filename, found in zip(files, exists)]
+        
+        comparison['newer'] = ''
+        remote_newer = comparison.changed & comparison.remote.notna() & (comparison.local.isna() | (comparison.remote > comparison.local))
+        comparison.loc[comparison.changed & comparison.local.notna() & ~remote_newer, 'newer'] = 'local'
+        comparison.loc[remote_newer, 'newer'] = 'remote'
+        
+        return comparison
+        
+    @instruments.timed('drive_lookup')
+    def getID_fileGroup(self, files):
+        """
+        Look up the drive copies of multiple files with a single list query, keeping the latest version of each
+        The file ids, modification times and checksums are saved to the manifest
+        
+        Arguments:
+            files: list of filenames
+        
+        Returns:
+            dict, filename: bool, True if the file is in google drive
+        """
+        names = " or ".join("name = '{}'".format(filename.replace("\\", "\\\\").replace("'", "\\'")) for filename in files)
+        query = "({}) and trashed = false".format(names)
+        
+        latest = {}
+        page_token = None
+        while True:
+            results = self.get_service().files().list(q=query, pageSize=100, pageToken=page_token, fields="nextPageToken, files({})".format(self.FILE_FIELDS)).execute()
+            for item in results.get('files', []):
+                #get the latest version
+                if item['name'] not in latest or item['modifiedTime'] > latest[item['name']]['modifiedTime']:
+                    latest[item['name']] = item
+            page_token = results.get('nextPageToken')
+            if page_token is None:
+                break
+        
+        found = {}
         for filename in files:
-            self.push(filename)
+            found[filename] = filename in latest
+            if found[filename]:
+                self.set_drive_file(filename, latest[filename])
+            else:
+                #forget any copy that has been deleted from drive
+                self.file_ids.pop(filename, None)
+                self.file_mod_times.pop(filename, None)
+                self.file_checksums.pop(filename, None)
+        
+        self.save_manifest()
+        
+        return found
         
     def getID(self, filename):
         """
@@ -56,64 +461,81 @@ class DriveAccess(QObject):
         
         Arguments:
             filename: str, name of the file
+        
+        Returns:
+            bool, True if the file is in google drive
         """
-        results = self.service.files().list(q="name = '{}'".format(filename), pageSize=10, fields="nextPageToken, files(id, name, modifiedTime)").execute()
-        items = results.get('files', [])
-
-        if not items:
-            return False
-        else:
-            # print('Files:')
-            files = pd.DataFrame()
-            for item in items:
-                # print(u'{0}, {1}, {2}'.format(item['name'], item['id'], item['modifiedTime']))
-                files = files.append({'name':item['name'], 'id':item['id'], 'time':item['modifiedTime']}, ignore_index=True)
-            
-            #get the latest version
-            files.time = pd.to_datetime(files.time, errors='coerce')
-            files = files.sort_values('time', ascending=False)
-            
-            self.file_ids[filename] = files.id.iloc[0]
-            self.file_mod_times[filename] = files.time.iloc[0]
-            
-            return True
-            
-    
+        return self.getID_fileGroup([filename])[filename]
         
-    def pull(self, filename):
+    def next_chunk(self, request, filename):
         """
-        Pull down the data files 
+        Transfer the next chunk of a resumable upload or download, retrying if the connection drops or drive has a server error
+        The upload and download requests keep track of how much has been transferred, so a retry carries on from the last good chunk
+        
+        Arguments:
+            request: the upload request or MediaIoBaseDownload
+            filename: str, name of the file being transferred, for the messages
+        
+        Returns:
+            tuple, (progress of the transfer, upload: the file metadata once done else None, download: bool, done) from request.next_chunk()
+        
+        Raises:
+            the last error if the chunk still fails after MAX_RETRIES retries, or straight away for errors a retry won't fix, e.g. file not found
+        """
+        retries = 0
+        while True:
+            try:
+                return request.next_chunk()
+            except (HttpError, HttpLib2Error, OSError) as err:
+                #4xx errors other than rate limiting won't be fixed by trying again
+                if isinstance(err, HttpError) and err.resp.status < 500 and err.resp.status != 429:
+                    raise
+                if retries >= self.MAX_RETRIES:
+                    raise
+                retry_wait = self.RETRY_WAIT*2**retries
+                retries += 1
+                instruments.count('drive_retries')
+                print('Transfer of {0} interrupted ({1}), retry {2} in {3}s'.format(filename, err, retries, retry_wait))
+                time.sleep(retry_wait)
+        
+    @instruments.timed('drive_pull')
+    def pull(self, filename, report_progress=None):
+        """
+        Pull down the data files, parsing the csv as each chunk arrives so the whole file is never held in memory
+        Every column is kept as text, so the file is written back out as it was and can be compared row by row for merging
         
         Arguments:
             filename: Name of the file we want to pull down
+            report_progress: function(filename, fraction), called as the download progresses
         """
         if filename not in self.file_ids.keys():
             success = self.getID(filename)
             if not success:
                 raise FileNotFoundError('File not found in google drive')
             
-        #download the file
-        request = self.service.files().get_media(fileId = self.file_ids[filename])
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-            print('Pulling {0}, Download: {1} %'.format(filename, status.progress()*100))
-
-        fh.seek(0)
-        df = pd.read_csv(fh, encoding='utf-8')
-
+        def fetch(downloader):
+            status, done = self.next_chunk(downloader, filename)
+            if report_progress is not None:
+                report_progress(filename, status.progress())
+            return status, done
+        
+        #download the file, a chunk at a time as the csv reader asks for it
+        request = self.get_service().files().get_media(fileId = self.file_ids[filename])
+        stream = DriveDownloadStream(request, self.CHUNK_SIZE, fetch)
+        df = pd.read_csv(io.BufferedReader(stream, self.CHUNK_SIZE), encoding='utf-8', dtype=str, keep_default_na=False)
+        
         return df
         
-    def push(self, filename, new=False):
+    @instruments.timed('drive_push')
+    def push(self, filename, new=False, report_progress=None, source=None):
         """
-        Push the input dataframe back to drive with the input filename
+        Push the local file back to drive with the same filename, read from disk a chunk at a time
         
         Arguments:
             filename: str, the path to save to and get the data from
             new: bool, is this a new file upload
+            report_progress: function(filename, fraction), called as the upload progresses
+            source: str, path to upload the data from instead of filename, e.g. a snapshot of it
         """
         if filename not in self.file_ids.keys() and not new:
             success = self.getID(filename)
@@ -123,15 +545,24 @@ class DriveAccess(QObject):
         file_metadata = {
         'name': filename
         }
-        media = MediaFileUpload(filename,
+        media = MediaFileUpload(filename if source is None else source,
                                 mimetype='text/csv',
+                                chunksize=self.CHUNK_SIZE,
                                 resumable=True)
         
         if new:
-            file = self.service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-            self.file_ids[filename] = file.get('id')
+            request = self.get_service().files().create(body=file_metadata, media_body=media, fields='id, modifiedTime, md5Checksum')
         else:
-            file = self.service.files().update(fileId=self.file_ids[filename], body=file_metadata, media_body=media).execute()
+            request = self.get_service().files().update(fileId=self.file_ids[filename], body=file_metadata, media_body=media, fields='id, modifiedTime, md5Checksum')
+        
+        #upload a chunk at a time to report the progress
+        file = None
+        while file is None:
+            status, file = self.next_chunk(request, filename)
+            if status is not None and report_progress is not None:
+                report_progress(filename, status.progress())
+        
+        self.set_drive_file(filename, file)
         
         print('Pushed {}'.format(filename))
         
@@ -0,0 +1,43 @@
+from googleapiclient.http import MediaIoBaseDownload
+import io
+
+class DriveDownloadStream(io.RawIOBase):
+    """
+    Read-only file object over a google drive download, fetching the next chunk only when the reader needs more
+    Passed to pd.read_csv so the file is parsed as it downloads and only one chunk is held in memory at a time
+    """
+    def __init__(self, request, chunksize, fetch):
+        """
+        Arguments:
+            request: the files().get_media() request for the file
+            chunksize: int, bytes downloaded at a time
+            fetch: function(downloader), downloads the next chunk with downloader.next_chunk() and returns what it returns,
+                   so the caller can retry failed chunks and report the progress
+        """
+        super().__init__()
+
+        #the downloader writes each chunk into self.chunk, which is then read out before the next one is fetched
+        self.chunk = io.BytesIO()
+        self.downloader = MediaIoBaseDownload(self.chunk, request, chunksize=chunksize)
+        self.fetch = fetch
+        self.done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        """
+        Fill b with the next bytes of the file, downloading another chunk if the current one has been read
+
+        Returns:
+            int, number of bytes read, 0 at the end of the file
+        """
+        n = self.chunk.readinto(b)
+        while n == 0 and not self.done:
+            self.chunk.seek(0)
+            self.chunk.truncate()
+            status, self.done = self.fetch(self.downloader)
+            self.chunk.seek(0)
+            n = self.chunk.readinto(b)
+
+        return n
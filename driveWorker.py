@@ -0,0 +1,37 @@
+from PyQt5.QtCore import pyqtSignal as Signal
+from PyQt5.QtCore import QObject, QRunnable
+
+class DriveWorkerSignals(QObject):
+    """
+    Signals for the DriveWorker, a QRunnable can't emit signals itself
+    """
+    finished = Signal(object) # the value returned by the task
+    failed = Signal(object) # the exception raised by the task
+
+class DriveWorker(QRunnable):
+    """
+    Run a google drive task, e.g. logging in or pulling the files, on a QThreadPool thread so the window isn't blocked by the network
+    The result is sent back to the GUI thread with the finished or failed signal
+    """
+    def __init__(self, task, *args):
+        """
+        Arguments:
+            task: function to run
+            args: arguments to the task
+        """
+        super().__init__()
+
+        self.task = task
+        self.args = args
+
+        self.signals = DriveWorkerSignals()
+
+    def run(self):
+        try:
+            result = self.task(*self.args)
+        except Exception as err: # sent back to be shown in the GUI thread rather than lost on the worker thread
+            print('Drive task failed: {}'.format(err))
+            self.signals.failed.emit(err)
+            return
+
+        self.signals.finished.emit(result)
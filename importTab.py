@@ -0,0 +1,129 @@
+import PyQt5.QtWidgets as widgets
+from PyQt5.QtCore import pyqtSignal as Signal
+from PyQt5.QtCore import Qt
+import pandas as pd
+
+class ImportTab(widgets.QWidget):
+    """
+    Tab for importing a csv file in one go, e.g. an ebay orders report
+    The file chosen is sent to MainWindow to check, which shows what will be imported and a report of any problems in the table before the import button is pressed
+    """
+    file_signal = Signal(str)
+    commit_signal = Signal()
+    MAX_ROWS_SHOWN = 1000 # rows put in the table, the saved report has them all
+    def __init__(self, instructions, commit_text="Import"):
+        """
+        Arguments:
+            instructions: str, what file to choose and what happens to it
+            commit_text: str, text of the import button
+        """
+        super().__init__()
+
+        self.report = pd.DataFrame()
+
+        layout = widgets.QVBoxLayout()
+        self.setLayout(layout)
+
+        instructionsLabel = widgets.QLabel(instructions)
+        instructionsLabel.setWordWrap(True)
+        layout.addWidget(instructionsLabel)
+
+        fileBar = widgets.QHBoxLayout()
+        openButton = widgets.QPushButton("Open file...")
+        openButton.clicked.connect(self.choose_file)
+        openButton.setFocusPolicy(Qt.ClickFocus)
+        fileBar.addWidget(openButton)
+        self.file_label = widgets.QLabel("No file chosen")
+        fileBar.addWidget(self.file_label, 1)
+        layout.addLayout(fileBar)
+
+        self.summary_label = widgets.QLabel()
+        self.summary_label.setWordWrap(True)
+        layout.addWidget(self.summary_label)
+
+        self.table = widgets.QTableWidget(0, 0)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(widgets.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        bottomBar = widgets.QHBoxLayout()
+        self.save_button = widgets.QPushButton("Save report...")
+        self.save_button.clicked.connect(self.save_report)
+        self.save_button.setFocusPolicy(Qt.ClickFocus)
+        bottomBar.addWidget(self.save_button)
+        bottomBar.addStretch(1)
+        self.commit_button = widgets.QPushButton(commit_text)
+        self.commit_button.clicked.connect(self.emit_commit_signal)
+        self.commit_button.setFocusPolicy(Qt.ClickFocus)
+        bottomBar.addWidget(self.commit_button)
+        layout.addLayout(bottomBar)
+
+        self.set_report("", self.report, False)
+
+    def choose_file(self):
+        """
+        SLOT connected to openButton.clicked() SIGNAL in self.__init__()
+        """
+        filepath, file_filter = widgets.QFileDialog.getOpenFileName(self, "Open file", "", "CSV files (*.csv);;All files (*)")
+        if filepath:
+            self.open_file(filepath)
+
+    def open_file(self, filepath):
+        """
+        Send the file to be checked, the table is filled by self.set_report()
+        """
+        self.file_label.setText(filepath)
+        self.file_signal.emit(filepath)
+
+    def set_report(self, summary, report, can_commit):
+        """
+        Show the outcome of checking or importing the file
+
+        Arguments:
+            summary: str, e.g. how many rows will be imported
+            report: pd.DataFrame, the rows to show in the table, e.g. the rejected lines
+            can_commit: bool, enable the import button
+        """
+        self.report = report
+
+        shown = report.iloc[:self.MAX_ROWS_SHOWN]
+        if len(report) > len(shown):
+            summary += "\nThe first {} rows are shown, save the report to see them all.".format(len(shown))
+        self.summary_label.setText(summary)
+
+        self.table.clear()
+        self.table.setColumnCount(len(shown.columns))
+        self.table.setRowCount(len(shown))
+        self.table.setHorizontalHeaderLabels([str(col) for col in shown.columns])
+        for row, values in enumerate(shown.itertuples(index=False, name=None)):
+            for col, value in enumerate(values):
+                self.table.setItem(row, col, widgets.QTableWidgetItem('' if pd.isna(value) else str(value)))
+        self.table.resizeColumnsToContents()
+
+        self.save_button.setEnabled(len(report) > 0)
+        self.commit_button.setEnabled(can_commit)
+
+    def save_report(self):
+        """
+        Save all the rows of the report to a csv file
+
+        SLOT connected to self.save_button.clicked() SIGNAL in self.__init__()
+        """
+        filepath, file_filter = widgets.QFileDialog.getSaveFileName(self, "Save report", "report.csv", "CSV files (*.csv)")
+        if not filepath:
+            return
+
+        try:
+            self.report.to_csv(filepath, index=False)
+        except PermissionError as err:
+            msg = widgets.QMessageBox()
+            msg.setIcon(widgets.QMessageBox.Warning)
+            msg.setText("Save failed")
+            msg.setInformativeText("The report could not be saved to {}, check the file is not open elsewhere.".format(filepath))
+            msg.setDetailedText("{}".format(err))
+            msg.setWindowTitle("Save failed")
+            msg.setStandardButtons(widgets.QMessageBox.Ok)
+            msg.exec_()
+
+    def emit_commit_signal(self):
+        self.commit_signal.emit()
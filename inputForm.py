@@ -5,25 +5,34 @@ from PyQt5.QtCore import Qt
 import pandas as pd
 # import numpy as np
 from item import Item
+from instrumentation import instruments
 
 class InputForm(widgets.QWidget):
     undo_signal = Signal()
+    redo_signal = Signal()
     commit_signal = Signal()
-    def __init__(self, stock_filepath, stock_input_form):
+    def __init__(self, stock_db, stock_input_form):
         super().__init__()
         
-        self.STOCK_FILEPATH = stock_filepath
+        self.stock_db = stock_db # shared StockDatabase
         self.STOCK_INPUT_FORM = stock_input_form
         
         #Main layout
         self.layout = widgets.QVBoxLayout()
         self.setLayout(self.layout)
         
-        #undo button
+        #undo and redo buttons
+        undoLayout = widgets.QHBoxLayout()
         undo_button = widgets.QPushButton("Undo")
         undo_button.clicked.connect(self.emit_undo_signal)
         undo_button.setFocusPolicy(Qt.ClickFocus)
-        self.layout.addWidget(undo_button)
+        undoLayout.addWidget(undo_button)
+        
+        redo_button = widgets.QPushButton("Redo")
+        redo_button.clicked.connect(self.emit_redo_signal)
+        redo_button.setFocusPolicy(Qt.ClickFocus)
+        undoLayout.addWidget(redo_button)
+        self.layout.addLayout(undoLayout)
 
     def addItemLayout(self):
         self.itemLayout = widgets.QVBoxLayout()
@@ -41,27 +50,12 @@ class InputForm(widgets.QWidget):
         commit_button.setFocusPolicy(Qt.ClickFocus)
         self.layout.addWidget(commit_button)
         
-    def load_stock_database(self):
-        """
-        Load the stock database using the filepath defined in self.__init__() from parent
-        """
-        stock = pd.read_csv(self.STOCK_FILEPATH)
-        stock.item_id = stock.item_id.astype(str)
-        stock.item_id = stock.item_id.apply(str.upper)
-        stock = stock.set_index('item_id')
-        
-        return stock
-        
+    @instruments.timed('fill_item')
     def fill_item(self, edit_num, item_id):
         """
         Find the item in the stock database with the given item_id
         """
-        stock = self.load_stock_database()
-    
-        try:
-            item = stock.loc[item_id]
-        except KeyError:
-            item = pd.Series()
+        item = self.stock_db.get_item(item_id)
             
         #more than one item with the same id
         if type(item) == pd.DataFrame:
@@ -99,6 +93,9 @@ class InputForm(widgets.QWidget):
     def emit_undo_signal(self):
         self.undo_signal.emit()
         
+    def emit_redo_signal(self):
+        self.redo_signal.emit()
+        
     def emit_commit_signal(self):
         self.commit_signal.emit()
         
\ No newline at end of file
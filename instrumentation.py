@@ -0,0 +1,151 @@
+import collections
+import functools
+import inspect
+import json
+import logging
+import logging.handlers
+import threading
+import time
+
+class Instrumentation():
+    """
+    Lightweight timing and counting of the hot paths: the slots, google drive calls and database file reads and writes
+
+    Each timed call is a span, written as a json line to a rotating log file once the log has been started with self.start_log(),
+    and kept in memory, the last RECENT_SPANS of each name, for the diagnostics tab.
+    Counters count events without timing them, e.g. search results sent back.
+
+    Spans can be taken from any thread, e.g. the search and drive workers.
+    """
+    RECENT_SPANS = 500 # spans of each name kept for the latency percentiles
+    LOG_MAX_BYTES = 1048576 # size at which the log file is rotated
+    LOG_BACKUP_COUNT = 3 # old log files kept
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = {} # name: deque of durations in seconds
+        self.counters = collections.Counter()
+
+        self.logger = logging.getLogger('stock_control.instrumentation')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def start_log(self, filepath):
+        """
+        Write the spans to a rotating log file
+
+        Arguments:
+            filepath: str, path to the log file, the old logs have .1, .2... added
+        """
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        try:
+            handler = logging.handlers.RotatingFileHandler(filepath, maxBytes=self.LOG_MAX_BYTES, backupCount=self.LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
+        except OSError as err:
+            print("Couldn't open the diagnostics log: {}".format(err))
+            return
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger.addHandler(handler)
+
+    def record(self, name, seconds, **fields):
+        """
+        Keep a span and write it to the log
+
+        Arguments:
+            name: str, what was timed
+            seconds: float, how long it took
+            fields: anything else to log with the span, e.g. the number of rows, must be json serializable
+        """
+        with self.lock:
+            if name not in self.spans:
+                self.spans[name] = collections.deque(maxlen=self.RECENT_SPANS)
+            self.spans[name].append(seconds)
+
+        if self.logger.handlers:
+            self.logger.info(json.dumps({'time':round(time.time(), 3), 'span':name, 'ms':round(1000*seconds, 3), 'thread':threading.current_thread().name, **fields}, default=str))
+
+    def span(self, name, **fields):
+        """
+        Time a block of code:
+            with instruments.span('name'):
+                ...
+
+        Returns:
+            context manager
+        """
+        return Span(self, name, fields)
+
+    def timed(self, name):
+        """
+        Decorator timing every call of a function or method
+
+        Qt drops any signal arguments a slot doesn't take, e.g. the checked argument of clicked(),
+        the decorated function is called the same way so it can still be connected as a slot.
+
+        Arguments:
+            name: str, name of the spans
+        """
+        def decorator(function):
+            parameters = inspect.signature(function).parameters.values()
+            takes_args = any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters)
+            max_args = len([parameter for parameter in parameters if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)])
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not takes_args:
+                    args = args[:max_args]
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def get_summary(self):
+        """
+        Returns:
+            dict, span name: dict with count, last, p50, p95 and max in ms, over the recent spans of that name
+        """
+        with self.lock:
+            spans = {name:sorted(durations) for name, durations in self.spans.items()}
+            last = {name:durations[-1] for name, durations in self.spans.items() if durations}
+
+        summary = {}
+        for name, durations in spans.items():
+            if not durations:
+                continue
+            summary[name] = {'count':len(durations),
+                             'last':1000*last[name],
+                             'p50':1000*durations[int(0.5*(len(durations)-1))],
+                             'p95':1000*durations[int(0.95*(len(durations)-1))],
+                             'max':1000*durations[-1]}
+        return summary
+
+    def get_counters(self):
+        with self.lock:
+            return dict(self.counters)
+
+class Span():
+    """
+    Context manager recording how long its block took with an Instrumentation, see Instrumentation.span()
+    """
+    def __init__(self, instrumentation, name, fields):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.instrumentation.record(self.name, time.perf_counter() - self.start, **self.fields)
+        return False
+
+#shared by all the modules, so the diagnostics tab sees every span
+instruments = Instrumentation()
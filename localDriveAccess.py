@@ -0,0 +1,97 @@
+import datetime as dt
+import pandas as pd
+import os
+import shutil
+from driveAccess import DriveAccess
+from instrumentation import instruments
+
+class LocalDriveAccess(DriveAccess):
+    """
+    Stand-in for DriveAccess keeping the drive copies of the files in a local folder, used when MainWindow.DRIVE_FOLDER is set
+    For trying out and testing the sync without a network or a google account, e.g. with MainWindow.TEST
+
+    Only the requests to drive are replaced, the group transfers, checksums and manifest are the same as for google drive.
+    Setting self.online to False makes every request fail as if the network was down.
+    """
+    MANIFEST_FILEPATH = "local_drive_manifest.json"
+    def __init__(self, folder):
+        """
+        Arguments:
+            folder: str, path to the folder standing in for google drive, created if it doesn't exist
+        """
+        super().__init__()
+
+        self.FOLDER = folder
+        os.makedirs(folder, exist_ok=True)
+
+        self.online = True
+        self.connected = False
+
+    def check_online(self):
+        if not self.online:
+            raise ConnectionError("Local drive folder {} is offline".format(self.FOLDER))
+
+    @instruments.timed('drive_connect')
+    def connect(self):
+        self.check_online()
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    def get_file_metadata(self, filename):
+        """
+        Returns:
+            dict, the drive metadata fields of the copy of the file in the folder
+        """
+        filepath = os.path.join(self.FOLDER, filename)
+        modified_time = dt.datetime.fromtimestamp(os.path.getmtime(filepath), dt.timezone.utc)
+
+        return {'id':filepath, 'name':filename, 'modifiedTime':modified_time.isoformat(), 'md5Checksum':self.hash_file(filepath)}
+
+    @instruments.timed('drive_lookup')
+    def getID_fileGroup(self, files):
+        self.check_online()
+
+        found = {}
+        for filename in files:
+            found[filename] = os.path.exists(os.path.join(self.FOLDER, filename))
+            if found[filename]:
+                self.set_drive_file(filename, self.get_file_metadata(filename))
+            else:
+                self.file_ids.pop(filename, None)
+                self.file_mod_times.pop(filename, None)
+                self.file_checksums.pop(filename, None)
+
+        self.save_manifest()
+
+        return found
+
+    @instruments.timed('drive_pull')
+    def pull(self, filename, report_progress=None):
+        self.check_online()
+        if filename not in self.file_ids.keys():
+            success = self.getID(filename)
+            if not success:
+                raise FileNotFoundError('File not found in the local drive folder')
+
+        df = pd.read_csv(self.file_ids[filename], encoding='utf-8', dtype=str, keep_default_na=False)
+        if report_progress is not None:
+            report_progress(filename, 1.0)
+
+        return df
+
+    @instruments.timed('drive_push')
+    def push(self, filename, new=False, report_progress=None, source=None):
+        self.check_online()
+
+        #copy to a temporary file first so the drive copy is never left half written
+        filepath = os.path.join(self.FOLDER, filename)
+        shutil.copyfile(filename if source is None else source, filepath + '.tmp')
+        os.replace(filepath + '.tmp', filepath)
+
+        self.set_drive_file(filename, self.get_file_metadata(filename))
+        if report_progress is not None:
+            report_progress(filename, 1.0)
+
+        print('Pushed {}'.format(filename))
@@ -0,0 +1,208 @@
+import heapq
+import os
+import threading
+import pandas as pd
+
+class LowStockIndex():
+    """
+    The items needing reordering, those with less stock than their reorder threshold, most short first
+
+    An item's threshold is its own if it has one in the thresholds file, otherwise that of its category, otherwise DEFAULT_THRESHOLD.
+    The thresholds file is a csv with item_id, category and threshold columns, a row with an item_id sets that item's threshold and a row with only a category sets the category's.
+
+    The shortfall (threshold minus stock) of each low item is kept in self.shortfalls and in a heap of (-shortfall, item_id), so the most urgent come first.
+    Like the SearchIndex it is built once from the stock frame, then only the items whose stock or category changed are updated on each save.
+    A changed item gets a new heap entry and its old one is skipped when read, the heap is rebuilt once the stale entries outnumber the live ones.
+    Updates and reads hold self.lock so the low items can be read from any thread.
+    """
+    DEFAULT_THRESHOLD = 15 # reorder threshold of items without their own or a category threshold
+    WATCH_COLUMNS = ['stock', 'category'] # columns which change an item's shortfall
+    NO_SIGNATURE = None
+    def __init__(self, thresholds_filepath=None):
+        """
+        Arguments:
+            thresholds_filepath: str, path to the optional csv file of reorder thresholds
+        """
+        self.THRESHOLDS_FILEPATH = thresholds_filepath
+
+        self.item_thresholds = pd.Series(dtype=float) # upper case item_id: threshold
+        self.category_thresholds = pd.Series(dtype=float) # lower case category: threshold
+        self.thresholds_signature = self.NO_SIGNATURE
+
+        self.shortfalls = {} # item_id: shortfall of the low items
+        self.heap = [] # (-shortfall, item_id), including stale entries for items changed since
+        self.lock = threading.Lock()
+
+    def get_thresholds_signature(self):
+        """
+        Returns:
+            tuple, (modification time in ns, size in bytes) of the thresholds file, NO_SIGNATURE if there isn't one
+        """
+        if self.THRESHOLDS_FILEPATH is None:
+            return self.NO_SIGNATURE
+        try:
+            stat = os.stat(self.THRESHOLDS_FILEPATH)
+        except FileNotFoundError:
+            return self.NO_SIGNATURE
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def is_thresholds_changed(self):
+        """
+        Returns:
+            bool, True if the thresholds file has been edited since it was read, so the index needs building again
+        """
+        return self.get_thresholds_signature() != self.thresholds_signature
+
+    def read_thresholds(self):
+        """
+        Read the item and category thresholds from the thresholds file, rows without a number for the threshold are ignored
+        """
+        self.thresholds_signature = self.get_thresholds_signature()
+        self.item_thresholds = pd.Series(dtype=float)
+        self.category_thresholds = pd.Series(dtype=float)
+        if self.thresholds_signature is self.NO_SIGNATURE:
+            return
+
+        try:
+            thresholds = pd.read_csv(self.THRESHOLDS_FILEPATH, dtype=str, keep_default_na=False).reindex(columns=['item_id', 'category', 'threshold'], fill_value='')
+        except (OSError, ValueError) as err:
+            print("Couldn't read the reorder thresholds: {}".format(err))
+            return
+
+        values = pd.to_numeric(thresholds.threshold, errors='coerce')
+        item_ids = thresholds.item_id.str.strip().str.upper()
+        categories = thresholds.category.str.strip().str.lower()
+
+        is_item = (item_ids != '') & values.notna()
+        is_category = (item_ids == '') & (categories != '') & values.notna()
+        self.item_thresholds = pd.Series(values[is_item].values, index=item_ids[is_item].values)
+        self.category_thresholds = pd.Series(values[is_category].values, index=categories[is_category].values)
+        #the last row wins if an item or category is given twice
+        self.item_thresholds = self.item_thresholds[~self.item_thresholds.index.duplicated(keep='last')]
+        self.category_thresholds = self.category_thresholds[~self.category_thresholds.index.duplicated(keep='last')]
+
+    def get_shortfalls(self, stock):
+        """
+        Arguments:
+            stock: pd.DataFrame, stock rows indexed by item_id
+
+        Returns:
+            pd.Series of float indexed by item_id, each item's threshold minus its stock, low items are above 0
+        """
+        thresholds = pd.Series(float(self.DEFAULT_THRESHOLD), index=stock.index)
+        if 'category' in stock.columns and len(self.category_thresholds) > 0:
+            thresholds = stock.category.astype(object).fillna('').astype(str).str.lower().map(self.category_thresholds).fillna(thresholds)
+        if len(self.item_thresholds) > 0:
+            thresholds = pd.Series(stock.index.map(self.item_thresholds), index=stock.index).fillna(thresholds)
+
+        return thresholds - pd.to_numeric(stock.stock, errors='coerce')
+
+    def build(self, stock):
+        """
+        Find the low items of the whole stock frame from scratch, re-reading the thresholds file
+
+        Arguments:
+            stock: pd.DataFrame, indexed by item_id
+        """
+        self.read_thresholds()
+        shortfalls = self.get_shortfalls(stock)
+        if not shortfalls.index.is_unique:
+            shortfalls = shortfalls.groupby(level=0).max()
+        low = shortfalls[shortfalls > 0]
+
+        with self.lock:
+            self.shortfalls = dict(zip(low.index, low.values))
+            self.heap = list(zip(-low.values, low.index))
+            heapq.heapify(self.heap)
+
+    def update(self, old_stock, stock):
+        """
+        Update only the items which have been added, removed or had their stock or category changed
+
+        Arguments:
+            old_stock: pd.DataFrame, the stock frame the index was last built or updated from
+            stock: pd.DataFrame, the new stock frame
+        """
+        cols = [col for col in self.WATCH_COLUMNS if col in stock.columns]
+        if not (old_stock.index.is_unique and stock.index.is_unique) or not all(col in old_stock.columns for col in cols):
+            self.build(stock)
+            return
+
+        if stock.index[:len(old_stock)].equals(old_stock.index):
+            #usual case, the same items in the same order with any new items at the end
+            common = old_stock.index
+            new_fields = stock[cols].iloc[:len(old_stock)]
+        else:
+            common = stock.index.intersection(old_stock.index)
+            new_fields = stock.loc[common, cols]
+        old_fields = old_stock.loc[common, cols]
+
+        changed = pd.Series(False, index=common)
+        for col in cols:
+            if not new_fields[col].equals(old_fields[col]):
+                changed |= (new_fields[col].to_numpy(dtype=object) != old_fields[col].to_numpy(dtype=object)) & ~(new_fields[col].isna().values & old_fields[col].isna().values)
+        changed = common[changed.values].append(stock.index.difference(old_stock.index))
+        removed = old_stock.index.difference(stock.index)
+
+        shortfalls = self.get_shortfalls(stock.loc[changed])
+
+        with self.lock:
+            for item_id in removed:
+                self.shortfalls.pop(item_id, None)
+            for item_id, shortfall in shortfalls.items():
+                if shortfall > 0:
+                    self.shortfalls[item_id] = shortfall
+                    heapq.heappush(self.heap, (-shortfall, item_id))
+                else:
+                    self.shortfalls.pop(item_id, None)
+
+            if len(self.heap) > 2*len(self.shortfalls):
+                self.heap = [(-shortfall, item_id) for item_id, shortfall in self.shortfalls.items()]
+                heapq.heapify(self.heap)
+
+    def get_low(self, count=None):
+        """
+        Arguments:
+            count: int, the number of items to return, all the low items if None
+
+        Returns:
+            list of (item_id, shortfall), the most short first
+        """
+        with self.lock:
+            if count is None or count >= len(self.shortfalls):
+                #all of them, quicker to sort the live items than to walk the heap past the stale entries
+                return [(item_id, -neg_shortfall) for neg_shortfall, item_id in sorted((-shortfall, item_id) for item_id, shortfall in self.shortfalls.items())]
+
+            live = count
+            low = []
+            seen = set()
+            #the heap is ordered, so stale entries can be skipped as they come until enough live ones are found
+            for neg_shortfall, item_id in self.iter_heap():
+                if len(low) == live:
+                    break
+                if item_id in seen or self.shortfalls.get(item_id) != -neg_shortfall:
+                    continue
+                seen.add(item_id)
+                low.append((item_id, -neg_shortfall))
+
+        return low
+
+    def iter_heap(self):
+        """
+        Yield the heap entries in order without changing the heap, only as far as they're read
+        """
+        heap = [(self.heap[0], 0)] if self.heap else []
+        while heap:
+            entry, position = heapq.heappop(heap)
+            yield entry
+            for child in (2*position+1, 2*position+2):
+                if child < len(self.heap):
+                    heapq.heappush(heap, (self.heap[child], child))
+
+    def get_count(self):
+        """
+        Returns:
+            int, the number of items needing reordering
+        """
+        with self.lock:
+            return len(self.shortfalls)
@@ -0,0 +1,213 @@
+import json
+import os
+
+class OperationLog():
+    """
+    Log of the orders and stock adds committed, undone and redone, giving up to MAX_UNDO undos and redos of each
+
+    Each commit is kept as an operation: its kind, the change it made to the stock of each item, the rows it added to the orders or stock adding files
+    and, when using the csv files, where in the files those rows start and end.
+    Undoing an operation applies the opposite stock changes and removes its rows from the end of the files, redoing it adds them back,
+    so neither depends on how many orders or stock adds there are.
+    Orders and stock adds have separate undo and redo stacks, as they each have their own undo button, and a new commit clears the redo stack of its kind.
+
+    Only the last MAX_UNDO operations of each kind are kept, older ones can still be undone from the end of the database, see MainWindow.get_last_operation().
+
+    The log is a file of json lines appended to as each event happens, and replayed at startup to rebuild the stacks.
+    It is rewritten with only the operations still on the stacks once it has grown to COMPACT_RATIO times the number of operations, at startup or as events are written.
+    """
+    KINDS = ('order', 'stock_add')
+    ENCODING = 'utf-8'
+    COMPACT_RATIO = 2
+    MAX_UNDO = 50 # operations of each kind kept on the undo stack, the oldest are dropped
+    def __init__(self, filepath):
+        """
+        Arguments:
+            filepath: str, path to the log file, created at the first commit
+        """
+        self.FILEPATH = filepath
+
+        self.done = {kind:[] for kind in self.KINDS} # operations that can be undone, last committed at the end
+        self.undone = {kind:[] for kind in self.KINDS} # operations that can be redone, last undone at the end
+        self.next_op_id = 1
+        self.num_events = 0
+
+        self.load()
+
+    def load(self):
+        """
+        Rebuild the undo and redo stacks by replaying the log file
+        """
+        try:
+            with open(self.FILEPATH, 'r', encoding=self.ENCODING) as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        #a line cut off when the program was closed mid-write
+                        continue
+                    self.replay(event['event'], event['op'])
+        except FileNotFoundError:
+            return
+
+        self.compact_if_grown()
+
+    def compact_if_grown(self):
+        """
+        Compact the log file if it has grown to COMPACT_RATIO times the number of operations on the stacks
+        """
+        num_ops = sum(len(self.done[kind]) + len(self.undone[kind]) for kind in self.KINDS)
+        if self.num_events > self.COMPACT_RATIO*max(num_ops, 1):
+            self.compact()
+
+    def replay(self, event, op):
+        """
+        Apply an event to the undo and redo stacks
+
+        Arguments:
+            event: str, 'commit', 'undo' or 'redo'
+            op: dict, the operation
+        """
+        kind = op['kind']
+        if event == 'commit':
+            self.done[kind].append(op)
+            self.undone[kind] = []
+        elif event == 'undo':
+            if self.done[kind] and self.done[kind][-1]['op_id'] == op['op_id']:
+                self.done[kind].pop()
+            self.undone[kind].append(op)
+        elif event == 'redo':
+            if self.undone[kind] and self.undone[kind][-1]['op_id'] == op['op_id']:
+                self.undone[kind].pop()
+            self.done[kind].append(op)
+        del self.done[kind][:-self.MAX_UNDO]
+        del self.undone[kind][:-self.MAX_UNDO]
+
+        if op['op_id'] is not None:
+            self.next_op_id = max(self.next_op_id, op['op_id']+1)
+        self.num_events += 1
+
+    def to_json(self, value):
+        """
+        Convert the numpy values in pandas rows for json.dumps()
+        """
+        if hasattr(value, 'item'):
+            return value.item()
+        raise TypeError("{} is not JSON serializable".format(type(value)))
+
+    def format_event(self, event, op):
+        return json.dumps({'event':event, 'op':op}, separators=(',', ':'), default=self.to_json) + '\n'
+
+    def write_event(self, event, op):
+        """
+        Append an event to the end of the log file and apply it to the stacks
+
+        Raises:
+            PermissionError if the log can't be written, the stacks are left unchanged
+        """
+        line = self.format_event(event, op)
+        with open(self.FILEPATH, 'a', encoding=self.ENCODING) as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.replay(event, op)
+        try:
+            self.compact_if_grown()
+        except OSError as err:
+            #the event is written, the log is only longer than it needs to be
+            print("Couldn't compact the operation log: {}".format(err))
+
+    def commit(self, kind, stock_changes, records, offsets=None, sizes=None):
+        """
+        Log a new order or stock add
+
+        Arguments:
+            kind: str, 'order' or 'stock_add'
+            stock_changes: dict, item_id: change in stock made by the commit
+            records: dict, the rows saved to the orders or stock adding database
+            offsets: list of int, the sizes of the csv files before the rows were appended, None if using sqlite
+            sizes: list of int, the sizes of the csv files after the rows were appended
+
+        Returns:
+            dict, the operation
+        """
+        op = {
+            'op_id':self.next_op_id,
+            'kind':kind,
+            'stock_changes':stock_changes,
+            'records':records,
+            'offsets':offsets,
+            'sizes':sizes
+            }
+        self.write_event('commit', op)
+
+        return op
+
+    def new_op_id(self):
+        """
+        Returns:
+            int, an op_id not used by any operation in the log, for an operation from the end of the database rather than the log
+        """
+        op_id = self.next_op_id
+        self.next_op_id += 1
+
+        return op_id
+
+    def get_undo(self, kind):
+        """
+        Returns:
+            dict, the last operation of the kind which can be undone, None if there isn't one
+        """
+        return self.done[kind][-1] if self.done[kind] else None
+
+    def get_redo(self, kind):
+        """
+        Returns:
+            dict, the last operation of the kind which was undone, None if there isn't one
+        """
+        return self.undone[kind][-1] if self.undone[kind] else None
+
+    def undo(self, op):
+        """
+        Log an operation as undone, the op needn't be from the log, e.g. an order saved before the log was started
+        """
+        self.write_event('undo', op)
+
+    def redo(self, op, offsets=None, sizes=None):
+        """
+        Log an undone operation as redone, with where its rows are in the csv files now
+        """
+        op = dict(op, offsets=offsets, sizes=sizes)
+        self.write_event('redo', op)
+
+        return op
+
+    def compact(self):
+        """
+        Rewrite the log file with only the operations still on the undo and redo stacks
+        """
+        temp_filepath = self.FILEPATH + '.tmp'
+        with open(temp_filepath, 'w', encoding=self.ENCODING) as f:
+            for kind in self.KINDS:
+                for op in self.done[kind]:
+                    f.write(self.format_event('commit', op))
+                for op in self.undone[kind]:
+                    f.write(self.format_event('undo', op))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_filepath, self.FILEPATH)
+        self.num_events = sum(len(self.done[kind]) + len(self.undone[kind]) for kind in self.KINDS)
+
+    def clear(self):
+        """
+        Forget all the operations, e.g. when the database files have been replaced from google drive
+        """
+        self.done = {kind:[] for kind in self.KINDS}
+        self.undone = {kind:[] for kind in self.KINDS}
+        self.num_events = 0
+        try:
+            os.remove(self.FILEPATH)
+        except FileNotFoundError:
+            pass
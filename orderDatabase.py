@@ -0,0 +1,257 @@
+import pandas as pd
+import re
+import os
+from csvJournal import CsvJournal
+from databaseSchema import DatabaseSchema
+from instrumentation import instruments
+
+class OrderDatabase():
+    """
+    The orders database, stored as one header row per order in the orders file and one row per item in the order lines file, joined on order_id
+
+    Replaces the old wide layout of a single orders file with item1_id, item1_quantity, item2_id... columns, which got wider with every large order.
+    Old wide files are converted by self.migrate(), and self.export_wide() writes the old layout for anything still needing it.
+    New orders are appended to the end of both files with CsvJournals.
+    The frames read are typed by the DatabaseSchema, with the money in pence and the dates parsed, and written back in the layout of the files.
+    """
+    HEADER_COLUMNS = ['order_id', 'postcode', 'date', 'order_amount', 'ebay_amount', 'paypal_amount', 'postpack_amount', 'order_number'] # order_number is the ebay order number of imported orders
+    LINE_COLUMNS = ['order_id', 'item_num', 'item_id', 'quantity', 'manufacturer', 'category', 'description']
+    WIDE_ITEM_FIELDS = {'id':'item_id', 'quantity':'quantity', 'manufacturer':'manufacturer', 'category':'category', 'description':'description'} # itemN_ field: line column
+    WIDE_ITEM_PATTERN = re.compile(r'^item(\d+)_(\w+)$')
+    BACKUP_SUFFIX = '.wide.bak'
+    def __init__(self, orders_filepath, order_lines_filepath, csv_cache=None):
+        """
+        Arguments:
+            orders_filepath: str, path to the csv file of order headers
+            order_lines_filepath: str, path to the csv file of order lines
+            csv_cache: CsvCache, keep binary copies of the parsed files so only the orders appended since are parsed
+        """
+        self.ORDERS_FILEPATH = orders_filepath
+        self.ORDER_LINES_FILEPATH = order_lines_filepath
+        self.csv_cache = csv_cache
+        self.schema = DatabaseSchema()
+
+        self.orders_journal = CsvJournal(orders_filepath)
+        self.lines_journal = CsvJournal(order_lines_filepath)
+
+    def is_wide(self):
+        """
+        Returns:
+            bool, True if the orders file is still in the old wide layout
+        """
+        return any(self.WIDE_ITEM_PATTERN.match(col) for col in self.orders_journal.get_columns())
+
+    def wide_to_lines(self, wide):
+        """
+        Split orders in the wide layout into headers and lines, one item slot at a time rather than one order at a time
+
+        Arguments:
+            wide: pd.DataFrame, orders with itemN_ columns, and an order_id column
+
+        Returns:
+            tuple of pd.DataFrames, (headers, lines)
+        """
+        slots = {}
+        for col in wide.columns:
+            match = self.WIDE_ITEM_PATTERN.match(col)
+            if match and match.group(2) in self.WIDE_ITEM_FIELDS:
+                slots.setdefault(int(match.group(1)), {})[col] = self.WIDE_ITEM_FIELDS[match.group(2)]
+
+        lines = []
+        for item_num in sorted(slots):
+            slot = wide[['order_id'] + list(slots[item_num])].rename(columns=slots[item_num])
+            slot.insert(1, 'item_num', item_num)
+            lines.append(slot)
+
+        lines = pd.concat(lines, ignore_index=True) if lines else pd.DataFrame(columns=self.LINE_COLUMNS)
+        lines = lines.reindex(columns=self.LINE_COLUMNS)
+        lines = lines[lines.item_id.notna() & lines.quantity.notna()]
+        lines = lines.astype({'quantity':int}).sort_values(['order_id', 'item_num'], kind='stable')
+
+        headers = wide.reindex(columns=self.HEADER_COLUMNS)
+
+        return headers, lines.reset_index(drop=True)
+
+    def lines_to_wide(self, headers, lines):
+        """
+        Join headers and lines back into the old wide layout
+
+        Arguments:
+            headers: pd.DataFrame, with the HEADER_COLUMNS
+            lines: pd.DataFrame, with the LINE_COLUMNS
+
+        Returns:
+            pd.DataFrame, one row per order with itemN_ columns, without the order_id
+        """
+        wide = headers.set_index('order_id')
+        if len(lines) > 0:
+            fields = {line_col:field for field, line_col in self.WIDE_ITEM_FIELDS.items()}
+            items = lines.astype({'quantity':'Int64'}).set_index(['order_id', 'item_num'])[list(fields)].unstack('item_num')
+            items = items.reindex(columns=[(col, item_num) for item_num in sorted(lines.item_num.unique()) for col in fields])
+            items.columns = ['item{0}_{1}'.format(item_num, fields[col]) for col, item_num in items.columns]
+            wide = wide.join(items)
+
+        return wide.reset_index(drop=True)
+
+    def migrate(self):
+        """
+        Convert a wide orders file to the headers and lines files, numbering the orders in file order
+        The wide file is kept with BACKUP_SUFFIX added to its name
+        A headers file from before any of the HEADER_COLUMNS were added has them added, empty for the orders already in it
+
+        Returns:
+            bool, True if the file was converted or had columns added
+        """
+        if not self.is_wide():
+            columns = self.orders_journal.get_columns()
+            missing = [col for col in self.HEADER_COLUMNS if col not in columns]
+            if not columns or not missing:
+                return False
+            self.orders_journal.rewrite(columns + missing)
+            return True
+
+        wide = pd.read_csv(self.ORDERS_FILEPATH)
+        wide.insert(0, 'order_id', range(1, len(wide)+1))
+        headers, lines = self.wide_to_lines(wide)
+
+        self.write(headers, lines, backup=True)
+
+        return True
+
+    @instruments.timed('csv_write_orders')
+    def write(self, headers, lines, backup=False):
+        """
+        Replace both files, each written to a temporary file first and swapped in so neither is left half written
+
+        Arguments:
+            headers: pd.DataFrame, with the HEADER_COLUMNS, typed or not
+            lines: pd.DataFrame, with the LINE_COLUMNS
+            backup: bool, keep the old orders file with BACKUP_SUFFIX added to its name
+        """
+        headers = self.schema.format_headers(headers)
+        for frame, filepath in [(lines, self.ORDER_LINES_FILEPATH), (headers, self.ORDERS_FILEPATH)]:
+            temp_filepath = filepath + CsvJournal.TEMP_SUFFIX
+            frame.to_csv(temp_filepath, index=False)
+            if backup and filepath == self.ORDERS_FILEPATH:
+                os.replace(filepath, filepath + self.BACKUP_SUFFIX)
+            os.replace(temp_filepath, filepath)
+
+    @instruments.timed('csv_read_orders')
+    def read(self):
+        """
+        Returns:
+            tuple of pd.DataFrames, (headers, lines) typed by the schema
+        """
+        headers = self.schema.type_headers(self.read_file(self.ORDERS_FILEPATH, self.schema.read_headers))
+        try:
+            lines = self.read_file(self.ORDER_LINES_FILEPATH, self.schema.read_lines)
+        except FileNotFoundError:
+            lines = pd.DataFrame(columns=self.LINE_COLUMNS)
+
+        return headers, self.schema.type_lines(lines)
+
+    def read_file(self, filepath, parse):
+        """
+        Arguments:
+            filepath: str
+            parse: function(source), one of the schema's readers
+
+        Returns:
+            pd.DataFrame, the csv file, from its cache if there is one
+        """
+        if self.csv_cache is not None:
+            return self.csv_cache.read(filepath, parse)
+        return parse(filepath)
+
+    def export_wide(self, filepath):
+        """
+        Write the orders in the old wide layout, indexed by postcode as before
+
+        Arguments:
+            filepath: str, path to write to
+        """
+        headers, lines = self.read()
+        self.lines_to_wide(self.schema.format_headers(headers), lines).set_index('postcode').to_csv(filepath)
+
+    def get_sizes(self):
+        """
+        Returns:
+            tuple of int, the sizes of the orders and order lines files
+        """
+        return self.orders_journal.get_size(), self.lines_journal.get_size()
+
+    def get_last_order(self):
+        """
+        Read the last order from the end of the files
+
+        Returns:
+            tuple, (pd.Series, the order header; pd.DataFrame, its lines; tuple of int, the offsets the order starts at in each file),
+            the header is None if there are no orders
+        """
+        header_rows, orders_offset = self.orders_journal.get_last_rows('order_id')
+        line_rows, lines_offset = self.lines_journal.get_last_rows('order_id')
+        if not header_rows:
+            return None, pd.DataFrame(columns=self.LINE_COLUMNS), (orders_offset, lines_offset)
+
+        header = pd.Series(header_rows[-1])
+        for col in ['order_amount', 'ebay_amount', 'paypal_amount', 'postpack_amount']:
+            header[col] = pd.to_numeric(header.get(col, ''), errors='coerce')
+
+        lines = pd.DataFrame(line_rows, columns=self.LINE_COLUMNS)
+        if len(lines) > 0 and lines.order_id.iloc[0] != header.order_id:
+            #no lines were saved for this order
+            lines = lines.iloc[:0]
+            lines_offset = self.lines_journal.get_size()
+        lines = lines.astype({'quantity':int, 'item_num':int})
+
+        return header, lines, (orders_offset, lines_offset)
+
+    def get_next_order_id(self):
+        """
+        Returns:
+            int, one more than the id of the last order
+        """
+        header_rows, offset = self.orders_journal.get_last_rows('order_id')
+        if not header_rows:
+            return 1
+
+        return int(header_rows[-1]['order_id']) + 1
+
+    def append(self, headers, lines):
+        """
+        Append orders to the end of both files, e.g. one from the order form or a batch imported from ebay
+
+        Arguments:
+            headers: list of dicts, with the HEADER_COLUMNS
+            lines: list of dicts, with the LINE_COLUMNS
+
+        Returns:
+            tuple of int, the sizes of the files before appending, for self.truncate()
+
+        Raises:
+            PermissionError if a file can't be written, nothing is left appended
+        """
+        lines_offset = self.lines_journal.append([{col:line.get(col, '') for col in self.LINE_COLUMNS} for line in lines])
+        try:
+            orders_offset = self.orders_journal.append([{col:header.get(col, '') for col in self.HEADER_COLUMNS} for header in headers])
+        except PermissionError:
+            self.lines_journal.truncate(lines_offset)
+            raise
+
+        return orders_offset, lines_offset
+
+    def truncate(self, offsets):
+        """
+        Remove everything after the given offsets, e.g. the last order
+
+        Arguments:
+            offsets: tuple of int, (orders file offset, order lines file offset)
+        """
+        orders_offset, lines_offset = offsets
+        self.orders_journal.truncate(orders_offset)
+        self.lines_journal.truncate(lines_offset)
+
+
+if __name__ == "__main__":
+    #write the orders in the old wide layout
+    OrderDatabase("orders.csv", "order_lines.csv").export_wide("orders_wide.csv")
@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+from instrumentation import instruments
+
+class OrderImport():
+    """
+    Turns an ebay orders report, downloaded as a csv file from seller hub, into orders for MainWindow.save_orders()
+
+    The report has a row per item sold. An order of more than one item also has a row of its own with the buyer and the total price,
+    above the item rows sharing its order number, while a single item order has everything on one row.
+    There can be title lines above the column names and a count of the records below the rows.
+
+    The custom label (SKU) of each item is mapped to its item_id through the sku map file if there is one, otherwise the SKU is taken as the item_id.
+    The whole report is checked against the stock at once: an order is rejected if any of its lines can't be imported,
+    and the orders are taken in the order of the report, so an order without enough stock left after the orders above it is rejected and the rest still go in.
+    The ebay order number is kept with each order, and an order already in the database from an earlier report is rejected, so overlapping reports don't take the stock twice.
+    """
+    COLUMNS = {'Order Number':'order_number', 'Item Number':'item_number', 'Custom Label':'sku', 'Quantity':'quantity', 'Post To Postcode':'postcode', 'Sale Date':'date', 'Total Price':'total'} # ebay report column: name used here
+    REQUIRED_COLUMNS = ['Order Number', 'Custom Label', 'Quantity', 'Sale Date', 'Total Price']
+    REJECTED_COLUMNS = ['line', 'order_number', 'sku', 'quantity', 'reason']
+    DATE_FORMAT = '%d/%m/%Y' # as in the order form
+    ENCODING = 'utf-8-sig' # seller hub starts the file with a byte order mark
+    def __init__(self, sku_map_filepath=None):
+        """
+        Arguments:
+            sku_map_filepath: str, path to an optional csv file with sku and item_id columns, for items listed under a custom label which isn't their item_id
+        """
+        self.SKU_MAP_FILEPATH = sku_map_filepath
+
+    @instruments.timed('read_order_report')
+    def read_report(self, filepath):
+        """
+        Read an ebay orders report
+
+        Arguments:
+            filepath: str, path to the csv file
+
+        Returns:
+            pd.DataFrame, all text, with the COLUMNS renamed and the line of each row in the file
+
+        Raises:
+            OSError if the file can't be read, ValueError if it isn't an orders report
+        """
+        #the column names are under any title lines
+        with open(filepath, 'r', encoding=self.ENCODING, newline='') as f:
+            for header_line, line in enumerate(f):
+                if 'Order Number' in line:
+                    break
+            else:
+                raise ValueError("No Order Number column was found, is this an ebay orders report?")
+
+        report = pd.read_csv(filepath, skiprows=header_line, dtype=str, keep_default_na=False, skip_blank_lines=False, encoding=self.ENCODING)
+
+        missing = [col for col in self.REQUIRED_COLUMNS if col not in report.columns]
+        if missing:
+            raise ValueError("The report has no {} column".format(', '.join(missing)))
+
+        report = report.apply(lambda column: column.str.strip())
+        #blank lines and the count of records at the end, which fill no more than the first couple of cells
+        is_row = (report != '').sum(axis=1) > 2
+
+        report = report.reindex(columns=list(self.COLUMNS), fill_value='').rename(columns=self.COLUMNS)
+        #line in the file, counting from 1, for the rejected lines report
+        report.insert(0, 'line', report.index + header_line + 2)
+
+        return report[is_row & (report.order_number != '')].reset_index(drop=True)
+
+    def get_sku_map(self):
+        """
+        Returns:
+            pd.Series, item_id indexed by sku, both upper case, empty if there is no sku map file
+        """
+        if self.SKU_MAP_FILEPATH is None:
+            return pd.Series(dtype=object)
+        try:
+            sku_map = pd.read_csv(self.SKU_MAP_FILEPATH, dtype=str, keep_default_na=False)
+        except FileNotFoundError:
+            return pd.Series(dtype=object)
+
+        return pd.Series(sku_map.item_id.str.strip().str.upper().values, index=sku_map.sku.str.strip().str.upper().values)
+
+    @instruments.timed('make_imported_orders')
+    def make_orders(self, report, stock, first_order_id, imported_numbers=()):
+        """
+        Check the report against the stock and build the orders which can be imported
+
+        Arguments:
+            report: pd.DataFrame, from self.read_report()
+            stock: pd.DataFrame, the stock database indexed by item_id
+            first_order_id: int, the order_id of the first imported order
+            imported_numbers: collection of str, the ebay order numbers of the orders already in the database
+
+        Returns:
+            tuple, (pd.DataFrame, one row per imported order with the order_id, order_number, postcode, date and order_amount as a float;
+                    pd.DataFrame, the lines of the imported orders with the OrderDatabase.LINE_COLUMNS;
+                    dict, item_id: change in stock;
+                    pd.DataFrame, the rejected lines of the report with the REJECTED_COLUMNS)
+        """
+        order_numbers = report.order_number
+        sizes = order_numbers.map(order_numbers.value_counts())
+
+        #the order details from whichever row of the order has them
+        totals = pd.to_numeric(report.total.str.replace(r'[^0-9.\-]', '', regex=True), errors='coerce')
+        dates = pd.to_datetime(report.date.where(report.date != ''), errors='coerce', dayfirst=True)
+        headers = pd.DataFrame({
+            'postcode':report.postcode.where(report.postcode != '').str.upper().groupby(order_numbers, sort=False).first(),
+            'date':dates.groupby(order_numbers, sort=False).first(),
+            'order_amount':totals.groupby(order_numbers, sort=False).first()
+            }, index=order_numbers.drop_duplicates().values)
+        headers['postcode'] = headers.postcode.fillna('')
+
+        order_reasons = pd.Series('', index=headers.index)
+        order_reasons[headers.order_amount.isna()] = 'No total price for the order'
+        order_reasons[headers.date.isna()] = 'No sale date for the order'
+        order_reasons[headers.index.isin(list(imported_numbers))] = 'Order already imported'
+
+        #item rows, the total row of an order of more than one item has neither a custom label nor an item number
+        is_item = (report.sku != '') | (report.item_number != '') | (sizes == 1)
+        lines = report[is_item]
+        summary_rows = report[~is_item & ~order_numbers.isin(lines.order_number)]
+
+        sku_map = self.get_sku_map()
+        skus = lines.sku.str.upper()
+        item_ids = skus.map(sku_map).fillna(skus)
+        quantities = pd.to_numeric(lines.quantity, errors='coerce')
+        matches = item_ids.map(stock.index.value_counts()).fillna(0)
+        unique_stock = stock[~stock.index.duplicated(keep=False)]
+        available = item_ids.map(pd.to_numeric(unique_stock.stock, errors='coerce'))
+
+        #the first problem found with each line, in order of the checks
+        reasons = lines.order_number.map(order_reasons)
+        for rejected, reason in [(lines.sku == '', 'No custom label (SKU)'),
+                                 (matches == 0, 'SKU not in the stock database'),
+                                 (matches > 1, 'More than one item in the stock database with this id'),
+                                 (~((quantities > 0) & (quantities % 1 == 0)), 'Quantity is not a whole number above 0')]:
+            reasons[rejected & (reasons == '')] = reason
+        rejected_orders = set(lines.order_number[reasons != ''])
+
+        #take the stock for the orders in turn, an order is rejected if a line is short of stock after the orders above it,
+        #which frees its other items for the orders below it, so this is repeated until no order is short
+        while True:
+            ok = ~lines.order_number.isin(rejected_orders)
+            #the most stock that can be taken before each line, if all the orders still in go in
+            taken = quantities.where(ok, 0).groupby(item_ids).cumsum() - quantities
+            short = ok & (taken + quantities > available)
+            if not short.any():
+                break
+
+            #orders with no line short are certain to go in, a line short even after just those certainly rejects its order
+            certain = ok & ~lines.order_number.isin(set(lines.order_number[short]))
+            certain_quantities = quantities.where(certain, 0)
+            taken = certain_quantities.groupby(item_ids).cumsum() - certain_quantities
+            rejected = ok & (taken + quantities > available)
+            #the first line short at all is always one of them
+            rejected[short.idxmax()] = True
+
+            reasons[rejected] = ['Not enough stock, {} left'.format(int(left)) for left in (available - taken)[rejected]]
+            rejected_orders.update(lines.order_number[rejected])
+
+        rejected_lines = lines.order_number.isin(rejected_orders)
+        reasons[rejected_lines & (reasons == '')] = 'Another line of the order was rejected'
+        rejected = pd.concat([lines[rejected_lines].assign(reason=reasons[rejected_lines]),
+                              summary_rows.assign(reason='No items in the order')])
+        rejected = rejected.sort_values('line')[self.REJECTED_COLUMNS].reset_index(drop=True)
+
+        #the imported orders, numbered in the order of the report
+        headers = headers[~headers.index.isin(rejected_orders) & headers.index.isin(lines.order_number)]
+        headers.insert(0, 'order_id', np.arange(first_order_id, first_order_id + len(headers)))
+        headers['date'] = headers.date.dt.strftime(self.DATE_FORMAT)
+        headers = headers.rename_axis('order_number').reset_index()
+
+        lines = lines[~rejected_lines]
+        item_ids = item_ids[~rejected_lines]
+        quantities = quantities[~rejected_lines].astype(int)
+        items = unique_stock.reindex(item_ids.values)
+        order_lines = pd.DataFrame({
+            'order_id':lines.order_number.map(pd.Series(headers.order_id.values, index=headers.order_number.values)).values,
+            'item_num':lines.groupby('order_number', sort=False).cumcount().values + 1,
+            'item_id':item_ids.values,
+            'quantity':quantities.values,
+            'manufacturer':items.manufacturer.values,
+            'category':items.category.values,
+            'description':items.description.values
+            })
+
+        stock_changes = (-quantities.groupby(item_ids).sum()).to_dict()
+
+        return headers, order_lines, stock_changes, rejected
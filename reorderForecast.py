@@ -0,0 +1,326 @@
+import datetime
+import re
+import threading
+import numpy as np
+import pandas as pd
+from databaseSchema import DatabaseSchema
+from instrumentation import instruments
+
+class ReorderForecast():
+    """
+    Sales velocity, days of stock left and suggested reorder quantities for every item, from the orders and stock adds
+
+    An item's velocity (units a day) blends its sales over the last SHORT_DAYS and LONG_DAYS, over fewer days if its first stock add was more recent.
+    The seasonal factor is how much better or worse the item sold over the coming LEAD_DAYS + COVER_DAYS last year than over the LONG_DAYS before them,
+    pulled towards 1 by SEASON_PRIOR units and limited to SEASON_LIMITS, so items with little history aren't thrown about.
+    The forecast (velocity times seasonal factor) gives the days of stock left, the date to reorder by to get the delivery in before running out,
+    and the quantity to bring the stock up to LEAD_DAYS + COVER_DAYS of forecast sales.
+
+    The dated sales and stock adds are kept as arrays of item code, day and quantity, read once the first time they're needed
+    and then added to by each commit (negative quantities for an undo). The windowed sums of each item are kept between refreshes
+    and only worked out again for the items touched since, unless the day has changed and every window has moved.
+    All the sums are np.bincounts over the item codes, so the whole catalogue is done at once.
+    """
+    SHORT_DAYS = 28 # recent window for the velocity
+    LONG_DAYS = 91 # longer window for the velocity, and for last year's sales before the coming season
+    SHORT_WEIGHT = 0.5 # share of the velocity from the recent window
+    MIN_DAYS = 7 # fewest days a velocity is worked out over, for items first added within the windows
+    LEAD_DAYS = 14 # days from reordering to the delivery arriving
+    COVER_DAYS = 42 # days of sales a delivery should cover
+    YEAR_DAYS = 364 # a year ago, in whole weeks so the weekdays line up
+    SEASON_PRIOR = 5.0 # units added to both sides of the seasonal ratio
+    SEASON_LIMITS = (0.5, 2.0) # lowest and highest seasonal factor
+    FEATURE_COLUMNS = ['sold_short', 'sold_long', 'sold_last_season', 'sold_before_last_season', 'first_added']
+    COLUMNS = ['item_id', 'manufacturer', 'category', 'stock', 'sold_short', 'sold_long', 'velocity', 'seasonal', 'forecast', 'days_left', 'reorder_by', 'suggested']
+    ITEM_COLUMN_PATTERN = re.compile(r'^item(\d+)_id$')
+    NO_DAY = np.iinfo(np.int64).max # first_added of items never added
+    def __init__(self, read_orders, read_stock_adding):
+        """
+        Arguments:
+            read_orders: function(), returns the (headers, lines) frames of all the orders
+            read_stock_adding: function(), returns the stock adds frame in the wide layout of the stock adding file
+        """
+        self.read_orders = read_orders
+        self.read_stock_adding = read_stock_adding
+        self.schema = DatabaseSchema()
+
+        self.item_ids = pd.Index([], dtype=object) # item_id of each item code, new items are added to the end
+        self.sales = [] # chunks of (codes, days, quantities) arrays, joined at the next refresh
+        self.adds = []
+        self.loaded = False
+
+        self.features = None # pd.DataFrame of the FEATURE_COLUMNS by item code, for self.features_day
+        self.features_day = None
+        self.touched = set() # codes of the items with sales or stock adds since the features were worked out
+
+        self.lock = threading.Lock()
+
+    def get_today(self):
+        """
+        Returns:
+            int, today as days since 1970
+        """
+        return int(np.datetime64(datetime.date.today(), 'D').astype(np.int64))
+
+    def parse_days(self, dates):
+        """
+        Arguments:
+            dates: pd.Series of dates, parsed or as text in DatabaseSchema.DATE_FORMAT unless typed otherwise
+
+        Returns:
+            np.array of int, days since 1970, -1 for dates that can't be read
+        """
+        parsed = self.schema.parse_dates(dates)
+        days = parsed.values.astype('datetime64[D]').astype(np.int64)
+        days[parsed.isna().values] = -1
+
+        return days
+
+    def get_codes(self, item_ids):
+        """
+        Arguments:
+            item_ids: pd.Series of item ids
+
+        Returns:
+            np.array of int, the code of each item, adding the items not seen before
+        """
+        positions, unique_ids = pd.factorize(item_ids.astype(str))
+        unique_ids = pd.Index(unique_ids).str.upper()
+        codes = self.item_ids.get_indexer(unique_ids)
+        if (codes == -1).any():
+            self.item_ids = self.item_ids.append(unique_ids[codes == -1].unique())
+            codes = self.item_ids.get_indexer(unique_ids)
+
+        return codes[positions]
+
+    def get_sales(self, headers, lines, sign=1):
+        """
+        Arguments:
+            headers: pd.DataFrame, order headers with order_id and date
+            lines: pd.DataFrame, order lines with order_id, item_id and quantity
+            sign: int, -1 for undone orders
+
+        Returns:
+            tuple of np.arrays, (codes, days, quantities) of the order lines
+        """
+        order_days = pd.Series(self.parse_days(headers.date), index=pd.to_numeric(headers.order_id, errors='coerce').values)
+        order_days = order_days[~order_days.index.duplicated(keep='last')]
+        days = pd.to_numeric(lines.order_id, errors='coerce').map(order_days).fillna(-1).values.astype(np.int64)
+        quantities = sign*pd.to_numeric(lines.quantity, errors='coerce').fillna(0).values.astype(float)
+        dated = days >= 0
+
+        return self.get_codes(lines.item_id[dated]), days[dated], quantities[dated]
+
+    def get_adds(self, stock_adding, sign=1):
+        """
+        Arguments:
+            stock_adding: pd.DataFrame, stock adds with a date column and itemN_id, itemN_quantity columns
+            sign: int, -1 for an undone stock add
+
+        Returns:
+            tuple of np.arrays, (codes, days, quantities) of the items added
+        """
+        item_nums = [match.group(1) for match in map(self.ITEM_COLUMN_PATTERN.match, stock_adding.columns) if match]
+        if not item_nums:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=float)
+
+        days = self.parse_days(stock_adding.date)
+        items = pd.concat([pd.DataFrame({
+            'item_id':stock_adding['item{}_id'.format(item_num)].values,
+            'day':days,
+            'quantity':pd.to_numeric(stock_adding.get('item{}_quantity'.format(item_num)), errors='coerce').values
+            }) for item_num in item_nums], ignore_index=True)
+        items = items[items.item_id.notna() & items.quantity.notna() & (items.day >= 0)]
+
+        return self.get_codes(items.item_id), items.day.values.astype(np.int64), sign*items.quantity.values.astype(float)
+
+    @instruments.timed('load_reorder_forecast')
+    def load(self):
+        """
+        Read all the orders and stock adds from scratch
+        """
+        headers, lines = self.read_orders()
+        stock_adding = self.read_stock_adding()
+        with self.lock:
+            self.item_ids = pd.Index([], dtype=object)
+            self.sales = [self.get_sales(headers, lines)]
+            self.adds = [self.get_adds(stock_adding)]
+            self.features = None
+            self.touched = set()
+            self.loaded = True
+
+    def invalidate(self):
+        """
+        Read the orders and stock adds again at the next refresh, e.g. after the files have been replaced from google drive
+        """
+        with self.lock:
+            self.loaded = False
+
+    def add_orders(self, headers, lines, sign=1):
+        """
+        Add the sales of committed orders, or take away those of undone orders, if they have been read
+
+        Arguments:
+            headers: list of dicts, the order headers
+            lines: list of dicts, the order lines
+            sign: int, -1 to take the orders away
+        """
+        with self.lock:
+            if not self.loaded:
+                return
+            sales = self.get_sales(pd.DataFrame(headers, columns=['order_id', 'date']), pd.DataFrame(lines, columns=['order_id', 'item_id', 'quantity']), sign)
+            self.sales.append(sales)
+            self.touched.update(sales[0])
+
+    def add_stock_add(self, stock_add, sign=1):
+        """
+        Add a committed stock add, or take away an undone one, if they have been read
+
+        Arguments:
+            stock_add: dict, the stock add row with date and itemN_id, itemN_quantity keys
+            sign: int, -1 to take the stock add away
+        """
+        with self.lock:
+            if not self.loaded:
+                return
+            adds = self.get_adds(pd.DataFrame([stock_add]), sign)
+            self.adds.append(adds)
+            self.touched.update(adds[0])
+
+    def join_chunks(self, chunks):
+        """
+        Returns:
+            list with the chunks of (codes, days, quantities) joined into one
+        """
+        if len(chunks) > 1:
+            chunks = [tuple(np.concatenate(arrays) for arrays in zip(*chunks))]
+
+        return chunks
+
+    def get_features(self, today, codes=None):
+        """
+        Sum each item's sales over the windows and find its first stock add
+
+        Arguments:
+            today: int, days since 1970
+            codes: np.array of int, the items to work out, all of them if None
+
+        Returns:
+            pd.DataFrame of the FEATURE_COLUMNS indexed by item code
+        """
+        count = len(self.item_ids)
+        features = {}
+
+        sale_codes, days, quantities = self.sales[0]
+        if codes is not None:
+            keep = np.isin(sale_codes, codes)
+            sale_codes, days, quantities = sale_codes[keep], days[keep], quantities[keep]
+        last_year = today - self.YEAR_DAYS
+        season_days = self.LEAD_DAYS + self.COVER_DAYS
+        for col, start, end in [('sold_short', today - self.SHORT_DAYS, today),
+                                ('sold_long', today - self.LONG_DAYS, today),
+                                ('sold_last_season', last_year, last_year + season_days),
+                                ('sold_before_last_season', last_year - self.LONG_DAYS, last_year)]:
+            window = (days > start) & (days <= end)
+            features[col] = np.bincount(sale_codes[window], weights=quantities[window], minlength=count)
+
+        #first day with stock added, leaving out adds which have since been undone
+        add_codes, days, quantities = self.adds[0]
+        if codes is not None:
+            keep = np.isin(add_codes, codes)
+            add_codes, days, quantities = add_codes[keep], days[keep], quantities[keep]
+        added = pd.Series(quantities).groupby([add_codes, days]).sum()
+        added = added[added > 0]
+        first_added = np.full(count, self.NO_DAY, dtype=np.int64)
+        if len(added) > 0:
+            np.minimum.at(first_added, added.index.get_level_values(0).values, added.index.get_level_values(1).values)
+        features['first_added'] = first_added
+
+        features = pd.DataFrame(features, columns=self.FEATURE_COLUMNS)
+        if codes is not None:
+            features = features.iloc[codes]
+
+        return features
+
+    @instruments.timed('refresh_reorder_forecast')
+    def refresh(self):
+        """
+        Bring the windowed sums up to date, for every item if the day has changed, otherwise only for the items touched since the last refresh
+
+        Returns:
+            tuple, (pd.DataFrame of the FEATURE_COLUMNS indexed by item_id; int, the day they're for)
+        """
+        if not self.loaded:
+            self.load()
+
+        today = self.get_today()
+        with self.lock:
+            self.sales = self.join_chunks(self.sales)
+            self.adds = self.join_chunks(self.adds)
+
+            if self.features is None or self.features_day != today:
+                self.features = self.get_features(today)
+                self.features_day = today
+            elif self.touched or len(self.features) < len(self.item_ids):
+                codes = np.array(sorted(self.touched | set(range(len(self.features), len(self.item_ids)))), dtype=np.int64)
+                features = self.features.reindex(range(len(self.item_ids)))
+                features.iloc[codes] = self.get_features(today, codes).values
+                self.features = features.astype(self.features.dtypes.to_dict())
+            self.touched = set()
+
+            return self.features.set_axis(self.item_ids), today
+
+    def get_table(self, stock):
+        """
+        Forecast each item sold in the last LONG_DAYS against its stock
+
+        Arguments:
+            stock: pd.DataFrame, the stock database indexed by item_id
+
+        Returns:
+            pd.DataFrame with the COLUMNS, the items with the fewest days of stock left first
+        """
+        features, today = self.refresh()
+
+        stock = stock[~stock.index.duplicated(keep='first')]
+        features = features[(features.sold_long > 0) & features.index.isin(stock.index)]
+        stock = stock.reindex(features.index)
+        levels = pd.to_numeric(stock.stock, errors='coerce').fillna(0).clip(lower=0).values
+
+        #days each velocity window covers, shorter for items first added within it
+        first_added = features.first_added.values
+        days_known = np.where(first_added == self.NO_DAY, np.inf, np.maximum(today - np.minimum(first_added, today) + 1, self.MIN_DAYS))
+        velocity = self.SHORT_WEIGHT*features.sold_short.values/np.minimum(self.SHORT_DAYS, days_known) \
+                   + (1 - self.SHORT_WEIGHT)*features.sold_long.values/np.minimum(self.LONG_DAYS, days_known)
+
+        #last year's coming season against the LONG_DAYS before it, only for items around for all of that
+        season_days = self.LEAD_DAYS + self.COVER_DAYS
+        expected = features.sold_before_last_season.values/self.LONG_DAYS*season_days
+        seasonal = (features.sold_last_season.values + self.SEASON_PRIOR)/(expected + self.SEASON_PRIOR)
+        seasonal = np.clip(seasonal, *self.SEASON_LIMITS)
+        seasonal[days_known < self.YEAR_DAYS + self.LONG_DAYS] = 1.0
+
+        forecast = velocity*seasonal
+        with np.errstate(divide='ignore', invalid='ignore'):
+            days_left = np.where(forecast > 0, levels/forecast, np.nan)
+        #reorder in time for the delivery to arrive before running out, today if that's already too late
+        reorder_days = np.clip(np.nan_to_num(days_left, nan=self.YEAR_DAYS) - self.LEAD_DAYS, 0, self.YEAR_DAYS)
+        reorder_by = np.datetime64('1970-01-01') + (today + reorder_days).astype(np.int64)
+        suggested = np.maximum(np.ceil(forecast*season_days - levels), 0).astype(int)
+
+        table = pd.DataFrame({
+            'item_id':features.index,
+            'manufacturer':stock.manufacturer.values,
+            'category':stock.category.values,
+            'stock':levels.astype(int),
+            'sold_short':features.sold_short.values.round().astype(int),
+            'sold_long':features.sold_long.values.round().astype(int),
+            'velocity':velocity.round(2),
+            'seasonal':seasonal.round(2),
+            'forecast':(forecast*season_days).round(1),
+            'days_left':days_left.round(1),
+            'reorder_by':pd.to_datetime(reorder_by).strftime('%Y-%m-%d'),
+            'suggested':suggested
+            }, columns=self.COLUMNS)
+
+        return table.sort_values(['days_left', 'suggested'], ascending=[True, False], kind='stable').reset_index(drop=True)
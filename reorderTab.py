@@ -0,0 +1,92 @@
+import PyQt5.QtWidgets as widgets
+from PyQt5.QtCore import pyqtSignal as Signal
+from PyQt5.QtCore import Qt
+from stockTableModel import StockTableModel
+from instrumentation import instruments
+
+class ReorderTab(widgets.QWidget):
+    """
+    Tab listing the items selling, with the days of stock they have left and how many to reorder, see ReorderForecast
+    Refreshed each time it's shown, so it's up to date with the orders and stock adds made since
+    """
+    NO_FILENAME = ""
+    HEADERS = {'item_id':"Item ID", 'manufacturer':"Manufacturer", 'category':"Category", 'stock':"Stock", 'sold_short':"Sold last {short} days",
+               'sold_long':"Sold last {long} days", 'velocity':"Sold a day", 'seasonal':"Seasonal factor", 'forecast':"Forecast next {season} days",
+               'days_left':"Days left", 'reorder_by':"Reorder by", 'suggested':"Suggested reorder"} # column: header, filled in with the forecast's windows
+    save_error = Signal(str, PermissionError)
+    def __init__(self, forecast, stock_db):
+        """
+        Arguments:
+            forecast: ReorderForecast
+            stock_db: StockDatabase, shared
+        """
+        super().__init__()
+
+        self.forecast = forecast
+        self.stock_db = stock_db
+
+        layout = widgets.QVBoxLayout()
+        self.setLayout(layout)
+
+        topBar = widgets.QHBoxLayout()
+        self.reorderOnlyBox = widgets.QCheckBox("Only items to reorder")
+        self.reorderOnlyBox.setChecked(True)
+        self.reorderOnlyBox.stateChanged.connect(self.refresh)
+        topBar.addWidget(self.reorderOnlyBox)
+        topBar.addStretch(1)
+        self.summaryLabel = widgets.QLabel()
+        topBar.addWidget(self.summaryLabel)
+        layout.addLayout(topBar)
+
+        windows = {'short':forecast.SHORT_DAYS, 'long':forecast.LONG_DAYS, 'season':forecast.LEAD_DAYS + forecast.COVER_DAYS}
+        self.model = StockTableModel(forecast.COLUMNS, [self.HEADERS[col].format(**windows) for col in forecast.COLUMNS])
+        self.table = widgets.QTableView()
+        self.table.setModel(self.model)
+        self.table.verticalHeader().setSectionResizeMode(widgets.QHeaderView.Fixed)
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+        layout.addWidget(self.table)
+
+        bottomBar = widgets.QHBoxLayout()
+        bottomBar.addWidget(widgets.QLabel("Suggested reorders cover {0} days of delivery and {1} days of sales after".format(forecast.LEAD_DAYS, forecast.COVER_DAYS)))
+        bottomBar.addStretch(1)
+        saveButton = widgets.QPushButton("Save")
+        saveButton.clicked.connect(self.save_to_file)
+        bottomBar.addWidget(saveButton)
+        layout.addLayout(bottomBar)
+
+    def showEvent(self, event):
+        """
+        Override the showEvent QWidget SLOT, refresh whenever the tab is shown
+        """
+        self.refresh()
+        super().showEvent(event)
+
+    @instruments.timed('refresh_reorder_tab')
+    def refresh(self):
+        """
+        SLOT connected to self.reorderOnlyBox.stateChanged() SIGNAL in self.__init__()
+        """
+        table = self.forecast.get_table(self.stock_db.load())
+        to_reorder = table.suggested > 0
+        if self.reorderOnlyBox.isChecked():
+            table = table[to_reorder]
+
+        self.model.set_frame(table)
+        self.summaryLabel.setText("{} items to reorder".format(to_reorder.sum()))
+
+    def save_to_file(self):
+        """
+        Save the table to a user-named csv file, in the order shown
+        """
+        frame = self.model.get_frame()
+        if len(frame) > 0:
+            (name, type) = widgets.QFileDialog.getSaveFileName(self, caption="Save reorder list", filter="*.csv")
+
+            if name == self.NO_FILENAME:
+                return
+
+            try:
+                frame.set_index('item_id').to_csv(name)
+            except PermissionError as err:
+                self.save_error.emit(name, err)
@@ -0,0 +1,243 @@
+import numpy as np
+import pandas as pd
+import threading
+from databaseSchema import DatabaseSchema
+from instrumentation import instruments
+
+class SalesAnalytics():
+    """
+    Revenue, fees and net profit of the orders by day, week, month, item, manufacturer and category
+
+    The net of an order is its order amount less the ebay and paypal cuts and the postage and packing cost.
+    The orders don't record a price for each item, so an order's amounts are shared between its lines by quantity.
+
+    The totals are kept in whole pence, and each order's amounts are shared out in whole pence which add up to the order's, so the totals by item
+    add up to the same as the totals by day. They are only turned into pounds as they are shown.
+    Two sets of totals are kept materialized: by day, and by item along with the item's manufacturer and category, along with the number of orders
+    with each manufacturer and category, as an order with two items of the same category is one order for the category.
+    They are built once with vectorized groupbys over all the orders, the first time they're needed,
+    then each commit adds, and each undo takes away, the totals of only its own orders.
+    Weeks and months are rolled up from the days, and manufacturers and categories from the items, as they are shown,
+    so showing them goes over the days or items rather than every order line.
+    """
+    AMOUNT_COLUMNS = ['order_amount', 'ebay_amount', 'paypal_amount', 'postpack_amount']
+    TOTAL_COLUMNS = ['orders', 'quantity', 'revenue', 'fees', 'postpack', 'net']
+    MONEY_COLUMNS = ['revenue', 'fees', 'postpack', 'net'] # whole pence, pounds only as they are shown
+    DETAIL_COLUMNS = ['manufacturer', 'category'] # kept with the item totals
+    GROUPINGS = {'Day':'D', 'Week':'W', 'Month':'M', 'Item':'item_id', 'Manufacturer':'manufacturer', 'Category':'category'} # name shown: period or item column
+    UNDATED = 'undated' # shown for the orders with a date which can't be read, in place of the day, week or month
+    def __init__(self, read_orders, default_postpack=0):
+        """
+        Arguments:
+            read_orders: function(), returns the (headers, lines) frames of all the orders, called to build the totals
+            default_postpack: float, the postage and packing in gbp of orders without one, as set for new orders
+        """
+        self.read_orders = read_orders
+        self.schema = DatabaseSchema()
+        self.DEFAULT_POSTPACK = self.schema.get_pence(default_postpack)
+
+        self.days = pd.DataFrame(columns=self.TOTAL_COLUMNS, dtype=np.int64) # totals indexed by date, NaT for the undated orders
+        self.items = pd.DataFrame(columns=self.DETAIL_COLUMNS + self.TOTAL_COLUMNS) # totals indexed by item_id
+        self.group_orders = {col:pd.Series(dtype=np.int64) for col in self.DETAIL_COLUMNS} # number of orders with each manufacturer and category
+        self.built = False
+
+        self.lock = threading.Lock()
+
+    def get_totals(self, headers, lines):
+        """
+        Total up some orders
+
+        Arguments:
+            headers: pd.DataFrame, the order headers with the AMOUNT_COLUMNS, typed by the schema or as committed
+            lines: pd.DataFrame, the order lines
+
+        Returns:
+            tuple, (pd.DataFrame of the TOTAL_COLUMNS by date; pd.DataFrame of the DETAIL_COLUMNS and TOTAL_COLUMNS by item_id;
+                    dict, manufacturer and category: pd.Series of the number of orders with each)
+        """
+        headers = headers.drop_duplicates('order_id', keep='last').reindex(columns=['order_id', 'date'] + self.AMOUNT_COLUMNS)
+        headers = self.schema.type_headers(headers)
+        headers['postpack_amount'] = headers.postpack_amount.fillna(self.DEFAULT_POSTPACK)
+        amounts = headers[self.AMOUNT_COLUMNS].fillna(0).astype(np.int64)
+        order_ids = headers.order_id.astype('Int64').values
+
+        line_order_ids = pd.to_numeric(lines.order_id, errors='coerce').astype('Int64')
+        quantities = pd.to_numeric(lines.quantity, errors='coerce').fillna(0).round().astype(np.int64)
+        order_quantities = quantities.groupby(line_order_ids).sum()
+
+        orders = pd.DataFrame({
+            'date':headers.date.values,
+            'orders':1,
+            'quantity':order_quantities.reindex(order_ids).fillna(0).astype(np.int64).values,
+            'revenue':amounts.order_amount.values,
+            'fees':(amounts.ebay_amount + amounts.paypal_amount).values,
+            'postpack':amounts.postpack_amount.values
+            }, index=order_ids)
+        orders['net'] = orders.revenue - orders.fees - orders.postpack
+        #the undated orders are kept together under NaT
+        days = orders.groupby('date', dropna=False)[self.TOTAL_COLUMNS].sum()
+
+        item_ids = lines.item_id.astype(str).str.upper().values
+        order_codes = pd.factorize(line_order_ids)[0]
+        line_orders = orders.reindex(line_order_ids.values)[['revenue', 'fees', 'postpack']].fillna(0).astype(np.int64)
+        values = pd.DataFrame({col:self.share_pence(line_orders[col].values, quantities.values, order_codes) for col in line_orders.columns})
+        values['net'] = values.revenue - values.fees - values.postpack
+        values['quantity'] = quantities.values
+
+        #grouped by the codes of the item ids rather than the ids themselves, which is much quicker
+        item_codes, item_index = pd.factorize(item_ids)
+        order_lines = lines.reindex(columns=self.DETAIL_COLUMNS).astype(object)
+        items = order_lines.groupby(item_codes).last().join(values.groupby(item_codes).sum())
+        #an order with several lines of the same item, manufacturer or category is counted once for it
+        items['orders'] = self.count_orders(item_codes, order_codes)
+        items = items.set_axis(item_index).sort_index()[self.DETAIL_COLUMNS + self.TOTAL_COLUMNS]
+        group_orders = {}
+        for col in self.DETAIL_COLUMNS:
+            group_codes, groups = pd.factorize(order_lines[col].fillna('').astype(str).values)
+            group_orders[col] = self.count_orders(group_codes, order_codes, groups)
+
+        return days, items, group_orders
+
+    def count_orders(self, key_codes, order_codes, keys=None):
+        """
+        Arguments:
+            key_codes: np.array of int, the item id, manufacturer or category of each line as a code from 0
+            order_codes: np.array of int, the order of each line as a code from 0, -1 for lines without an order
+            keys: array, the item id, manufacturer or category of each code, to index the counts by
+
+        Returns:
+            np.array or pd.Series if keys are given, the number of different orders with lines of each code
+        """
+        #each pair of key and order once, the lines without an order are counted as one
+        pairs = np.unique(key_codes.astype(np.int64)*(len(order_codes) + 1) + order_codes + 1)
+        counts = np.bincount(pairs // (len(order_codes) + 1), minlength=key_codes.max(initial=-1) + 1)
+
+        return counts if keys is None else pd.Series(counts, index=keys)
+
+    def share_pence(self, amounts, quantities, order_codes):
+        """
+        Share each order's amount between its lines by quantity, in whole pence which add up to the order's amount
+
+        Arguments:
+            amounts: np.array of int, the amount of each line's order in pence
+            quantities: np.array of int, the quantity of each line
+            order_codes: np.array of int, the order of each line as a code from 0, -1 for lines without an order
+
+        Returns:
+            np.array of int, each line's share in pence, each order's amount is rounded down by quantity and the pence left over
+            go to the lines with the largest remainders
+        """
+        #the lines without an order are kept together in a last code, and get no share
+        codes = np.where(order_codes >= 0, order_codes, order_codes.max(initial=-1) + 1)
+        order_quantities = np.bincount(codes, weights=quantities).astype(np.int64)[codes]
+        counted = (order_quantities != 0) & (order_codes >= 0)
+        divisors = np.where(counted, order_quantities, 1)
+        shares = np.where(counted, amounts*quantities // divisors, 0)
+        remainders = np.where(counted, amounts*quantities % divisors, 0)
+
+        #the pence left over in each order, fewer than its number of lines, go one each to the lines in order of their remainders
+        left = np.where(counted, amounts, 0) - np.bincount(codes, weights=shares).astype(np.int64)[codes]
+        ranked = np.lexsort((-remainders, codes))
+        ranks = np.empty(len(codes), dtype=np.int64)
+        ranks[ranked] = np.arange(len(codes)) - np.searchsorted(codes[ranked], codes[ranked])
+
+        return shares + (counted & (ranks < left)).astype(np.int64)
+
+    @instruments.timed('build_sales_analytics')
+    def build(self):
+        """
+        Total up all the orders from scratch
+        """
+        headers, lines = self.read_orders()
+        days, items, group_orders = self.get_totals(headers, lines)
+        with self.lock:
+            self.days = days
+            self.items = items
+            self.group_orders = group_orders
+            self.built = True
+
+    def invalidate(self):
+        """
+        Build the totals again the next time they're needed, e.g. after the orders files have been replaced from google drive
+        """
+        with self.lock:
+            self.built = False
+
+    def add_orders(self, headers, lines, sign=1):
+        """
+        Add the totals of committed orders, or take away those of undone orders, if the totals have been built
+
+        Arguments:
+            headers: list of dicts, the order headers
+            lines: list of dicts, the order lines
+            sign: int, -1 to take the orders away
+        """
+        if not self.built:
+            return
+
+        days, items, group_orders = self.get_totals(pd.DataFrame(headers, columns=['order_id', 'date'] + self.AMOUNT_COLUMNS), pd.DataFrame(lines, columns=['order_id', 'item_id', 'quantity'] + self.DETAIL_COLUMNS))
+        with self.lock:
+            self.days = self.days.add(sign*days, fill_value=0).astype(np.int64)
+            totals = self.items[self.TOTAL_COLUMNS].add(sign*items[self.TOTAL_COLUMNS], fill_value=0).astype(np.int64)
+            self.items = items[self.DETAIL_COLUMNS].combine_first(self.items[self.DETAIL_COLUMNS]).join(totals)
+            self.group_orders = {col:self.group_orders[col].add(sign*group_orders[col], fill_value=0).astype(np.int64) for col in self.DETAIL_COLUMNS}
+
+            #drop the days, items, manufacturers and categories left without any orders after an undo
+            self.days = self.days[self.days.orders != 0]
+            self.items = self.items[self.items.orders != 0]
+            self.group_orders = {col:counts[counts != 0] for col, counts in self.group_orders.items()}
+
+    def get_table(self, grouping):
+        """
+        Arguments:
+            grouping: str, one of the GROUPINGS
+
+        Returns:
+            pd.DataFrame, a row per day, week, month, item, manufacturer or category with the TOTAL_COLUMNS, the money in gbp, and the margin,
+                          the first column is the group as text, with an UNDATED row for the orders without a date
+        """
+        if not self.built:
+            self.build()
+
+        with self.lock:
+            days = self.days
+            items = self.items
+            group_orders = self.group_orders
+
+        key = self.GROUPINGS[grouping]
+        if key in self.DETAIL_COLUMNS:
+            table = items.groupby(items[key].fillna('').astype(str))[self.TOTAL_COLUMNS].sum()
+            #the orders with more than one of the items aren't counted again
+            table['orders'] = group_orders[key].reindex(table.index).fillna(0).astype(np.int64)
+        elif key == 'item_id':
+            table = items.copy()
+        else:
+            dated = days[days.index.notna()]
+            if key == 'D':
+                table = dated.copy()
+                table.index = table.index.strftime('%Y-%m-%d')
+            else:
+                table = dated.groupby(dated.index.to_period(key))[self.TOTAL_COLUMNS].sum()
+                table.index = table.index.start_time.strftime('%Y-%m-%d' if key == 'W' else '%Y-%m')
+            if len(dated) < len(days):
+                table.loc[self.UNDATED] = days[days.index.isna()][self.TOTAL_COLUMNS].sum()
+
+        table['margin'] = (100*table.net / table.revenue.where(table.revenue != 0)).round(1)
+        table[self.MONEY_COLUMNS] = table[self.MONEY_COLUMNS]/100
+        table.index.name = grouping.lower()
+
+        return table.reset_index()
+
+    def get_overall(self):
+        """
+        Returns:
+            pd.Series, the TOTAL_COLUMNS over all the orders, dated or not, with the money in gbp
+        """
+        if not self.built:
+            self.build()
+
+        with self.lock:
+            overall = self.days[self.TOTAL_COLUMNS].sum().astype('float64')
+        overall[self.MONEY_COLUMNS] = overall[self.MONEY_COLUMNS]/100
+
+        return overall
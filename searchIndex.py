@@ -0,0 +1,149 @@
+from collections import defaultdict
+import pandas as pd
+import threading
+
+class SearchIndex():
+    """
+    Trigram index over the text fields of the stock database for fast substring searching
+
+    Each item id is mapped to the lower case text of its searchable fields, joined with FIELD_SEPARATOR so a term can't match across two fields,
+    and each trigram of that text is mapped to the set of item ids containing it.
+    Terms of at least GRAM_LENGTH characters are matched by intersecting the postings of their trigrams and checking the few candidates left,
+    shorter terms fall back to a scan of the item texts.
+    Updates and searches hold self.lock so the index can be searched from a worker thread.
+    """
+    SEARCH_COLUMNS = ['manufacturer', 'category', 'description'] # searched along with the item_id index
+    GRAM_LENGTH = 3
+    FIELD_SEPARATOR = '\x00'
+    def __init__(self):
+        self.texts = {} # item_id: searchable text
+        self.postings = defaultdict(set) # trigram: set of item_ids
+        self.lock = threading.Lock()
+
+    def get_grams(self, text):
+        """
+        Returns:
+            set of the trigrams in the text
+        """
+        return {text[i:i+self.GRAM_LENGTH] for i in range(len(text)-self.GRAM_LENGTH+1)}
+
+    def get_texts(self, stock):
+        """
+        Build the searchable text for each row of the stock frame
+
+        Arguments:
+            stock: pd.DataFrame, indexed by item_id
+
+        Returns:
+            pd.Series of str indexed by item_id, rows with the same id are joined together
+        """
+        texts = pd.Series(stock.index.astype(str), index=stock.index)
+        for col in self.SEARCH_COLUMNS:
+            if col in stock.columns:
+                texts = texts + self.FIELD_SEPARATOR + stock[col].astype(object).fillna('').astype(str)
+        texts = texts.str.lower()
+
+        if not texts.index.is_unique:
+            texts = texts.groupby(level=0).agg(self.FIELD_SEPARATOR.join)
+
+        return texts
+
+    def add(self, item_id, text):
+        self.texts[item_id] = text
+        for gram in self.get_grams(text):
+            if self.FIELD_SEPARATOR not in gram:
+                self.postings[gram].add(item_id)
+
+    def remove(self, item_id):
+        text = self.texts.pop(item_id, None)
+        if text is None:
+            return
+        for gram in self.get_grams(text):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def build(self, stock):
+        """
+        Index the whole stock frame from scratch
+
+        Arguments:
+            stock: pd.DataFrame, indexed by item_id
+        """
+        with self.lock:
+            self.texts = {}
+            self.postings = defaultdict(set)
+            for item_id, text in self.get_texts(stock).items():
+                self.add(item_id, text)
+
+    def update(self, old_stock, stock):
+        """
+        Re-index only the items which have been added, removed or had their text fields changed, stock level changes don't touch the index
+
+        Arguments:
+            old_stock: pd.DataFrame, the stock frame the index was built from
+            stock: pd.DataFrame, the new stock frame
+        """
+        cols = [col for col in self.SEARCH_COLUMNS if col in stock.columns]
+        if not (old_stock.index.is_unique and stock.index.is_unique) or not all(col in old_stock.columns for col in cols):
+            self.build(stock)
+            return
+
+        if stock.index[:len(old_stock)].equals(old_stock.index):
+            #usual case, the same items in the same order with any new items at the end
+            common = old_stock.index
+            new_fields = stock[cols].iloc[:len(old_stock)]
+        else:
+            common = stock.index.intersection(old_stock.index)
+            new_fields = stock.loc[common, cols]
+        old_fields = old_stock.loc[common, cols]
+
+        changed = pd.Series(False, index=common)
+        for col in cols:
+            if not new_fields[col].equals(old_fields[col]):
+                changed |= new_fields[col].astype(object).fillna('').values != old_fields[col].astype(object).fillna('').values
+        changed = common[changed.values]
+
+        to_remove = old_stock.index.difference(stock.index).append(changed)
+        to_add = stock.index.difference(old_stock.index).append(changed)
+        texts = self.get_texts(stock.loc[to_add]) if len(to_add) > 0 else pd.Series(dtype=object)
+
+        with self.lock:
+            for item_id in to_remove:
+                self.remove(item_id)
+            for item_id, text in texts.items():
+                self.add(item_id, text)
+
+    def search_term(self, term):
+        """
+        Arguments:
+            term: str, a single search term
+
+        Returns:
+            set of the item ids with any field containing the term, case insensitive
+        """
+        term = term.lower()
+        with self.lock:
+            if len(term) < self.GRAM_LENGTH:
+                return {item_id for item_id, text in self.texts.items() if term in text}
+
+            grams = sorted((self.postings.get(gram, set()) for gram in self.get_grams(term)), key=len)
+            candidates = grams[0].intersection(*grams[1:])
+
+            return {item_id for item_id in candidates if term in self.texts[item_id]}
+
+    def search(self, terms):
+        """
+        Arguments:
+            terms: list of str
+
+        Returns:
+            set of the item ids with any field containing any of the terms
+        """
+        found = set()
+        for term in terms:
+            found |= self.search_term(term)
+
+        return found
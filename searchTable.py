@@ -1,20 +1,33 @@
 import PyQt5.QtWidgets as widgets
 from PyQt5.QtCore import pyqtSignal as Signal
-from PyQt5.QtCore import QObject
-from PyQt5.QtGui import QIntValidator
+from PyQt5.QtCore import QTimer, QThreadPool, Qt
 import pandas as pd
-import numpy as np
+import threading
+from searchWorker import SearchWorker
+from stockTableModel import StockTableModel
+from instrumentation import instruments
 
 class SearchTable(widgets.QWidget):
-    LOW_STOCK_LIMIT = 15 # limit for including in low stock get
-    NUM_ROWS = 500 # the number of rows in the table, note: this doesn't affect what is saved (as this is taken from self.frame), just what is shown in the table
     NO_FILENAME = ""
+    SEARCH_DELAY = 300 # ms after the last keystroke in the search field before searching
+    LOW_STOCK_ROWS = 500 # most short items shown by the low stock button, read off the top of the LowStockIndex heap
     save_error = Signal(str, PermissionError)
-    def __init__(self, stock_filepath):
+    def __init__(self, stock_db):
         super().__init__()
         
-        self.STOCK_FILEPATH = stock_filepath
-        self.frame = pd.DataFrame()
+        self.stock_db = stock_db # shared StockDatabase
+        
+        #searches run on a worker thread, a newer search cancels the running one
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(1)
+        self.search_number = 0
+        self.search_cancel = threading.Event()
+        
+        #search as you type, after a short pause
+        self.search_timer = QTimer()
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search)
         
         layout = widgets.QVBoxLayout()
         self.setLayout(layout)
@@ -24,11 +37,17 @@ class SearchTable(widgets.QWidget):
         topBar = widgets.QHBoxLayout()
         topBar.addWidget(widgets.QLabel("Search"))
         self.searchEdit = widgets.QLineEdit()
+        self.searchEdit.textEdited.connect(self.start_search_timer)
         self.searchEdit.editingFinished.connect(self.search)
         topBar.addWidget(self.searchEdit)
         
         topBar.addStretch(1)
         
+        #live count of the items needing reordering
+        self.reorderLabel = widgets.QLabel()
+        topBar.addWidget(self.reorderLabel)
+        self.stock_db.stock_changed.connect(self.update_reorder_count)
+        
         lowStockButton = widgets.QPushButton("Find low stock items")
         lowStockButton.clicked.connect(self.get_low_stock)
         topBar.addWidget(lowStockButton)
@@ -38,12 +57,13 @@ class SearchTable(widgets.QWidget):
         
         #add the table
         ###
-        self.table = widgets.QTableWidget(self.NUM_ROWS,5)
-        self.table.setHorizontalHeaderItem(0, widgets.QTableWidgetItem("Item ID"))
-        self.table.setHorizontalHeaderItem(1, widgets.QTableWidgetItem("Manufacturer"))
-        self.table.setHorizontalHeaderItem(2, widgets.QTableWidgetItem("Category"))
-        self.table.setHorizontalHeaderItem(3, widgets.QTableWidgetItem("Stock"))
-        self.table.setHorizontalHeaderItem(4, widgets.QTableWidgetItem("Description"))
+        #the model reads from the results frame and the view only draws the visible rows, so all the results are shown
+        self.model = StockTableModel()
+        self.table = widgets.QTableView()
+        self.table.setModel(self.model)
+        self.table.verticalHeader().setSectionResizeMode(widgets.QHeaderView.Fixed)
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
         layout.addWidget(self.table)
         ###
         
@@ -57,71 +77,99 @@ class SearchTable(widgets.QWidget):
         layout.addLayout(bottomBar)
         ###
         
-    def load_stock_database(self):
+        self.update_reorder_count()
+        
+    def start_search_timer(self, text):
+        """
+        Restart the search delay timer, the search runs once typing pauses
+        SLOT connected to self.searchEdit.textEdited() SIGNAL in self.__init__()
+        """
+        self.search_timer.start()
+        
+    def cancel_search(self):
         """
-        Load the stock database using the filepath defined in self.__init__() from parent
-        Don't set the index to the item id here
+        Cancel any running search and stop the delay timer
+        Returns the number for the next search
         """
-        stock = pd.read_csv(self.STOCK_FILEPATH)
-        stock.item_id = stock.item_id.astype(str)
-        stock.item_id = stock.item_id.apply(str.upper)
+        self.search_timer.stop()
+        self.search_cancel.set()
+        self.search_cancel = threading.Event()
+        self.search_number += 1
         
-        return stock
+        return self.search_number
         
+    @instruments.timed('search')
     def search(self):
         """
         Search for a number of terms separated by spaces
-        uses the pandas series.str.contains() function
-        fills the table with the returned values
+        uses the trigram index kept by the StockDatabase, any fields containing any of the terms are returned
+        the search runs on a worker thread and the table is filled as the results come back
         
-        SLOT connected to self.searchEdit.editingFinished() SIGNAL in self.__init__()
+        SLOT connected to self.searchEdit.editingFinished() SIGNAL and self.search_timer.timeout() SIGNAL in self.__init__()
         """
-        stock = self.load_stock_database()
+        search_number = self.cancel_search()
         
         term = self.searchEdit.text()
         
         terms = term.split(' ')
         
-        output = pd.DataFrame()
-        for t in terms:
-            for col in stock.columns:
-                try:
-                    stock['term_in'] = stock[col].str.contains(t, na=False, case=False)
-                except AttributeError:
-                    continue
-                output = output.append(stock[stock.term_in == True])
-        output = output.drop_duplicates()
-        output = output.drop('term_in', axis=1)
+        self.populate_table(pd.DataFrame(columns=StockTableModel.COLUMNS))
+        
+        worker = SearchWorker(self.stock_db, terms, search_number, self.search_cancel)
+        worker.signals.results.connect(self.add_search_results)
+        self.thread_pool.start(worker)
+        
+    def add_search_results(self, search_number, frame):
+        """
+        Add a chunk of results to the table, ignoring any from a cancelled search
+        SLOT connected to SearchWorker.signals.results() SIGNAL in self.search()
         
-        self.populate_table(output)
+        Arguments:
+            search_number: int, the number of the search the results are from
+            frame: pd.DataFrame, the rows found
+        """
+        if search_number == self.search_number:
+            self.append_to_table(frame)
         
+    @instruments.timed('get_low_stock')
     def get_low_stock(self):
         """
-        Fill the table with items with stock less than self.LOW_STOCK_LIMIT
+        Fill the table with the LOW_STOCK_ROWS items furthest below their reorder threshold, the most short first, see LowStockIndex
         SLOT connected to lowStockButton.clicked() SIGNAL in self.__init__()
         """
-        stock = self.load_stock_database()
+        self.cancel_search()
         
-        stock = stock[stock.stock < self.LOW_STOCK_LIMIT]
+        stock = self.stock_db.get_low_stock(self.LOW_STOCK_ROWS).reset_index()
         
         self.populate_table(stock)
+        
+    def update_reorder_count(self):
+        """
+        Show how many items need reordering
+        SLOT connected to self.stock_db.stock_changed() SIGNAL in self.__init__()
+        """
+        count = self.stock_db.get_low_stock_count()
+        self.reorderLabel.setText("{} items need reordering".format(count) if count != 1 else "1 item needs reordering")
 
+    @instruments.timed('populate_table')
     def populate_table(self, frame):
         """
-        Fill the self.table QTableWidget with data
+        Fill the self.table QTableView with data, via self.model
+        
+        Arguments:
+            frame: pd.DataFrame, the data to fill the table with, containing keys 'item_id', 'manufacturer', 'category', 'stock' and 'description'
+        """
+        self.model.set_frame(frame)
+        
+    @instruments.timed('append_to_table')
+    def append_to_table(self, frame):
+        """
+        Add rows to the self.table QTableView, via self.model
         
         Arguments:
-            frame: pd.DataFrame, the data to fill the table with, containing keys 'manufacturer', 'category' and 'stock'
+            frame: pd.DataFrame, the data to add, containing keys 'item_id', 'manufacturer', 'category', 'stock' and 'description'
         """
-        frame = frame.replace(np.nan, '') # empty cells for np.nan in the dataframe
-        self.frame = frame
-        self.table.clearContents() # empty the table data but not the headers
-        for index, row in enumerate(frame.iterrows()):
-            self.table.setItem(index,0,widgets.QTableWidgetItem(str(row[1]['item_id'])))
-            self.table.setItem(index,1,widgets.QTableWidgetItem(str(row[1]['manufacturer'])))
-            self.table.setItem(index,2,widgets.QTableWidgetItem(str(row[1]['category'])))
-            self.table.setItem(index,3,widgets.QTableWidgetItem(str(row[1]['stock'])))
-            self.table.setItem(index,4,widgets.QTableWidgetItem(str(row[1]['description'])))
+        self.model.append_frame(frame)
         
         
     def save_to_file(self):
@@ -129,13 +177,14 @@ class SearchTable(widgets.QWidget):
         Save the data contained in the table to a user-named csv file
         Set the index to the item id for saving to remove the arbitrary index column
         """
-        if len(self.frame) > 0:
+        frame = self.model.get_frame()
+        if len(frame) > 0:
             (name, type) = widgets.QFileDialog.getSaveFileName(self, caption="Save stock data", filter="*.csv")
             
             if name == self.NO_FILENAME:
                 return
             
-            frame_to_save = self.frame.set_index('item_id')
+            frame_to_save = frame.set_index('item_id')
             
             try:
                 frame_to_save.to_csv(name)
@@ -0,0 +1,59 @@
+from PyQt5.QtCore import pyqtSignal as Signal
+from PyQt5.QtCore import QObject, QRunnable
+from instrumentation import instruments
+
+class SearchWorkerSignals(QObject):
+    """
+    Signals for the SearchWorker, a QRunnable can't emit signals itself
+    """
+    results = Signal(int, object) # search number, pd.DataFrame of matching stock rows
+    finished = Signal(int) # search number
+
+class SearchWorker(QRunnable):
+    """
+    Run a stock search on a QThreadPool thread, streaming the results back to the SearchTable a chunk at a time
+
+    The search stops at the next term or chunk once its cancel event is set, e.g. when a newer search is started
+    """
+    CHUNK_SIZE = 500 # maximum number of rows sent back per results signal
+    def __init__(self, stock_db, terms, search_number, cancel_event):
+        """
+        Arguments:
+            stock_db: StockDatabase, the shared stock database
+            terms: list of str, the search terms
+            search_number: int, sent back with the results so stale results can be ignored
+            cancel_event: threading.Event, set to cancel the search
+        """
+        super().__init__()
+
+        self.stock_db = stock_db
+        self.terms = terms
+        self.search_number = search_number
+        self.cancel_event = cancel_event
+
+        self.signals = SearchWorkerSignals()
+
+    @instruments.timed('search_worker')
+    def run(self):
+        """
+        Search each term in turn, sending back the rows not already found by an earlier term
+        """
+        if not self.cancel_event.is_set():
+            stock, search_index = self.stock_db.get_search_index()
+
+            found = set()
+            for term in self.terms:
+                if self.cancel_event.is_set():
+                    break
+
+                new_ids = search_index.search_term(term) - found
+                found |= new_ids
+                instruments.count('search_results', len(new_ids))
+
+                rows = stock[stock.index.isin(new_ids)]
+                for start in range(0, len(rows), self.CHUNK_SIZE):
+                    if self.cancel_event.is_set():
+                        break
+                    self.signals.results.emit(self.search_number, rows.iloc[start:start+self.CHUNK_SIZE].reset_index())
+
+        self.signals.finished.emit(self.search_number)
@@ -0,0 +1,337 @@
+import sqlite3
+import re
+import threading
+import pandas as pd
+from orderDatabase import OrderDatabase
+from databaseSchema import DatabaseSchema
+from instrumentation import instruments
+
+class SqliteDatabase():
+    """
+    Optional transactional store for the stock, orders and stock adding databases, used instead of the csv files when MainWindow.USE_SQLITE is set
+
+    The stock table is indexed on item_id for the stock changes of each commit, the items are looked up in the StockDatabase's in-memory copy. Orders and stock adds are stored as a header row plus one row per item, like the orders and order lines files,
+    and each commit or undo (the order or stock add and the matching stock changes) is a single transaction, so a failure leaves nothing half saved.
+    The csv files stay the interchange format with google drive, they are imported with self.import_csv() and written back with self.export_csv().
+    The connection can be used from the search worker thread, self.lock serialises its use.
+    """
+    STOCK_COLUMNS = ['item_id', 'manufacturer', 'category', 'stock', 'description']
+    ORDER_ITEM_COLUMNS = {'order_id':'order_id', 'item_num':'item_num', 'item_id':'id', 'quantity':'quantity', 'manufacturer':'manufacturer', 'category':'category', 'description':'description'} # order lines column: order_items column
+    STOCK_ADD_COLUMNS = ['date', 'time']
+    STOCK_ADD_ITEM_FIELDS = ['id', 'quantity']
+    ITEM_COLUMN_PATTERN = re.compile(r'^item(\d+)_(\w+)$')
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS stock (item_id TEXT NOT NULL, manufacturer TEXT, category TEXT, stock INTEGER NOT NULL DEFAULT 0, description TEXT);
+        CREATE INDEX IF NOT EXISTS stock_item_id ON stock (item_id);
+        CREATE TABLE IF NOT EXISTS orders (order_id INTEGER PRIMARY KEY, postcode TEXT, date TEXT, order_amount REAL, ebay_amount REAL, paypal_amount REAL, postpack_amount REAL, order_number TEXT);
+        CREATE TABLE IF NOT EXISTS order_items (order_id INTEGER NOT NULL REFERENCES orders (order_id), item_num INTEGER NOT NULL, id TEXT NOT NULL, quantity INTEGER NOT NULL, manufacturer TEXT, category TEXT, description TEXT);
+        CREATE INDEX IF NOT EXISTS order_items_order_id ON order_items (order_id);
+        CREATE INDEX IF NOT EXISTS order_items_item_id ON order_items (id);
+        CREATE TABLE IF NOT EXISTS stock_adds (stock_add_id INTEGER PRIMARY KEY, date TEXT, time TEXT);
+        CREATE TABLE IF NOT EXISTS stock_add_items (stock_add_id INTEGER NOT NULL REFERENCES stock_adds (stock_add_id), item_num INTEGER NOT NULL, id TEXT NOT NULL, quantity INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS stock_add_items_stock_add_id ON stock_add_items (stock_add_id);
+        """
+    def __init__(self, filepath):
+        """
+        Arguments:
+            filepath: str, path to the sqlite database file, created if it doesn't exist
+        """
+        self.FILEPATH = filepath
+        self.schema = DatabaseSchema() # column types of the frames read
+
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+        #databases from before the ebay order numbers were kept
+        if 'order_number' not in [row[1] for row in self.connection.execute("PRAGMA table_info(orders)")]:
+            with self.connection:
+                self.connection.execute("ALTER TABLE orders ADD COLUMN order_number TEXT")
+
+    def close(self):
+        self.connection.close()
+
+    def is_empty(self):
+        """
+        Returns:
+            bool, True if nothing has been imported yet
+        """
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM stock").fetchone()[0] == 0
+
+    def to_rows(self, frame, columns):
+        """
+        Convert frame columns to a list of tuples sqlite can bind, with None for missing values
+        """
+        frame = frame.reindex(columns=columns).astype(object)
+        frame = frame.where(frame.notna(), None)
+
+        return list(frame.itertuples(index=False, name=None))
+
+    def split_items(self, row, fields):
+        """
+        Split the items out of a wide order or stock add row
+
+        Arguments:
+            row: dict or pd.Series, with itemN_field keys
+            fields: list of str, the item fields to keep
+
+        Returns:
+            list of dicts, item_num plus the fields for each item with an id
+        """
+        items = {}
+        for key, value in row.items():
+            match = self.ITEM_COLUMN_PATTERN.match(key)
+            if match and match.group(2) in fields:
+                items.setdefault(int(match.group(1)), {})[match.group(2)] = value
+
+        lines = []
+        for item_num in sorted(items):
+            item = items[item_num]
+            if pd.isna(item.get('id', None)) or pd.isna(item.get('quantity', None)):
+                continue
+            item['item_num'] = item_num
+            item['quantity'] = int(item['quantity'])
+            lines.append(item)
+
+        return lines
+
+    def join_items(self, headers, items, key, fields):
+        """
+        Join header rows and their items back into the wide csv layout, one row per header with itemN_field columns
+
+        Arguments:
+            headers: pd.DataFrame, indexed by key
+            items: pd.DataFrame, with columns key, item_num and the fields
+            key: str, the header id column
+            fields: list of str, the item fields
+
+        Returns:
+            pd.DataFrame
+        """
+        if len(items) == 0:
+            return headers.reset_index(drop=True)
+
+        items = items.astype({'quantity':'Int64'}) # keep the quantities as integers when unstacking leaves gaps
+        wide = items.set_index([key, 'item_num'])[fields].unstack('item_num')
+        wide = wide.reindex(columns=[(field, item_num) for item_num in sorted(items.item_num.unique()) for field in fields])
+        wide.columns = ['item{0}_{1}'.format(item_num, field) for field, item_num in wide.columns]
+
+        return headers.join(wide).reset_index(drop=True)
+
+    @instruments.timed('sqlite_import_csv')
+    def import_csv(self, stock_filepath, orders_filepath, order_lines_filepath, stock_adding_filepath):
+        """
+        Replace the contents of the database with the csv files, in a single transaction
+
+        Arguments:
+            stock_filepath, orders_filepath, order_lines_filepath, stock_adding_filepath: str, paths to the csv files
+        """
+        stock = pd.read_csv(stock_filepath)
+        stock.item_id = stock.item_id.astype(str).str.upper()
+        orders, order_lines = OrderDatabase(orders_filepath, order_lines_filepath).read()
+        orders = self.schema.format_headers(orders)
+        stock_adding = pd.read_csv(stock_adding_filepath)
+
+        stock_add_items = []
+        for stock_add_id, stock_add in enumerate(stock_adding.to_dict('records'), 1):
+            stock_add_items += [dict(item, stock_add_id=stock_add_id) for item in self.split_items(stock_add, self.STOCK_ADD_ITEM_FIELDS)]
+        stock_adding['stock_add_id'] = range(1, len(stock_adding)+1)
+
+        stock_add_item_columns = ['stock_add_id', 'item_num'] + self.STOCK_ADD_ITEM_FIELDS
+        with self.lock, self.connection:
+            for table in ['order_items', 'orders', 'stock_add_items', 'stock_adds', 'stock']:
+                self.connection.execute("DELETE FROM {}".format(table))
+            self.connection.executemany("INSERT INTO stock VALUES (?,?,?,?,?)", self.to_rows(stock, self.STOCK_COLUMNS))
+            self.connection.executemany("INSERT INTO orders VALUES (?,?,?,?,?,?,?,?)", self.to_rows(orders, OrderDatabase.HEADER_COLUMNS))
+            self.connection.executemany("INSERT INTO order_items VALUES (?,?,?,?,?,?,?)", self.to_rows(order_lines, OrderDatabase.LINE_COLUMNS))
+            self.connection.executemany("INSERT INTO stock_adds VALUES (?,?,?)", self.to_rows(stock_adding, ['stock_add_id'] + self.STOCK_ADD_COLUMNS))
+            self.connection.executemany("INSERT INTO stock_add_items VALUES (?,?,?,?)", self.to_rows(pd.DataFrame(stock_add_items, columns=stock_add_item_columns), stock_add_item_columns))
+
+    @instruments.timed('sqlite_export_csv')
+    def export_csv(self, stock_filepath, orders_filepath, order_lines_filepath, stock_adding_filepath):
+        """
+        Write the database out to the csv files in the same layout the csv version of the program uses
+
+        Arguments:
+            stock_filepath, orders_filepath, order_lines_filepath, stock_adding_filepath: str, paths to the csv files
+
+        Raises:
+            PermissionError if one of the files can't be written
+        """
+        with self.lock:
+            self.read_stock().to_csv(stock_filepath)
+
+            orders, order_lines = self.read_orders()
+            OrderDatabase(orders_filepath, order_lines_filepath).write(self.schema.format_headers(orders).reindex(columns=OrderDatabase.HEADER_COLUMNS), order_lines)
+
+            self.read_stock_adding().set_index(['date', 'time']).to_csv(stock_adding_filepath)
+
+    def read_stock_adding(self):
+        """
+        Returns:
+            pd.DataFrame, the stock adds in the wide layout of the stock adding file, date and time then itemN_id and itemN_quantity columns
+        """
+        with self.lock:
+            stock_adding = pd.read_sql_query("SELECT * FROM stock_adds ORDER BY stock_add_id", self.connection, index_col='stock_add_id')
+            stock_add_items = pd.read_sql_query("SELECT * FROM stock_add_items", self.connection)
+
+        return self.join_items(stock_adding, stock_add_items, 'stock_add_id', self.STOCK_ADD_ITEM_FIELDS)
+
+    def read_orders(self):
+        """
+        Returns:
+            tuple of pd.DataFrames, (headers, lines) in the layout of the orders and order lines files, typed by the DatabaseSchema
+        """
+        with self.lock:
+            orders = pd.read_sql_query("SELECT * FROM orders ORDER BY order_id", self.connection)
+            order_lines = pd.read_sql_query("SELECT {} FROM order_items ORDER BY order_id, item_num".format(self.get_order_item_select()), self.connection)
+
+        return self.schema.type_headers(orders), self.schema.type_lines(order_lines)
+
+    def get_order_item_select(self):
+        """
+        Returns:
+            str, the select expression for the order_items columns named as the order lines columns
+        """
+        return ', '.join('{0} AS {1}'.format(col, line_col) for line_col, col in self.ORDER_ITEM_COLUMNS.items())
+
+    def read_stock(self):
+        """
+        Returns:
+            pd.DataFrame, the stock database indexed by item_id in the same layout as the csv file
+        """
+        with self.lock:
+            return pd.read_sql_query("SELECT {} FROM stock ORDER BY rowid".format(', '.join(self.STOCK_COLUMNS)), self.connection, index_col='item_id')
+
+    def change_stock(self, stock_changes):
+        """
+        Add to the stock of each item, run inside the commit transactions
+
+        Arguments:
+            stock_changes: dict, item_id: change in stock
+
+        Raises:
+            KeyError if an item isn't in the stock table, rolling back the transaction
+        """
+        for item_id, change in stock_changes.items():
+            cursor = self.connection.execute("UPDATE stock SET stock = stock + ? WHERE item_id = ?", (int(change), item_id))
+            if cursor.rowcount == 0:
+                raise KeyError(item_id)
+
+    @instruments.timed('sqlite_commit_orders')
+    def commit_orders(self, headers, lines, stock_changes):
+        """
+        Save new orders, e.g. one from the order form or a batch imported from ebay, and deduct their stock in a single transaction
+
+        Arguments:
+            headers: list of dicts, with the OrderDatabase.HEADER_COLUMNS
+            lines: list of dicts, with the OrderDatabase.LINE_COLUMNS
+            stock_changes: dict, item_id: change in stock (negative)
+
+        Raises:
+            sqlite3.Error, or KeyError if an item is missing, nothing is saved
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT INTO orders VALUES (?,?,?,?,?,?,?,?)", self.to_rows(pd.DataFrame(headers), OrderDatabase.HEADER_COLUMNS))
+            self.connection.executemany("INSERT INTO order_items VALUES (?,?,?,?,?,?,?)", self.to_rows(pd.DataFrame(lines), OrderDatabase.LINE_COLUMNS))
+            self.change_stock(stock_changes)
+
+    def get_next_order_id(self):
+        """
+        Returns:
+            int, one more than the id of the last order
+        """
+        with self.lock:
+            last_order_id = self.connection.execute("SELECT MAX(order_id) FROM orders").fetchone()[0]
+
+        return 1 if last_order_id is None else last_order_id + 1
+
+    @instruments.timed('sqlite_commit_stock_add')
+    def commit_stock_add(self, stock_add, stock_changes, new_items):
+        """
+        Save a new stock add, add any new items and increase the stock in a single transaction
+
+        Arguments:
+            stock_add: dict, the stock add in the wide csv layout, with itemN_ keys
+            stock_changes: dict, item_id: change in stock for existing items
+            new_items: pd.DataFrame, new stock rows indexed by item_id
+
+        Raises:
+            sqlite3.Error, or KeyError if an item is missing, nothing is saved
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute("INSERT INTO stock_adds ({}) VALUES (?,?)".format(', '.join(self.STOCK_ADD_COLUMNS)), (stock_add['date'], stock_add['time']))
+            items = pd.DataFrame(self.split_items(stock_add, self.STOCK_ADD_ITEM_FIELDS))
+            items['stock_add_id'] = cursor.lastrowid
+            self.connection.executemany("INSERT INTO stock_add_items VALUES (?,?,?,?)", self.to_rows(items, ['stock_add_id', 'item_num'] + self.STOCK_ADD_ITEM_FIELDS))
+            self.connection.executemany("INSERT INTO stock VALUES (?,?,?,?,?)", self.to_rows(new_items.reset_index(), self.STOCK_COLUMNS))
+            self.change_stock(stock_changes)
+
+    def get_last_order(self):
+        """
+        Returns:
+            tuple, (pd.Series, the header of the last order or None if there are no orders; pd.DataFrame, its lines)
+        """
+        with self.lock:
+            orders = pd.read_sql_query("SELECT * FROM orders ORDER BY order_id DESC LIMIT 1", self.connection)
+            if len(orders) == 0:
+                return None, pd.DataFrame(columns=OrderDatabase.LINE_COLUMNS)
+            lines = pd.read_sql_query("SELECT {} FROM order_items WHERE order_id = ? ORDER BY item_num".format(self.get_order_item_select()), self.connection, params=(int(orders.order_id.iloc[0]),))
+
+            return orders.iloc[0], lines
+
+    def get_last_stock_add(self):
+        """
+        Returns:
+            pd.Series, the last stock add in the wide csv layout, or None if there are no stock adds
+        """
+        with self.lock:
+            stock_adds = pd.read_sql_query("SELECT * FROM stock_adds ORDER BY stock_add_id DESC LIMIT 1", self.connection, index_col='stock_add_id')
+            if len(stock_adds) == 0:
+                return None
+            items = pd.read_sql_query("SELECT * FROM stock_add_items WHERE stock_add_id = ?", self.connection, params=(int(stock_adds.index[0]),))
+
+            return self.join_items(stock_adds, items, 'stock_add_id', self.STOCK_ADD_ITEM_FIELDS).iloc[0]
+
+    def remove_last_orders(self, count=1):
+        """
+        Remove the last orders and re-add their stock in a single transaction
+
+        Arguments:
+            count: int, number of orders to remove from the end, e.g. all the orders of an import
+
+        Raises:
+            sqlite3.Error, or KeyError if an item is missing, nothing is changed
+        """
+        with self.lock, self.connection:
+            #the first of the last count orders
+            first_id = self.connection.execute("SELECT MIN(order_id) FROM (SELECT order_id FROM orders ORDER BY order_id DESC LIMIT ?)", (int(count),)).fetchone()[0]
+            items = self.connection.execute("SELECT id, quantity FROM order_items WHERE order_id >= ?", (first_id,)).fetchall()
+            self.connection.execute("DELETE FROM order_items WHERE order_id >= ?", (first_id,))
+            self.connection.execute("DELETE FROM orders WHERE order_id >= ?", (first_id,))
+            self.change_stock(self.sum_quantities(items, 1))
+
+    def remove_last_stock_add(self):
+        """
+        Remove the last stock add and deduct its stock in a single transaction
+
+        Raises:
+            sqlite3.Error, or KeyError if an item is missing, nothing is changed
+        """
+        with self.lock, self.connection:
+            stock_add_id = self.connection.execute("SELECT MAX(stock_add_id) FROM stock_adds").fetchone()[0]
+            items = self.connection.execute("SELECT id, quantity FROM stock_add_items WHERE stock_add_id = ?", (stock_add_id,)).fetchall()
+            self.connection.execute("DELETE FROM stock_add_items WHERE stock_add_id = ?", (stock_add_id,))
+            self.connection.execute("DELETE FROM stock_adds WHERE stock_add_id = ?", (stock_add_id,))
+            self.change_stock(self.sum_quantities(items, -1))
+
+    def sum_quantities(self, items, sign):
+        """
+        Returns:
+            dict, item_id: total quantity times sign
+        """
+        stock_changes = {}
+        for item_id, quantity in items:
+            stock_changes[item_id] = stock_changes.get(item_id, 0) + sign*quantity
+
+        return stock_changes
@@ -0,0 +1,271 @@
+from PyQt5.QtCore import pyqtSignal as Signal
+from PyQt5.QtCore import QObject
+import pandas as pd
+import os
+import threading
+from searchIndex import SearchIndex
+from lowStockIndex import LowStockIndex
+from databaseSchema import DatabaseSchema
+from instrumentation import instruments
+
+class StockDatabase(QObject):
+    """
+    Shared in-memory copy of the stock database, used by the MainWindow, the InputForms and the SearchTable
+
+    The parsed frame (indexed by item_id) is kept in memory and the csv file is only re-read when its modification time or size changes,
+    e.g. after a pull from google drive or an edit in another program
+    Loads and saves hold self.lock so the stock can be searched from a worker thread
+    The frame is typed by the DatabaseSchema, with categorical manufacturer and category columns and integer stock
+    A stock which isn't a whole number is read as 0, and the stock can't be saved until it has been corrected, so the value in the file isn't lost
+    """
+    NO_SIGNATURE = None
+    stock_changed = Signal()
+    invalid_stock_found = Signal(list) # (item_id, text) of the stock which isn't a whole number, emitted when the stock is read
+    def __init__(self, stock_filepath, sqlite_db=None, thresholds_filepath=None, csv_cache=None):
+        """
+        Arguments:
+            stock_filepath: str, path to the csv file containing the stock details
+            sqlite_db: SqliteDatabase, read the stock from this instead of the csv file if given
+            thresholds_filepath: str, path to the optional csv file of reorder thresholds, see LowStockIndex
+            csv_cache: CsvCache, keep a binary copy of the parsed csv file so it's only parsed again when it changes
+        """
+        super().__init__()
+
+        self.STOCK_FILEPATH = stock_filepath
+        self.sqlite_db = sqlite_db
+        self.csv_cache = csv_cache
+        self.cache_stale = False # saved since the cache was written, see self.store_cache()
+        self.schema = DatabaseSchema()
+        self.invalid_stock = [] # (item_id, text) of the stock read which isn't a whole number
+
+        self.stock = pd.DataFrame()
+        self.file_signature = self.NO_SIGNATURE
+
+        #trigram index for searching, built at the first search after the stock is read and kept up to date on each save
+        self.search_index = SearchIndex()
+        self.search_index_built = False
+
+        #items needing reordering, found at the first lookup after the stock is read and kept up to date on each save
+        self.low_stock_index = LowStockIndex(thresholds_filepath)
+        self.low_stock_index_built = False
+
+        self.lock = threading.RLock()
+
+    def get_file_signature(self):
+        """
+        Returns:
+            tuple, (modification time in ns, size in bytes) of the stock file, or of the sqlite database file
+        """
+        stat = os.stat(self.STOCK_FILEPATH if self.sqlite_db is None else self.sqlite_db.FILEPATH)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    @instruments.timed('csv_read_stock')
+    def read_file(self):
+        """
+        Read the stock database, from its cache if the csv file hasn't changed since it was cached
+        The cache isn't kept of a file with invalid stock, which would hide it on the next read
+        """
+        self.schema.invalid_stock = []
+        if self.sqlite_db is not None:
+            return self.schema.type_stock(self.sqlite_db.read_stock())
+        if self.csv_cache is not None:
+            #typed again in case the cache was written before the schema
+            stock = self.schema.type_stock(self.csv_cache.read(self.STOCK_FILEPATH, self.parse_file))
+            if self.schema.invalid_stock:
+                self.csv_cache.discard(self.STOCK_FILEPATH)
+            return stock
+
+        return self.parse_file(self.STOCK_FILEPATH)
+
+    def parse_file(self, source):
+        """
+        Parse the stock csv file into a typed frame indexed by the upper case item_id
+
+        Arguments:
+            source: str or file-like, the csv file
+        """
+        return self.schema.read_stock(source)
+
+    def load(self):
+        """
+        Get the stock frame, only re-reading the file if it has changed on disk since it was last read or written
+        The returned frame is shared, copy it before making any changes
+
+        Returns:
+            pd.DataFrame, the stock database indexed by item_id
+        """
+        with self.lock:
+            signature = self.get_file_signature()
+            if signature != self.file_signature:
+                self.stock = self.read_file()
+                self.invalid_stock = self.schema.invalid_stock
+                self.file_signature = signature
+                self.search_index_built = False
+                self.low_stock_index_built = False
+                self.stock_changed.emit()
+                if self.invalid_stock:
+                    self.invalid_stock_found.emit(self.invalid_stock)
+
+            return self.stock
+
+    def get_invalid_stock(self):
+        """
+        Returns:
+            list of tuples, (item_id, text) of the stock which isn't a whole number, re-reading the file first in case it has been corrected
+        """
+        with self.lock:
+            self.load()
+            return list(self.invalid_stock)
+
+    def get_item(self, item_id):
+        """
+        Look up an item in the stock database
+
+        Arguments:
+            item_id: str, the upper case item id
+
+        Returns:
+            pd.Series, or pd.DataFrame if the id is not unique, empty pd.Series if the item is not found
+        """
+        stock = self.load()
+
+        try:
+            return stock.loc[item_id]
+        except KeyError:
+            return pd.Series(dtype=object)
+
+    @instruments.timed('csv_write_stock')
+    def save(self, stock):
+        """
+        Write the stock frame to file and keep it as the in-memory copy, so the next load doesn't re-read the file
+
+        Arguments:
+            stock: pd.DataFrame, the full stock database indexed by item_id
+
+        Raises:
+            PermissionError if the file can't be written, the in-memory copy is left unchanged
+            ValueError if the stock read has invalid stock, which would be saved over, see self.get_invalid_stock()
+        """
+        with self.lock:
+            if self.invalid_stock:
+                raise ValueError("The stock of {} isn't a whole number".format(", ".join(item_id for item_id, text in self.invalid_stock)))
+            stock.to_csv(self.STOCK_FILEPATH)
+            self.set_stock(stock)
+            self.cache_stale = True
+
+    def store_cache(self):
+        """
+        Cache the stock frame if it has been saved since it was last cached, called at closing rather than on every save to keep commits quick
+        """
+        with self.lock:
+            if self.csv_cache is None or not self.cache_stale or self.sqlite_db is not None or self.invalid_stock:
+                return
+            try:
+                #only if the file hasn't been changed outside the program since
+                if self.get_file_signature() == self.file_signature:
+                    self.csv_cache.store(self.STOCK_FILEPATH, self.stock)
+            except OSError as err:
+                print("Couldn't cache the stock database: {}".format(err))
+            self.cache_stale = False
+
+    def set_stock(self, stock):
+        """
+        Keep the stock frame as the in-memory copy after it has been saved elsewhere, e.g. by a sqlite transaction
+
+        Arguments:
+            stock: pd.DataFrame, the full stock database indexed by item_id
+        """
+        #typed again, rows added with new manufacturers or categories leave object columns
+        stock = self.schema.type_stock(stock)
+        with self.lock:
+            if self.search_index_built:
+                self.search_index.update(self.stock, stock)
+            if self.low_stock_index_built:
+                self.low_stock_index.update(self.stock, stock)
+            self.stock = stock
+            self.file_signature = self.get_file_signature()
+        self.stock_changed.emit()
+
+    def search(self, terms):
+        """
+        Find the items with any of the id, manufacturer, category or description fields containing any of the terms, case insensitive
+
+        Arguments:
+            terms: list of str
+
+        Returns:
+            pd.DataFrame, the matching rows of the stock database in file order
+        """
+        stock, search_index = self.get_search_index()
+
+        found = search_index.search(terms)
+
+        return stock[stock.index.isin(found)]
+
+    @instruments.timed('get_search_index')
+    def get_search_index(self):
+        """
+        Get the search index for the current stock, building it first if needed
+        The index is built without holding self.lock so lookups from the forms aren't blocked by a search on a worker thread
+
+        Returns:
+            tuple, (pd.DataFrame, SearchIndex) the stock database and its search index
+        """
+        with self.lock:
+            stock = self.load()
+            if self.search_index_built:
+                return stock, self.search_index
+
+        search_index = SearchIndex()
+        search_index.build(stock)
+
+        with self.lock:
+            #only keep the new index if the stock wasn't changed while it was being built
+            if self.stock is stock:
+                self.search_index = search_index
+                self.search_index_built = True
+
+        return stock, search_index
+
+    def get_low_stock_index(self):
+        """
+        Get the low stock index for the current stock, building it first if needed or if the thresholds file has been edited
+
+        Returns:
+            tuple, (pd.DataFrame, LowStockIndex) the stock database and its low stock index
+        """
+        with self.lock:
+            stock = self.load()
+            if not self.low_stock_index_built or self.low_stock_index.is_thresholds_changed():
+                with instruments.span('build_low_stock_index', rows=len(stock)):
+                    self.low_stock_index.build(stock)
+                self.low_stock_index_built = True
+
+            return stock, self.low_stock_index
+
+    def get_low_stock(self, count=None):
+        """
+        Arguments:
+            count: int, the number of items to return, read off the top of the index's heap without sorting the rest, all of them if None
+
+        Returns:
+            pd.DataFrame, the stock rows of the items needing reordering, the most short of their threshold first
+        """
+        stock, low_stock_index = self.get_low_stock_index()
+        item_ids = [item_id for item_id, shortfall in low_stock_index.get_low(count)]
+
+        return stock.loc[item_ids]
+
+    def get_low_stock_count(self):
+        """
+        Returns:
+            int, the number of items needing reordering
+        """
+        stock, low_stock_index = self.get_low_stock_index()
+        return low_stock_index.get_count()
+
+    def invalidate(self):
+        """
+        Force a re-read of the stock file at the next load, e.g. after the file has been overwritten from google drive
+        """
+        self.file_signature = self.NO_SIGNATURE
@@ -0,0 +1,225 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+import pandas as pd
+import numpy as np
+
+class StockTableModel(QAbstractTableModel):
+    """
+    Table model reading straight from the column arrays of stock frames, for showing search and low stock results in a QTableView
+
+    The view only asks for the cells that are visible, so any number of rows can be shown.
+    Rows streamed in from a search are kept as separate chunks so appending doesn't copy the rows already in the table,
+    the chunks are only joined when the table is sorted or saved.
+    Sorting only reorders self.order, an array of row positions, the rows themselves are never copied or rearranged.
+    Rows appended to a sorted table are sorted on their own and merged into self.order, the rows already shown aren't sorted again.
+    """
+    COLUMNS = ['item_id', 'manufacturer', 'category', 'stock', 'description'] # frame columns shown in the table
+    HEADERS = ["Item ID", "Manufacturer", "Category", "Stock", "Description"]
+    NO_SORT = -1
+    def __init__(self, columns=None, headers=None):
+        """
+        Arguments:
+            columns: list of str, frame columns to show instead of the stock COLUMNS, e.g. for the sales analytics
+            headers: list of str, the header of each of the columns
+        """
+        super().__init__()
+
+        if columns is not None:
+            self.COLUMNS = columns
+            self.HEADERS = headers
+
+        self.chunks = [] # list of lists of column arrays
+        self.offsets = np.array([], dtype=int) # first row position of each chunk
+        self.num_rows = 0
+        self.order = np.arange(0)
+        self.sort_keys = np.array([]) # sort column values in self.order, for merging in appended rows
+
+        self.sort_column = self.NO_SORT
+        self.sort_order = Qt.AscendingOrder
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.num_rows
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+
+        position = self.order[index.row()]
+        chunk = np.searchsorted(self.offsets, position, side='right') - 1
+        value = self.chunks[chunk][index.column()][position - self.offsets[chunk]]
+        if pd.isna(value):
+            return ''
+
+        return str(value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+
+        return str(section+1)
+
+    def get_arrays(self, frame):
+        """
+        Returns:
+            list of np.array, the columns of the frame shown in the table
+        """
+        return [frame[col].to_numpy() for col in self.COLUMNS]
+
+    def set_frame(self, frame):
+        """
+        Replace the data shown in the table
+
+        Arguments:
+            frame: pd.DataFrame, containing the columns in self.COLUMNS
+        """
+        self.beginResetModel()
+        self.chunks = [self.get_arrays(frame)]
+        self.offsets = np.array([0])
+        self.num_rows = len(frame)
+        self.order = np.arange(self.num_rows)
+        if self.sort_column != self.NO_SORT:
+            self.order, self.sort_keys = self.get_sort_order(self.sort_column, self.sort_order)
+        self.endResetModel()
+
+    def append_frame(self, frame):
+        """
+        Add rows to the data shown in the table, keeping the current sort
+
+        Arguments:
+            frame: pd.DataFrame, containing the columns in self.COLUMNS
+        """
+        if len(frame) == 0:
+            return
+
+        start = self.num_rows
+        arrays = self.get_arrays(frame)
+        if self.sort_column != self.NO_SORT:
+            #sort only the new rows and merge them in, so each chunk of a search costs about its own size
+            self.layoutAboutToBeChanged.emit()
+            self.chunks.append(arrays)
+            self.offsets = np.append(self.offsets, start)
+            self.num_rows += len(frame)
+            self.merge_order(pd.Series(arrays[self.sort_column]), start)
+            self.layoutChanged.emit()
+            return
+
+        self.beginInsertRows(QModelIndex(), start, start+len(frame)-1)
+        self.chunks.append(arrays)
+        self.offsets = np.append(self.offsets, start)
+        self.num_rows += len(frame)
+        self.order = np.arange(self.num_rows)
+        self.endInsertRows()
+
+    def merge_order(self, values, start):
+        """
+        Merge appended rows into the sorted self.order, after any rows already shown with the same value
+
+        Arguments:
+            values: pd.Series, the sort column of the appended rows
+            start: int, row position of the first appended row
+        """
+        text = self.sort_keys.dtype == object if len(self.sort_keys) > 0 else None
+        if text is False and values.infer_objects().dtype == object:
+            #text in a column sorted as numbers, sort the whole column again
+            self.order, self.sort_keys = self.get_sort_order(self.sort_column, self.sort_order)
+            return
+
+        keys = self.get_sort_keys(values, text)
+        new_order = self.argsort(keys, self.sort_order)
+        new_keys = keys[new_order]
+        if len(self.sort_keys) == 0:
+            positions = np.zeros(len(keys), dtype=int)
+        elif self.sort_order == Qt.DescendingOrder:
+            #after the rows shown with values at least as large
+            positions = len(self.sort_keys) - np.searchsorted(self.sort_keys[::-1], new_keys, side='left')
+        else:
+            positions = np.searchsorted(self.sort_keys, new_keys, side='right')
+
+        self.order = np.insert(self.order, positions, new_order + start)
+        self.sort_keys = np.insert(self.sort_keys, positions, new_keys) if len(self.sort_keys) > 0 else new_keys
+
+    def get_column(self, column):
+        """
+        Returns:
+            pd.Series, all the values in a column in row position order
+        """
+        if len(self.chunks) == 1:
+            return pd.Series(self.chunks[0][column], copy=False)
+
+        return pd.Series(np.concatenate([chunk[column] for chunk in self.chunks])) if self.chunks else pd.Series(dtype=object)
+
+    def join_chunks(self):
+        """
+        Join the streamed chunks into one set of column arrays
+        """
+        if len(self.chunks) > 1:
+            self.chunks = [[self.get_column(i).to_numpy() for i in range(len(self.COLUMNS))]]
+            self.offsets = np.array([0])
+
+    def get_sort_keys(self, values, text=None):
+        """
+        Arguments:
+            values: pd.Series, a column of the table
+            text: bool, sort the values as text, worked out from the values if None
+
+        Returns:
+            np.array, the values to sort by, text is lower case so it's sorted case insensitively
+        """
+        values = values.infer_objects()
+        if text or (text is None and values.dtype == object):
+            values = values.astype(object).fillna('').astype(str).str.lower()
+
+        return values.to_numpy()
+
+    def argsort(self, keys, order):
+        """
+        Returns:
+            np.array of positions sorting the keys, rows with the same value stay in row order whichever way they're sorted
+        """
+        if order == Qt.DescendingOrder:
+            #stable sort of the reversed keys, reversed back
+            return (len(keys) - 1 - np.argsort(keys[::-1], kind='stable'))[::-1]
+
+        return np.argsort(keys, kind='stable')
+
+    def get_sort_order(self, column, order):
+        """
+        Returns:
+            tuple of np.arrays, (the row positions sorted by the values in the given column, the sorted values)
+        """
+        if column == self.NO_SORT:
+            return np.arange(self.num_rows), np.array([])
+
+        keys = self.get_sort_keys(self.get_column(column))
+        sort_order = self.argsort(keys, order)
+
+        return sort_order, keys[sort_order]
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """
+        Sort the rows by a column, called by the QTableView when a header is clicked
+        """
+        self.sort_column = column
+        self.sort_order = order
+
+        self.layoutAboutToBeChanged.emit()
+        self.join_chunks()
+        self.order, self.sort_keys = self.get_sort_order(column, order)
+        self.layoutChanged.emit()
+
+    def get_frame(self):
+        """
+        Returns:
+            pd.DataFrame, the data in the table in the order it's shown
+        """
+        frame = pd.DataFrame({col:self.get_column(i) for i, col in enumerate(self.COLUMNS)}, columns=self.COLUMNS)
+
+        return frame.iloc[self.order].reset_index(drop=True)
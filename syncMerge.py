@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+
+class SyncMerge():
+    """
+    Three-way merge of the database files changed on this computer and, since the last sync, in google drive by another computer
+
+    Each merge takes the base, the copy of the file as it was in drive at the last sync, and the local and drive copies.
+    The changes each side made since the base are worked out and both applied, rather than one copy overwriting the other:
+        orders and stock adds are only appended to (or removed from the end by undo), so the rows added on either side are kept and the rows removed on either side are dropped
+        the stock of each item is the base stock plus the change made on each side, so the orders and stock adds from both computers are counted
+    Rows are compared by hashing all their columns at once, so a merge is a few vectorized operations however long the history.
+
+    All the frames are read with every column as text (dtype=str, keep_default_na=False), so rows compare exactly as they are written in the files.
+    A change made differently on both sides, e.g. an item's category edited on both computers, is a conflict: the local version is kept and a description returned for the user.
+    """
+    MISSING = np.uint64(0) # hash for a row missing from one side
+    OCCURRENCE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15) # mixes the occurrence of a repeated row into its hash
+    def get_row_hashes(self, frame, columns):
+        """
+        Arguments:
+            frame: pd.DataFrame, all text
+            columns: list of str, the columns to hash, missing ones are hashed as blank
+
+        Returns:
+            pd.Series of uint64, a hash of each row, with the index of frame
+        """
+        return pd.util.hash_pandas_object(frame.reindex(columns=columns, fill_value=''), index=False)
+
+    def get_row_keys(self, frame, columns):
+        """
+        Key each row by its hash and how many identical rows came before it, so repeated rows are each matched once
+
+        Returns:
+            pd.Series of uint64, with the index of frame
+        """
+        hashes = self.get_row_hashes(frame, columns)
+        occurrences = hashes.groupby(hashes.values).cumcount().values.astype(np.uint64)
+        #the uint64 multiply wraps around rather than overflowing
+        with np.errstate(over='ignore'):
+            return hashes ^ (occurrences*self.OCCURRENCE_MULTIPLIER)
+
+    def get_columns(self, *frames):
+        """
+        Returns:
+            list of str, the columns of all the frames, in the order they first appear
+        """
+        columns = []
+        for frame in frames:
+            columns += [col for col in frame.columns if col not in columns]
+        return columns
+
+    def get_numbers(self, column):
+        """
+        Arguments:
+            column: pd.Series of text, e.g. the order_ids
+
+        Returns:
+            pd.Series of the numbers for sorting, NaN for any text that isn't a number
+        """
+        try:
+            return column.astype(np.int64)
+        except ValueError:
+            return pd.to_numeric(column, errors='coerce')
+
+    def merge_rows(self, base, local, remote):
+        """
+        Merge an append-only file, e.g. the stock adds, keeping the base rows still on both sides and the rows added on either side
+
+        Arguments:
+            base, local, remote: pd.DataFrames, all text
+
+        Returns:
+            pd.DataFrame, the base rows left, then the local then the remote rows added, with the columns of all three
+        """
+        columns = self.get_columns(local, remote, base)
+        base_keys = self.get_row_keys(base, columns)
+        local_keys = self.get_row_keys(local, columns)
+        remote_keys = self.get_row_keys(remote, columns)
+
+        kept = base[(base_keys.isin(local_keys) & base_keys.isin(remote_keys)).values]
+        local_new = ~local_keys.isin(base_keys)
+        local_added = local[local_new.values]
+        #the same row added on both sides, e.g. a merge already uploaded, is only kept once
+        remote_added = remote[(~remote_keys.isin(base_keys) & ~remote_keys.isin(local_keys[local_new])).values]
+
+        merged = pd.concat([kept, local_added, remote_added], ignore_index=True)
+        return merged.reindex(columns=columns).fillna('')
+
+    def get_order_hashes(self, headers, lines, header_columns, line_columns):
+        """
+        Hash each order together with its lines
+
+        Returns:
+            pd.Series of uint64 indexed by order_id
+        """
+        header_hashes = pd.Series(self.get_row_hashes(headers, header_columns).values, index=headers.order_id.values)
+        line_hashes = pd.Series(self.get_row_hashes(lines, line_columns).values, index=lines.order_id.values)
+        #summing the line hashes doesn't depend on the order the lines are in, the uint64 sum wraps around rather than overflowing
+        line_hashes = line_hashes.groupby(level=0).sum()
+
+        order_ids = header_hashes.index.union(line_hashes.index, sort=False)
+        return header_hashes.reindex(order_ids, fill_value=0) + line_hashes.reindex(order_ids, fill_value=0)
+
+    def merge_orders(self, base, local, remote):
+        """
+        Merge the orders, each order taken as its header and lines together
+
+        An order added on both sides with the same order_id is two different orders, the local one is given the next free order_id and listed with the conflicts.
+        An order changed or removed on one side is taken from that side, changed differently on both sides is a conflict.
+
+        Arguments:
+            base, local, remote: tuples of pd.DataFrames, (headers, lines), all text
+
+        Returns:
+            tuple, (pd.DataFrame of headers, pd.DataFrame of lines, list of str conflict descriptions)
+        """
+        header_columns = self.get_columns(local[0], remote[0], base[0])
+        line_columns = self.get_columns(local[1], remote[1], base[1])
+
+        hashes = {side:self.get_order_hashes(headers, lines, header_columns, line_columns) for side, (headers, lines) in [('base', base), ('local', local), ('remote', remote)]}
+        order_ids = hashes['local'].index.union(hashes['remote'].index, sort=False).union(hashes['base'].index, sort=False)
+        hashes = pd.DataFrame({side:side_hashes.reindex(order_ids, fill_value=0) for side, side_hashes in hashes.items()})
+        b, l, r = hashes.base, hashes.local, hashes.remote
+
+        #which side each order is taken from, checked in order so the first that applies wins
+        source = pd.Series(np.select([l == r, l == b, r == b, b == self.MISSING],
+                                     ['local', 'remote', 'local', 'both'],
+                                     default='conflict'), index=hashes.index)
+
+        conflicts = []
+        for order_id in source.index[source == 'conflict']:
+            if l[order_id] == self.MISSING:
+                conflicts.append("Order {} was removed on this computer and changed on another, the other computer's order has been kept".format(order_id))
+                source[order_id] = 'remote'
+            else:
+                kept = "removed on another" if r[order_id] == self.MISSING else "changed differently on another"
+                conflicts.append("Order {0} was changed on this computer and {1}, this computer's order has been kept".format(order_id, kept))
+                source[order_id] = 'local'
+
+        #orders added on both sides under the same order_id, the local one moves to the end
+        renumber = source.index[source == 'both']
+        order_numbers = self.get_numbers(pd.Series(hashes.index))
+        first_id = int(order_numbers.max()) + 1 if order_numbers.notna().any() else 1
+        new_ids = {order_id:str(first_id + i) for i, order_id in enumerate(sorted(renumber, key=lambda order_id: pd.to_numeric(order_id, errors='coerce')))}
+        for order_id, new_id in new_ids.items():
+            conflicts.append("Order {0} was added on both computers, this computer's order has been renumbered to {1}".format(order_id, new_id))
+
+        take = {'local':source.index[source.isin(['local', 'both'])],
+                'remote':source.index[source.isin(['remote', 'both'])]}
+        headers = []
+        lines = []
+        for side, (side_headers, side_lines) in [('local', local), ('remote', remote)]:
+            side_headers = side_headers[side_headers.order_id.isin(take[side])]
+            side_lines = side_lines[side_lines.order_id.isin(take[side])]
+            if side == 'local' and new_ids:
+                side_headers = side_headers.assign(order_id=side_headers.order_id.replace(new_ids))
+                side_lines = side_lines.assign(order_id=side_lines.order_id.replace(new_ids))
+            headers.append(side_headers)
+            lines.append(side_lines)
+
+        headers = pd.concat(headers, ignore_index=True).reindex(columns=header_columns, fill_value='')
+        lines = pd.concat(lines, ignore_index=True).reindex(columns=line_columns, fill_value='')
+
+        #back into order_id order, the lines in item order within each order
+        headers = headers.iloc[self.get_numbers(headers.order_id).argsort(kind='stable')]
+        lines = lines.assign(sort_id=self.get_numbers(lines.order_id), sort_num=self.get_numbers(lines.item_num))
+        lines = lines.sort_values(['sort_id', 'sort_num'], kind='stable').drop(columns=['sort_id', 'sort_num'])
+
+        return headers.reset_index(drop=True), lines.reset_index(drop=True), conflicts
+
+    def get_item_keys(self, frame):
+        """
+        Key each stock row by its item_id and how many rows with the same item_id came before it, so repeated item ids are each merged as their own row
+
+        Returns:
+            pd.DataFrame, indexed by (item_id, occurrence)
+        """
+        return frame.set_index([frame.item_id, frame.groupby('item_id').cumcount().rename('occurrence')]).drop(columns='item_id')
+
+    def get_item_name(self, key):
+        """
+        Arguments:
+            key: tuple, (item_id, occurrence)
+
+        Returns:
+            str, the item id, with which of its rows for a repeated item id
+        """
+        item_id, occurrence = key
+        return item_id if occurrence == 0 else "{0} (row {1} with this id)".format(item_id, occurrence + 1)
+
+    def merge_stock(self, base, local, remote):
+        """
+        Merge the stock, adding up the change in stock of each item made on each side
+
+        The other columns, e.g. the category, are taken from the side that changed them.
+        An item removed on one side is removed unless the other side changed it.
+        An item id on more than one row is merged row by row, the first row with the id on each side with each other and so on.
+
+        Arguments:
+            base, local, remote: pd.DataFrames with an item_id column, all text
+
+        Returns:
+            tuple, (pd.DataFrame, the merged stock with an item_id column; list of str conflict descriptions)
+        """
+        columns = self.get_columns(local, remote, base)
+        value_columns = [col for col in columns if col != 'item_id']
+        sides = [self.get_item_keys(frame).reindex(columns=value_columns) for frame in (base, local, remote)]
+        items = sides[1].index.append(sides[2].index).append(sides[0].index).drop_duplicates()
+        in_base, in_local, in_remote = [items.isin(side.index) for side in sides]
+        b, l, r = [side.reindex(items).fillna('') for side in sides]
+
+        conflicts = []
+
+        #items removed on one side and not changed on the other are dropped
+        local_unchanged = (l == b).all(axis=1).values
+        remote_unchanged = (r == b).all(axis=1).values
+        removed = in_base & ((~in_local & (~in_remote | remote_unchanged)) | (~in_remote & (~in_local | local_unchanged)))
+        for key in items[in_base & ~removed & (~in_local | ~in_remote)]:
+            conflicts.append("{} was removed on one computer and changed on the other, it has been kept".format(self.get_item_name(key)))
+        #a removed item stands in as its base row, so the other side's changes are kept
+        l.loc[~in_local & in_base] = b.loc[~in_local & in_base]
+        r.loc[~in_remote & in_base] = b.loc[~in_remote & in_base]
+
+        #each other column from the side that changed it
+        local_changed = l != b
+        merged = l.where(local_changed, r)
+        clashes = local_changed & (r != b) & (l != r)
+        if 'stock' in clashes.columns:
+            clashes['stock'] = False
+        for item, col in zip(*np.nonzero(clashes.values)):
+            conflicts.append("The {0} of {1} was changed on both computers, this computer's value '{2}' has been kept over '{3}'".format(clashes.columns[col], self.get_item_name(items[item]), l.iat[item, col], r.iat[item, col]))
+
+        #the stock changes from both sides
+        if 'stock' in merged.columns:
+            stock = [pd.to_numeric(side.stock, errors='coerce').fillna(0).values for side in (b, l, r)]
+            stock = stock[1] + stock[2] - stock[0]
+            for item in np.nonzero((stock < 0) & ~removed)[0]:
+                conflicts.append("The stock of {0} is {1} after adding the orders from both computers".format(self.get_item_name(items[item]), int(stock[item])))
+            merged['stock'] = stock.astype(int).astype(str)
+
+        merged = merged[~removed]
+
+        return merged.reset_index().drop(columns='occurrence').reindex(columns=columns), conflicts
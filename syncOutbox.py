@@ -0,0 +1,73 @@
+import json
+import os
+
+class SyncOutbox():
+    """
+    The database files with committed changes still to be uploaded to google drive
+
+    Kept in a json file, so changes made while offline are uploaded by a later session once drive can be reached.
+    Each file has a version number which goes up every time it's added, so an upload only clears a file from the outbox
+    if it wasn't changed again while it was being uploaded.
+    """
+    def __init__(self, filepath):
+        """
+        Arguments:
+            filepath: str, path to the outbox file
+        """
+        self.FILEPATH = filepath
+
+        self.pending = {} # filename: version
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.FILEPATH, 'r', encoding='utf-8') as f:
+                self.pending = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.pending = {}
+
+    def save(self):
+        """
+        Write the outbox, to a temporary file first so it's never left half written
+        """
+        temp_filepath = self.FILEPATH + '.tmp'
+        try:
+            with open(temp_filepath, 'w', encoding='utf-8') as f:
+                json.dump(self.pending, f)
+            os.replace(temp_filepath, self.FILEPATH)
+        except PermissionError as err:
+            print("Couldn't save the sync outbox: {}".format(err))
+
+    def add(self, files):
+        """
+        Add files which have been changed
+
+        Arguments:
+            files: list of filenames
+        """
+        for filename in files:
+            self.pending[filename] = self.pending.get(filename, 0) + 1
+        self.save()
+
+    def get_pending(self):
+        """
+        Returns:
+            dict, filename: version of each file waiting to be uploaded
+        """
+        return dict(self.pending)
+
+    def remove(self, uploaded):
+        """
+        Clear uploaded files, unless they have been added again since
+
+        Arguments:
+            uploaded: dict, filename: version when the upload started, from self.get_pending()
+        """
+        for filename, version in uploaded.items():
+            if self.pending.get(filename) == version:
+                del self.pending[filename]
+        self.save()
+
+    def __len__(self):
+        return len(self.pending)
@@ -0,0 +1,115 @@
+import os
+import sys
+import unittest
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from syncMerge import SyncMerge
+
+STOCK_COLUMNS = ['item_id', 'manufacturer', 'category', 'stock', 'description']
+HEADER_COLUMNS = ['order_id', 'postcode', 'date', 'order_amount']
+LINE_COLUMNS = ['order_id', 'item_num', 'item_id', 'quantity']
+
+class TestMergeStock(unittest.TestCase):
+    def setUp(self):
+        self.merge = SyncMerge()
+        self.base = pd.DataFrame([
+            ['MAVIC23', 'mavic', 'spoke key', '298', 'main key type'],
+            ['MAVICCOMP244', 'mavic', 'spoke', '10', ''],
+            ['MAVICCOMP246', 'Mavic', 'Competition', '67', ''],
+            ['MAVICCOMP244', 'mavic', '', '10', ''],
+            ['MAVIC23', 'mavic', 'spoke key', '298', 'extra key type'],
+            ], columns=STOCK_COLUMNS)
+
+    def test_repeated_item_ids_are_kept(self):
+        local = self.base.copy()
+        local.loc[2, 'stock'] = '60'
+        merged, conflicts = self.merge.merge_stock(self.base, local, self.base.copy())
+
+        self.assertEqual(merged.values.tolist(), local.values.tolist())
+        self.assertEqual(conflicts, [])
+
+    def test_repeated_item_ids_are_merged_row_by_row(self):
+        local = self.base.copy()
+        local.loc[4, 'stock'] = '297'
+        remote = self.base.copy()
+        remote.loc[0, 'stock'] = '290'
+        remote.loc[4, 'stock'] = '296'
+        merged, conflicts = self.merge.merge_stock(self.base, local, remote)
+
+        self.assertEqual(merged.stock.tolist(), ['290', '10', '67', '10', '295'])
+        self.assertEqual(merged.description.tolist(), self.base.description.tolist())
+        self.assertEqual(conflicts, [])
+
+    def test_repeated_item_id_clash_names_the_row(self):
+        local = self.base.copy()
+        local.loc[4, 'description'] = 'local'
+        remote = self.base.copy()
+        remote.loc[4, 'description'] = 'remote'
+        merged, conflicts = self.merge.merge_stock(self.base, local, remote)
+
+        self.assertEqual(merged.description.iloc[4], 'local')
+        self.assertEqual(len(conflicts), 1)
+        self.assertIn('MAVIC23 (row 2 with this id)', conflicts[0])
+
+    def test_removed_and_changed_item_is_kept(self):
+        local = self.base.drop(index=2).reset_index(drop=True)
+        remote = self.base.copy()
+        remote.loc[2, 'category'] = 'Spoke'
+        merged, conflicts = self.merge.merge_stock(self.base, local, remote)
+
+        self.assertIn('MAVICCOMP246', merged.item_id.tolist())
+        self.assertEqual(merged.set_index('item_id').loc['MAVICCOMP246', 'category'], 'Spoke')
+        self.assertEqual(len(conflicts), 1)
+        self.assertIn('MAVICCOMP246 was removed on one computer and changed on the other', conflicts[0])
+
+    def test_removed_and_unchanged_item_is_dropped(self):
+        local = self.base.drop(index=2).reset_index(drop=True)
+        merged, conflicts = self.merge.merge_stock(self.base, local, self.base.copy())
+
+        self.assertNotIn('MAVICCOMP246', merged.item_id.tolist())
+        self.assertEqual(len(merged), 4)
+        self.assertEqual(conflicts, [])
+
+class TestMergeOrders(unittest.TestCase):
+    def setUp(self):
+        self.merge = SyncMerge()
+        self.base = (pd.DataFrame([['1', 'M15 9PL', '17/07/2020', '14.0']], columns=HEADER_COLUMNS),
+                     pd.DataFrame([['1', '1', 'MAVICCOMP250', '2']], columns=LINE_COLUMNS))
+
+    def add_order(self, side, header, lines):
+        headers, side_lines = side
+        return (pd.concat([headers, pd.DataFrame([header], columns=HEADER_COLUMNS)], ignore_index=True),
+                pd.concat([side_lines, pd.DataFrame(lines, columns=LINE_COLUMNS)], ignore_index=True))
+
+    def test_order_added_on_both_is_renumbered(self):
+        local = self.add_order(self.base, ['2', 'A1', '18/07/2020', '5.0'], [['2', '1', 'MAVICCOMP246', '1']])
+        remote = self.add_order(self.base, ['2', 'B2', '18/07/2020', '7.0'], [['2', '1', 'MAVICCOMP242', '3']])
+        headers, lines, conflicts = self.merge.merge_orders(self.base, local, remote)
+
+        self.assertEqual(headers[['order_id', 'postcode']].values.tolist(), [['1', 'M15 9PL'], ['2', 'B2'], ['3', 'A1']])
+        self.assertEqual(lines[['order_id', 'item_id']].values.tolist(), [['1', 'MAVICCOMP250'], ['2', 'MAVICCOMP242'], ['3', 'MAVICCOMP246']])
+        self.assertEqual(len(conflicts), 1)
+        self.assertIn('Order 2 was added on both computers', conflicts[0])
+        self.assertIn('renumbered to 3', conflicts[0])
+
+    def test_order_removed_and_changed_keeps_the_change(self):
+        local = (self.base[0].iloc[:0], self.base[1].iloc[:0])
+        remote = (self.base[0].assign(order_amount='15.0'), self.base[1])
+        headers, lines, conflicts = self.merge.merge_orders(self.base, local, remote)
+
+        self.assertEqual(headers.order_amount.tolist(), ['15.0'])
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(len(conflicts), 1)
+        self.assertIn('Order 1 was removed on this computer and changed on another', conflicts[0])
+
+    def test_orders_added_on_each_side_are_both_kept(self):
+        local = self.add_order(self.base, ['2', 'A1', '18/07/2020', '5.0'], [['2', '1', 'MAVICCOMP246', '1']])
+        remote = self.add_order(local, ['3', 'B2', '19/07/2020', '7.0'], [['3', '1', 'MAVICCOMP242', '3']])
+        headers, lines, conflicts = self.merge.merge_orders(self.base, local, remote)
+
+        self.assertEqual(headers.order_id.tolist(), ['1', '2', '3'])
+        self.assertEqual(conflicts, [])
+
+if __name__ == '__main__':
+    unittest.main()